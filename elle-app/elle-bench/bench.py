@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""Benchmarks for the HAL and display servers, runnable without LinuxCNC.
+
+The stand-in hal, linuxcnc, gcode and rs274 modules in fakes/ are put in
+front of sys.path before the servers are imported, and requests go through
+the Flask test client, so the numbers measure our own code rather than the
+network or the controller. Inputs are fixed or seeded, and each benchmark
+reports the best and median of several timed samples with the garbage
+collector disabled.
+
+    ./bench.py                       run everything
+    ./bench.py --filter tojson       run benchmarks whose name contains tojson
+    ./bench.py --json after.json     also write the results as JSON
+    ./bench.py --compare before.json show the change against earlier results
+
+Exits with status 1 when a benchmark in CHECKS is slower than allowed.
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+HAL_DIR = os.path.join(os.path.dirname(BENCH_DIR), "elle-hal")
+FAKES_DIR = os.path.join(BENCH_DIR, "fakes")
+
+START_DIR = os.getcwd()
+sys.path[:0] = [FAKES_DIR, HAL_DIR]
+# The servers read lathe.ini and write canned cycle files relative to cwd
+os.chdir(HAL_DIR)
+os.environ.setdefault("ELLE_BACKPLOT_WORKERS", "0")
+
+import numpy as np  # noqa: E402
+from cycle_params import THREADING_PARAMS, TURNING_PARAMS  # noqa: E402
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import hal  # noqa: E402
+    import lathe_cycles  # noqa: E402
+    import lathe_halcomp  # noqa: E402
+    import lathe_display  # noqa: E402
+    import rs274.glcanon  # noqa: E402
+
+SEED = 1234
+SAMPLES = 7
+
+# (benchmark, reference, factor): benchmark must not take longer than factor
+# times reference. Both run in the same session, so a slow machine slows
+# down both. Decimation emits fewer moves and should cost about the same as
+# the full backplot, while a per-polyline Python loop took five times as long
+CHECKS = [
+    (f"tojson_{size}_tolerance", f"tojson_{size}", 1.5) for size in (10000, 100000)
+]
+
+
+def measure(function, number, samples):
+    """Best and median seconds per call over samples runs of number calls"""
+    function()
+    times = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(samples):
+            started = time.perf_counter()
+            for _ in range(number):
+                function()
+            times.append((time.perf_counter() - started) / number)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    times.sort()
+    return {"best": times[0], "median": times[len(times) // 2], "number": number}
+
+
+def synthetic_canon(segments, seed=SEED):
+    """Canon with a lathe-like toolpath of the given number of feed segments.
+
+    Every line is an 8 segment polyline, with a connecting traverse and a
+    dwell every 50 lines, in inches like the interpreter reports them."""
+    rng = np.random.default_rng(seed)
+    canon = rs274.glcanon.GLCanon(None, "XZ")
+    lines = segments // 8
+    radius = 0.5 + rng.random(lines).cumsum() / lines
+    for line in range(lines):
+        z = np.linspace(0.0, -2.0, 9)
+        x = radius[line] + 0.01 * np.sin(np.linspace(0, np.pi, 9) + line)
+        points = [(float(x[i]), 0.0, float(z[i])) for i in range(9)]
+        for start, end in zip(points, points[1:]):
+            canon.feed.append((line + 1, start, end, 0.0656, (0.0, 0.0, 0.0)))
+        canon.traverse.append((line + 1, points[-1], points[0], (0.0, 0.0, 0.0)))
+        if line % 50 == 0:
+            canon.dwells.append((line + 1, None, points[0][0], 0.0, points[0][2], 0))
+    return canon
+
+
+def benchmarks(quick):
+    halcomp = lathe_halcomp.app.test_client()
+    display = lathe_display.app.test_client()
+    lathe = hal.components["lathe"]
+    sizes = (10000,) if quick else (10000, 100000)
+
+    def hal_in_poll():
+        lathe["position_z"] += 0.001
+        halcomp.get("/hal/hal_in")
+
+    jog = {"control_z_type": 1, "velocity_z_cmd": 0.0}
+
+    def hal_out_jog_single():
+        jog["velocity_z_cmd"] += 0.1
+        halcomp.put("/hal/hal_out", json=jog)
+
+    def hal_out_jog_burst():
+        burst = []
+        for _ in range(10):
+            jog["velocity_z_cmd"] += 0.1
+            burst.append(dict(jog))
+        halcomp.put("/hal/hal_out", json=burst)
+
+    def build(kind, params):
+        build_program = lathe_cycles.CYCLE_PREVIEWS[kind][1]
+        return lambda: build_program(params, for_backplot=True)
+
+    def cycle_backplot(kind, params):
+        build_program = lathe_cycles.CYCLE_PREVIEWS[kind][1]
+        return lambda: build_program(params, for_backplot=True).backplot()
+
+    def generate_endpoint(kind, params):
+        return lambda: halcomp.put(f"/hal/{kind}/generate", json=params)
+
+    def endpoint(path, params):
+        return lambda: halcomp.put(f"/hal/{path}", json=params)
+
+    def batch_endpoint(kind, params, swept):
+        # 64 sets sweeping one parameter from half to one and a half times its value
+        sets = [dict(params, **{swept: params[swept] * (0.5 + i / 64)}) for i in range(64)]
+        return lambda: halcomp.put(f"/hal/{kind}/batch", json=sets)
+
+    yield "hal_in_state", lathe_halcomp.hal_in_state, 2000
+    yield "hal_in_poll", hal_in_poll, 500
+    yield "hal_out_jog_single", hal_out_jog_single, 500
+    yield "hal_out_jog_burst_10", hal_out_jog_burst, 200
+    yield "threading_build", build("threading", THREADING_PARAMS), 200
+    yield "turning_build", build("turning", TURNING_PARAMS), 200
+    yield "threading_backplot", cycle_backplot("threading", THREADING_PARAMS), 100
+    yield "turning_backplot", cycle_backplot("turning", TURNING_PARAMS), 100
+    yield "threading_generate_cached", generate_endpoint("threading", THREADING_PARAMS), 500
+    yield "turning_generate_cached", generate_endpoint("turning", TURNING_PARAMS), 500
+    yield "threading_batch_64", batch_endpoint("threading", THREADING_PARAMS, "FirstCut"), 20
+    yield "turning_batch_64", batch_endpoint("turning", TURNING_PARAMS, "StepDown"), 20
+    yield "threading_estimate", endpoint("threading/estimate", THREADING_PARAMS), 200
+    yield "turning_estimate", endpoint("turning/estimate", TURNING_PARAMS), 200
+    yield "threading_optimize", endpoint("threading/optimize", dict(THREADING_PARAMS, MaxChipArea=0.05)), 20
+    yield "turning_optimize", endpoint("turning/optimize", dict(TURNING_PARAMS, MaxCut=1.0)), 100
+
+    generator = lathe_display.get_backplot_generator()
+    canons = {}
+
+    def with_canon(size, function):
+        def run():
+            if size not in canons:
+                canons[size] = synthetic_canon(size)
+            generator.canon = canons[size]
+            return function()
+        return run
+
+    for size in sizes:
+        number = max(1, 100000 // size)
+        yield f"tojson_{size}", with_canon(size, generator.toJson), number
+        yield f"tojson_{size}_tolerance", with_canon(size, lambda: generator.toJson(0.01)), number
+        yield f"tobinary_{size}", with_canon(size, generator.toBinary), number
+
+    yield "metrics_prometheus", lambda: display.get("/metrics"), 200
+
+
+def metadata():
+    try:
+        revision = subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            capture_output=True, text=True, cwd=BENCH_DIR,
+        ).stdout.strip()
+    except OSError:
+        revision = None
+    return {
+        "revision": revision,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "seed": SEED,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--filter", default="", help="only run benchmarks containing this")
+    parser.add_argument("--samples", type=int, default=SAMPLES)
+    parser.add_argument("--quick", action="store_true", help="skip the largest inputs")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="compare against results written with --json")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(os.path.join(START_DIR, args.compare)) as f:
+            baseline = json.load(f)["results"]
+
+    results = {}
+    print(f"{'benchmark':32} {'best':>12} {'median':>12} {'ops/s':>10}")
+    for name, function, number in benchmarks(args.quick):
+        if args.filter not in name:
+            continue
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = measure(function, number, args.samples)
+        results[name] = result
+        line = (
+            f"{name:32} {result['best'] * 1e6:10.1f}us {result['median'] * 1e6:10.1f}us"
+            f" {1 / result['median']:10.0f}"
+        )
+        if baseline and name in baseline:
+            change = result["median"] / baseline[name]["median"] - 1
+            line += f" {change:+8.1%}"
+        print(line, flush=True)
+
+    if args.json:
+        with open(os.path.join(START_DIR, args.json), "w") as f:
+            json.dump({"meta": metadata(), "results": results}, f, indent=2)
+
+    failed = False
+    for name, reference, factor in CHECKS:
+        if name in results and reference in results:
+            ratio = results[name]["best"] / results[reference]["best"]
+            if ratio > factor:
+                print(f"FAIL {name} took {ratio:.2f}x {reference}, allowed {factor:.2f}x")
+                failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
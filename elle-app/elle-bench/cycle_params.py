@@ -0,0 +1,17 @@
+"""Canned cycle parameters shared by the benchmarks and the tests.
+
+Both are typical jobs for the lathe: a M10x1.5 external thread and a
+turning pass from 25mm stock down to 10mm.
+"""
+
+THREADING_PARAMS = {
+    "XStart": 10.0, "ZStart": 2.0, "Pitch": 1.5, "XDepth": -0.92, "ZDepth": -0.53,
+    "XEnd": 10.0, "ZEnd": -40.0, "XPullout": 1.0, "ZPullout": -1.0,
+    "FirstCut": 0.3, "CutMult": 0.8, "MinCut": 0.02, "SpringCuts": 2,
+    "XReturn": 15.0, "ZReturn": 5.0,
+}
+TURNING_PARAMS = {
+    "Pitch": 0.1, "Stock": 25.0, "Target": 10.0, "ZLead": 1.0, "ZEnd": -60.0,
+    "Angle": 0.0, "StepDown": 0.25, "FinalStepDown": 0.05, "SpringPasses": 1,
+    "XReturn": 30.0, "ZReturn": 5.0,
+}
@@ -0,0 +1,54 @@
+"""Stand-in for the LinuxCNC gcode module.
+
+parse() understands just enough G-code for previews: G0, G1 and G33 straight
+moves, G4 dwells, G20/G21 units and comments. Like the real interpreter it
+reports positions to the canon in inches.
+"""
+import re
+
+MIN_ERROR = 3
+
+WORD = re.compile(r"([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))")
+MOTION = {0: "straight_traverse", 1: "straight_feed", 33: "straight_feed"}
+
+
+def parse(filename, canon, unitcode, initcode):
+    position = [0.0] * 9
+    # Program units per inch
+    units = 25.4
+    motion = None
+    with open(filename) as f:
+        lines = f.read().splitlines()
+    for line in (unitcode, initcode):
+        if "G20" in line.upper():
+            units = 1.0
+    for lineno, line in enumerate(lines, 1):
+        line = re.sub(r"\(.*?\)|;.*", "", line.upper())
+        words = WORD.findall(line)
+        if not words:
+            continue
+        canon.next_line(lineno)
+        axes = {}
+        dwell = False
+        for letter, value in words:
+            value = float(value)
+            if letter == "G":
+                if value == 20:
+                    units = 1.0
+                elif value == 21:
+                    units = 25.4
+                elif value == 4:
+                    dwell = True
+                elif value in MOTION:
+                    motion = MOTION[value]
+            elif letter == "F":
+                canon.set_feed_rate(value / units)
+            elif letter in "XYZ":
+                axes["XYZ".index(letter)] = value / units
+        if dwell:
+            canon.dwell(*position[:3])
+        elif axes and motion is not None:
+            for axis, value in axes.items():
+                position[axis] = value
+            getattr(canon, motion)(*position)
+    return 0, len(lines)
@@ -0,0 +1,71 @@
+"""Stand-in for the LinuxCNC hal module.
+
+Pins are plain Python values. Components are registered in `components` by
+name so a benchmark or test can drive input pins, e.g.
+hal.components["lathe"]["position_z"] = 12.5
+
+Output pins of ready components count as linked, as if the .hal file had
+netted them all.
+"""
+
+HAL_BIT = 1
+HAL_FLOAT = 2
+HAL_S32 = 3
+HAL_U32 = 4
+
+HAL_IN = 16
+HAL_OUT = 32
+HAL_IO = HAL_IN | HAL_OUT
+
+components = {}
+
+
+class Pin:
+    def __init__(self, name, pin_type, direction):
+        self.name = name
+        self.pin_type = pin_type
+        self.direction = direction
+        self.value = False if pin_type == HAL_BIT else 0
+        self.writes = 0
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+        self.writes += 1
+
+
+class component:
+    def __init__(self, name):
+        self.name = name
+        self.pins = {}
+        self.is_ready = False
+        components[name] = self
+
+    def newpin(self, name, pin_type, direction):
+        pin = Pin(name, pin_type, direction)
+        self.pins[name] = pin
+        return pin
+
+    def ready(self):
+        self.is_ready = True
+
+    def exit(self):
+        components.pop(self.name, None)
+
+    def __getitem__(self, name):
+        return self.pins[name].get()
+
+    def __setitem__(self, name, value):
+        self.pins[name].value = value
+
+
+def get_info_signals():
+    return [
+        {"NAME": f"{name}-{pin.name}", "VALUE": pin.value, "DRIVER": f"{name}.{pin.name}"}
+        for name, comp in components.items()
+        if comp.is_ready
+        for pin in comp.pins.values()
+        if pin.direction & HAL_OUT
+    ]
@@ -0,0 +1,110 @@
+"""Stand-in for the LinuxCNC linuxcnc module.
+
+The simulated machine is on, homed and idle in MDI mode. command() calls are
+recorded in `commands` and update `machine`, which stat.poll() copies, so
+precondition loops see the state change the way they would on a real
+controller.
+"""
+import time
+
+STATE_ESTOP = 1
+STATE_ESTOP_RESET = 2
+STATE_OFF = 3
+STATE_ON = 4
+
+MODE_MANUAL = 1
+MODE_AUTO = 2
+MODE_MDI = 3
+
+INTERP_IDLE = 1
+INTERP_READING = 2
+INTERP_PAUSED = 3
+INTERP_WAITING = 4
+
+EXEC_ERROR = 1
+EXEC_DONE = 2
+EXEC_WAITING_FOR_MOTION = 3
+EXEC_WAITING_FOR_MOTION_QUEUE = 4
+EXEC_WAITING_FOR_IO = 5
+
+RCS_DONE = 1
+RCS_EXEC = 2
+RCS_ERROR = 3
+
+machine = {
+    "estop": 0,
+    "enabled": True,
+    "homed": (1, 1, 0, 0, 0, 0, 0, 0, 0),
+    "interp_state": INTERP_IDLE,
+    "exec_state": EXEC_DONE,
+    "call_level": 0,
+    "task_mode": MODE_MDI,
+    "task_state": STATE_ON,
+    "motion_line": 0,
+    "axis_mask": 0b101,
+    "echo_serial_number": 0,
+    "state": RCS_DONE,
+}
+commands = []
+polls = 0
+
+
+class stat:
+    def __init__(self):
+        self.__dict__.update(machine)
+
+    def poll(self):
+        global polls
+        polls += 1
+        self.__dict__.update(machine)
+
+
+class command:
+    def _record(self, name, *args):
+        commands.append((time.monotonic(), name, args))
+        machine["echo_serial_number"] += 1
+        return RCS_DONE
+
+    def state(self, state):
+        machine["task_state"] = state
+        machine["estop"] = int(state == STATE_ESTOP)
+        machine["enabled"] = state == STATE_ON
+        return self._record("state", state)
+
+    def mode(self, mode):
+        machine["task_mode"] = mode
+        return self._record("mode", mode)
+
+    def mdi(self, text):
+        return self._record("mdi", text)
+
+    def abort(self):
+        machine["interp_state"] = INTERP_IDLE
+        machine["exec_state"] = EXEC_DONE
+        machine["call_level"] = 0
+        return self._record("abort")
+
+    def reset_interpreter(self):
+        return self._record("reset_interpreter")
+
+    def wait_complete(self, timeout=5.0):
+        return self._record("wait_complete", timeout)
+
+
+class ini:
+    """INI reader returning the first value of a key, like linuxcnc.ini"""
+
+    def __init__(self, path):
+        self.sections = {}
+        section = None
+        with open(path) as f:
+            for line in f:
+                line = line.split("#", 1)[0].strip()
+                if line.startswith("[") and "]" in line:
+                    section = self.sections.setdefault(line[1:line.index("]")], {})
+                elif "=" in line and section is not None:
+                    key, value = line.split("=", 1)
+                    section.setdefault(key.strip(), value.strip())
+
+    def find(self, section, key):
+        return self.sections.get(section, {}).get(key)
@@ -0,0 +1,46 @@
+"""Stand-in for rs274.glcanon, recording moves like the real GLCanon"""
+import gcode
+
+
+class GLCanon:
+    def __init__(self, colors, geometry):
+        self.colors = colors
+        self.geometry = geometry
+        self.feed = []
+        self.arcfeed = []
+        self.traverse = []
+        self.dwells = []
+        self.lineno = 0
+        self.feedrate = 1.0
+        self.first_move = True
+        self.lo = (0.0,) * 9
+        self.tool_offset = (0.0, 0.0, 0.0)
+
+    def next_line(self, st):
+        self.lineno = st
+
+    def set_feed_rate(self, arg):
+        self.feedrate = arg / 60.0
+
+    def straight_traverse(self, *position):
+        # Traverses before the first feed are not drawn
+        if not self.first_move:
+            self.traverse.append((self.lineno, self.lo, position, self.tool_offset))
+        self.lo = position
+
+    def straight_feed(self, *position):
+        self.first_move = False
+        self.feed.append((self.lineno, self.lo, position, self.feedrate, self.tool_offset))
+        self.lo = position
+
+    def dwell(self, x, y, z):
+        self.dwells.append((self.lineno, self.colors, x, y, z, 0))
+
+
+class GlCanonDraw:
+    def __init__(self, stat, lp):
+        self.stat = stat
+        self.lp = lp
+
+    def load_preview(self, filename, canon, unitcode, initcode):
+        return gcode.parse(filename, canon, unitcode, initcode)
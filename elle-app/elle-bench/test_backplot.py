@@ -0,0 +1,144 @@
+"""Tests for backplot generation.
+
+    python3 -m unittest test_backplot
+"""
+import contextlib
+import io
+import os
+import unittest
+
+import numpy as np
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import bench
+    import lathe_backplot
+    import lathe_display
+
+
+def segments(points):
+    return np.stack((points[:-1], points[1:]), axis=1)
+
+
+def douglas_peucker(points, tolerance):
+    """Indices kept by a plain recursive Douglas-Peucker of one polyline"""
+    if len(points) < 3:
+        return list(range(len(points)))
+    chord = points[-1] - points[0]
+    offsets = points[1:-1] - points[0]
+    chord_length = np.linalg.norm(chord)
+    if chord_length > 0:
+        distances = np.linalg.norm(np.cross(offsets, chord), axis=1) / chord_length
+    else:
+        distances = np.linalg.norm(offsets, axis=1)
+    split = int(np.argmax(distances)) + 1
+    if distances[split - 1] <= tolerance:
+        return [0, len(points) - 1]
+    head = douglas_peucker(points[:split + 1], tolerance)
+    tail = douglas_peucker(points[split:], tolerance)
+    return head + [split + i for i in tail[1:]]
+
+
+class SimplifyMovesTest(unittest.TestCase):
+    def test_runs_are_decimated_within_their_line(self):
+        z = np.linspace(0.0, -10.0, 11)
+        straight = np.stack((np.full(11, 5.0), np.zeros(11), z), axis=1)
+        lines = np.array([1] * 5 + [2] * 5)
+        offsets = list(range(10))
+        lines, points, rates, offsets = lathe_backplot.simplifyMoves(
+            lines, segments(straight), [0.1] * 10, offsets, 0.01
+        )
+        # One segment per line, never merged across the line change
+        self.assertEqual(lines.tolist(), [1, 2])
+        self.assertEqual(points[:, :, 2].tolist(), [[0.0, -5.0], [-5.0, -10.0]])
+        self.assertEqual(offsets, [0, 5])
+
+    def test_dropped_points_stay_within_tolerance(self):
+        rng = np.random.default_rng(bench.SEED)
+        polyline = np.cumsum(rng.normal(scale=0.1, size=(500, 3)), axis=0)
+        tolerance = 0.05
+        _, points, _, _ = lathe_backplot.simplifyMoves(
+            np.ones(499, dtype=int), segments(polyline), None, list(range(499)), tolerance
+        )
+        self.assertLess(len(points), 499)
+        kept = np.concatenate((points[:, 0], points[-1:, 1]))
+        index = [int(np.flatnonzero((polyline == point).all(axis=1))[0]) for point in kept]
+        for (a, b), first, last in zip(points, index[:-1], index[1:]):
+            chord = b - a
+            offsets = polyline[first + 1:last] - a
+            distances = np.linalg.norm(np.cross(offsets, chord), axis=1) / np.linalg.norm(chord)
+            self.assertTrue(np.all(distances <= tolerance))
+
+
+    def test_matches_per_polyline_decimation(self):
+        rng = np.random.default_rng(bench.SEED)
+        for _ in range(50):
+            count = int(rng.integers(1, 200))
+            lines = np.sort(rng.integers(0, count // 5 + 1, count))
+            scale = rng.choice([0.01, 1.0])
+            points = np.cumsum(rng.normal(scale=scale, size=(count + 1, 3)), axis=0)
+            # Repeated points give zero length chords
+            points[count // 2:count // 2 + 3] = points[count // 2]
+            moves = segments(points)
+            # Disconnected segments start a new run
+            moves[rng.random(count) < 0.05, 0] += 0.5
+            rates = list(rng.random(count))
+            tolerance = float(rng.choice([0.0, 0.01, 0.5]))
+
+            expected_lines, expected_points, expected_index = [], [], []
+            start = 0
+            for end in range(1, count + 1):
+                connected = end < count and (moves[end, 0] == moves[end - 1, 1]).all()
+                if connected and lines[end] == lines[start]:
+                    continue
+                polyline = np.concatenate((moves[start:end, 0], moves[end - 1:end, 1]))
+                kept = douglas_peucker(polyline, tolerance)
+                expected_lines += [lines[start]] * (len(kept) - 1)
+                expected_points += [(polyline[a], polyline[b]) for a, b in zip(kept, kept[1:])]
+                expected_index += [start + a for a in kept[:-1]]
+                start = end
+
+            result = lathe_backplot.simplifyMoves(
+                lines, moves, rates, list(range(count)), tolerance
+            )
+            self.assertEqual(result[0].tolist(), expected_lines)
+            np.testing.assert_array_equal(result[1], np.array(expected_points))
+            self.assertEqual(result[2], [rates[i] for i in expected_index])
+            self.assertEqual(result[3], expected_index)
+
+
+class BackplotWorkerPoolTest(unittest.TestCase):
+    GCODE = b"G0 X10 Z0\nG1 Z-10 F100\nG1 X12\nM2\n"
+
+    def setUp(self):
+        self.pool = lathe_display.BackplotWorkerPool(1, 2, 30.0)
+        self.pool.start()
+
+    def tearDown(self):
+        self.pool.stop()
+
+    def test_replacements_are_not_forked_from_the_server(self):
+        expected = self.pool.submit("a", self.GCODE, lathe_display.BACKPLOT_JSON_MIMETYPE)
+        killed = self.pool.idle.get()
+        worker = self.pool.replace(killed)
+        self.pool.idle.put(worker)
+        self.assertFalse(os.path.exists(killed.scratch_dir))
+        with open(f"/proc/{worker.process.pid}/stat") as f:
+            parent = int(f.read().rsplit(")", 1)[1].split()[1])
+        self.assertNotEqual(parent, os.getpid())
+        result = self.pool.submit("a", self.GCODE, lathe_display.BACKPLOT_JSON_MIMETYPE)
+        self.assertEqual(result, expected)
+
+    def test_stop_removes_scratch_directories(self):
+        self.pool.submit("a", self.GCODE, lathe_display.BACKPLOT_JSON_MIMETYPE)
+        self.pool.stop()
+        self.assertFalse(os.path.exists(self.pool.scratch_root))
+
+    def test_client_id_header_keys_supersede(self):
+        with lathe_display.app.test_request_context(headers={"X-Client-Id": "tab-1"}):
+            self.assertEqual(lathe_display.backplot_client(), "tab-1")
+        with lathe_display.app.test_request_context(environ_base={"REMOTE_ADDR": "10.0.0.2"}):
+            self.assertEqual(lathe_display.backplot_client(), "10.0.0.2")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,320 @@
+"""Tests for the HAL server against the stand-ins in fakes/.
+
+    python3 -m unittest test_halcomp
+"""
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import threading
+import time
+import unittest
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+HAL_DIR = os.path.join(os.path.dirname(BENCH_DIR), "elle-hal")
+FAKES_DIR = os.path.join(BENCH_DIR, "fakes")
+
+sys.path[:0] = [FAKES_DIR, HAL_DIR]
+# The server reads lathe.ini and writes canned cycle files relative to cwd
+os.chdir(HAL_DIR)
+
+from cycle_params import THREADING_PARAMS, TURNING_PARAMS  # noqa: E402
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import hal  # noqa: E402
+    import linuxcnc  # noqa: E402
+    import lathe_cycles  # noqa: E402
+    import lathe_halcomp  # noqa: E402
+
+lathe = hal.components["lathe"]
+
+
+class StartupTest(unittest.TestCase):
+    def test_cycle_modules_load_on_first_use(self):
+        code = (
+            "import contextlib, io, sys\n"
+            "with contextlib.redirect_stdout(io.StringIO()):\n"
+            "    import lathe_halcomp\n"
+            "print(sorted({'lathe_cycles', 'lathe_backplot'} & set(sys.modules)))\n"
+        )
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([FAKES_DIR, HAL_DIR]))
+        result = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, cwd=HAL_DIR, env=env
+        )
+        self.assertEqual(result.stdout.strip().splitlines()[-1], "[]")
+
+    def test_unchecked_pin_links_are_reported(self):
+        get_info_signals = hal.get_info_signals
+        delay = lathe_halcomp.HAL_LINK_FALLBACK_DELAY
+        try:
+            del hal.get_info_signals
+            lathe_halcomp.HAL_LINK_FALLBACK_DELAY = 0.0
+            self.assertIsNone(lathe_halcomp.wait_for_pin_links(lathe_halcomp.HAL_LINK_PINS, 1.0))
+        finally:
+            hal.get_info_signals = get_info_signals
+            lathe_halcomp.HAL_LINK_FALLBACK_DELAY = delay
+        self.assertTrue(lathe_halcomp.wait_for_pin_links(lathe_halcomp.HAL_LINK_PINS, 1.0))
+
+
+class JogOffsetTest(unittest.TestCase):
+    def setUp(self):
+        self.client = lathe_halcomp.app.test_client()
+        lathe["position_a"] = 0.0
+        lathe["position_z_encoder"] = 5.0
+        lathe["position_x_encoder"] = 2.0
+        self.client.put("/hal/hal_out", json={"control_source": 0})
+
+    def test_stop_now_latches_offsets_at_jog_end(self):
+        self.client.put("/hal/hal_out", json={"control_z_type": 1, "velocity_z_cmd": 10.0})
+        self.assertEqual(lathe["offset_z_stepper"], 5.0)
+
+        # Velocity updates leave the offsets alone
+        lathe["position_z_encoder"] = 15.0
+        self.client.put("/hal/hal_out", json={"control_z_type": 1, "velocity_z_cmd": 12.0})
+        self.assertEqual(lathe["offset_z_stepper"], 5.0)
+
+        lathe["position_z_encoder"] = 25.0
+        lathe["position_a"] = 3.5
+        self.client.put("/hal/hal_out", json={"control_stop_now": 1})
+        self.assertEqual(lathe["control_z_type"], 0)
+        self.assertEqual(lathe["offset_z_stepper"], 25.0)
+        self.assertEqual(lathe["offset_z_encoder"], -3.5)
+        self.assertEqual(lathe["offset_x_stepper"], 2.0)
+
+    def test_leaving_velocity_control_latches_offsets(self):
+        self.client.put("/hal/hal_out", json={"control_x_type": 1, "velocity_x_cmd": -4.0})
+        lathe["position_x_encoder"] = -6.0
+        self.client.put("/hal/hal_out", json={"control_x_type": 0, "velocity_x_cmd": 0.0})
+        self.assertEqual(lathe["offset_x_stepper"], -6.0)
+
+    def test_non_object_commands_are_rejected(self):
+        for body in ([1], [{"control_z_type": 1}, "x"], 2):
+            response = self.client.put("/hal/hal_out", json=body)
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(lathe["control_z_type"], 0)
+
+
+class JogRampTest(unittest.TestCase):
+    def setUp(self):
+        self.client = lathe_halcomp.app.test_client()
+        lathe["position_a"] = 0.0
+        lathe["position_z_encoder"] = 5.0
+        self.client.put("/hal/hal_out", json={"control_source": 0})
+        self.deadman_timeout = lathe_halcomp.jog_ramp.deadman_timeout
+        lathe_halcomp.jog_ramp.deadman_timeout = 0.1
+
+    def tearDown(self):
+        lathe_halcomp.jog_ramp.deadman_timeout = self.deadman_timeout
+        lathe_halcomp.jog_ramp.stop_now()
+
+    def test_deadman_timeout_latches_offsets(self):
+        response = self.client.put("/hal/jog", json={
+            "axis": "z", "direction": 1, "velocity": 10.0, "acceleration": 100.0,
+        })
+        self.assertEqual(response.status_code, 200)
+        deadline = time.monotonic() + 2.0
+        while lathe["control_z_type"] != 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(lathe["control_z_type"], 1)
+
+        lathe["position_z_encoder"] = 40.0
+        lathe["position_a"] = -1.25
+        # Without renewal the ramp stops the axis after the dead-man timeout
+        while lathe["control_z_type"] != 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(lathe["control_z_type"], 0)
+        self.assertEqual(lathe["velocity_z_cmd"], 0.0)
+        self.assertEqual(lathe["offset_z_stepper"], 40.0)
+        self.assertEqual(lathe["offset_z_encoder"], 1.25)
+
+    def test_stop_ramps_axis_down(self):
+        self.client.put("/hal/jog", json={
+            "axis": "z", "direction": 1, "velocity": 10.0, "acceleration": 100.0,
+        })
+        self.assertEqual(self.client.put("/hal/jog/stop", json=["z"]).status_code, 400)
+        response = self.client.put("/hal/jog/stop", json={"axis": "z"})
+        self.assertEqual(response.status_code, 200)
+        deadline = time.monotonic() + 2.0
+        while lathe["control_z_type"] != 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(lathe["control_z_type"], 0)
+        self.assertEqual(lathe["velocity_z_cmd"], 0.0)
+
+
+class StreamSlotTest(unittest.TestCase):
+    def test_streams_leave_threads_for_control_requests(self):
+        client = lathe_halcomp.app.test_client()
+        streams = [client.get("/hal/hal_in/stream") for _ in range(lathe_halcomp.STREAM_MAX_CLIENTS)]
+        try:
+            self.assertEqual([stream.status_code for stream in streams], [200] * len(streams))
+            refused = client.get("/hal/hal_in/stream")
+            self.assertEqual(refused.status_code, 503)
+            self.assertEqual(client.put("/hal/abort").status_code, 200)
+
+            # Closing a stream frees its slot
+            streams.pop().close()
+            streams.append(client.get("/hal/hal_in/stream"))
+            self.assertEqual(streams[-1].status_code, 200)
+        finally:
+            # The test client shares one thread, so request contexts must
+            # unwind in reverse
+            for stream in reversed(streams):
+                stream.close()
+
+
+class CycleJobTest(unittest.TestCase):
+    def setUp(self):
+        self.client = lathe_halcomp.app.test_client()
+
+    def start(self, params):
+        """Start a threading job and return its response and MDI call"""
+        recorded = len(linuxcnc.commands)
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = self.client.put("/hal/threading", json=params)
+        self.assertEqual(response.status_code, 202)
+        deadline = time.monotonic() + 2.0
+        calls = []
+        while not calls and time.monotonic() < deadline:
+            calls = [args[0] for _, name, args in linuxcnc.commands[recorded:] if name == "mdi"]
+            time.sleep(0.01)
+        lathe_halcomp.cycle_jobs.abort_active("Test done")
+        self.assertEqual(len(calls), 1)
+        return response.json, calls[0]
+
+    def test_start_position_is_a_call_parameter(self):
+        first, first_call = self.start(dict(THREADING_PARAMS, XPos=1.25, ZPos=-3.0))
+        second, second_call = self.start(dict(THREADING_PARAMS, XPos=7.5, ZPos=0.5))
+        self.assertEqual(first["subroutine_file"], second["subroutine_file"])
+        self.assertIn("G10 L20 P1 X#1 Z#2", first["gcode"])
+        self.assertTrue(first_call.endswith("call [1.250000] [-3.000000]"))
+        self.assertTrue(second_call.endswith("call [7.500000] [0.500000]"))
+
+    def test_abort_while_starting_is_kept(self):
+        command = lathe_halcomp.c.command
+        abort = threading.Thread(target=lathe_halcomp.abort_operation)
+
+        def mdi(text):
+            # An abort request arriving while the call is being issued
+            abort.start()
+            abort.join(0.2)
+            return type(command).mdi(command, text)
+
+        params = dict(THREADING_PARAMS, XPos=0.0, ZPos=0.0)
+        recorded = len(linuxcnc.commands)
+        command.mdi = mdi
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                response = self.client.put("/hal/threading", json=params)
+            self.assertEqual(response.status_code, 202)
+            job = lathe_halcomp.cycle_jobs.get(response.json["job_id"])
+            deadline = time.monotonic() + 2.0
+            while job.state in ("starting", "running") and time.monotonic() < deadline:
+                time.sleep(0.01)
+            abort.join()
+        finally:
+            del command.mdi
+        self.assertEqual(job.state, "aborted")
+        names = [name for _, name, _ in linuxcnc.commands[recorded:]]
+        # The machine is stopped after the call went out, not before it
+        self.assertLess(names.index("mdi"), names.index("abort"))
+
+
+class HistoryTest(unittest.TestCase):
+    def test_history_survives_wall_clock_steps(self):
+        client = lathe_halcomp.app.test_client()
+        time.sleep(0.1)
+        wall_clock = time.time
+        try:
+            # NTP stepping the clock an hour back after the samples were taken
+            time.time = lambda: wall_clock() - 3600.0
+            response = client.get("/hal/history?start=-0.5")
+        finally:
+            time.time = wall_clock
+        self.assertEqual(response.status_code, 200)
+        timestamps = response.json["timestamp"]
+        self.assertGreater(len(timestamps), 0)
+        self.assertEqual(timestamps, sorted(timestamps))
+        self.assertLessEqual(response.json["now"] - timestamps[-1], 0.1)
+
+
+class CycleBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.client = lathe_halcomp.app.test_client()
+
+    def put(self, path, json):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return self.client.put(path, json=json)
+
+    def test_threading_batch_reports_errors_per_set(self):
+        sets = [
+            THREADING_PARAMS,
+            dict(THREADING_PARAMS, SpringCuts=-1),
+            dict(THREADING_PARAMS, MinCut=0.0, CutMult=0.5),
+            {"Pitch": 1.5},
+            dict(THREADING_PARAMS, FirstCut=None),
+        ]
+        response = self.put("/hal/threading/batch", sets)
+        self.assertEqual(response.status_code, 200)
+        results = response.json["results"]
+        self.assertEqual([result["status"] for result in results], ["OK"] + ["Error"] * 4)
+        self.assertEqual(results[0]["summary"]["pass_count"], len(results[0]["passes"]))
+        self.assertIn("No passes planned", results[1]["message"])
+
+    def test_turning_batch_reports_errors_per_set(self):
+        sets = [dict(TURNING_PARAMS, StepDown=0.0), TURNING_PARAMS, dict(TURNING_PARAMS, Stock="x")]
+        response = self.put("/hal/turning/batch", sets)
+        self.assertEqual(response.status_code, 200)
+        results = response.json["results"]
+        self.assertEqual([result["status"] for result in results], ["Error", "OK", "Error"])
+        passes = lathe_cycles.plan_turning_passes(25.0, 10.0, 0.25, 0.05, 1)
+        self.assertEqual([p["depth"] for p in results[1]["passes"]], [p[3] for p in passes])
+
+
+class CycleEstimateTest(unittest.TestCase):
+    def setUp(self):
+        self.client = lathe_halcomp.app.test_client()
+
+    def put(self, path, json=None, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return self.client.put(path, json=json, **kwargs)
+
+    def test_invalid_requests_are_client_errors(self):
+        for route in ("estimate", "optimize"):
+            for kind, params in (("threading", THREADING_PARAMS), ("turning", TURNING_PARAMS)):
+                path = f"/hal/{kind}/{route}"
+                self.assertEqual(self.put(path, data="x").status_code, 415)
+                self.assertEqual(self.put(path, {}).status_code, 400)
+                self.assertEqual(self.put(path, [params]).status_code, 400)
+                bad = dict(params, Pitch=None, MaxCut=0.2)
+                self.assertEqual(self.put(path, bad).status_code, 400)
+
+    def test_null_parameters_are_client_errors(self):
+        for kind, params, name in (
+            ("threading", THREADING_PARAMS, "FirstCut"),
+            ("turning", TURNING_PARAMS, "StepDown"),
+        ):
+            for route in ("generate", "backplot"):
+                response = self.put(f"/hal/{kind}/{route}", dict(params, **{name: None}))
+                self.assertEqual(response.status_code, 400)
+            response = self.put(f"/hal/{kind}", dict(params, XPos=None, ZPos=0.0))
+            self.assertEqual(response.status_code, 400)
+
+    def test_zero_pass_sets_are_reported(self):
+        params = dict(THREADING_PARAMS, SpringCuts=-1, MaxCut=0.2)
+        for route in ("estimate", "optimize"):
+            response = self.put(f"/hal/threading/{route}", params)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("No passes planned", response.json["message"])
+
+    def test_optimize_respects_max_cut(self):
+        response = self.put("/hal/threading/optimize", dict(THREADING_PARAMS, MaxCut=0.2))
+        self.assertEqual(response.status_code, 200)
+        proposed = response.json["proposed"]
+        self.assertLessEqual(proposed["max_cut"], 0.2 + 1e-9)
+        # 1.06mm of compound depth takes 6 cuts of 0.2mm, plus 2 spring passes
+        self.assertEqual(proposed["pass_count"], 8)
+
+
+if __name__ == "__main__":
+    unittest.main()
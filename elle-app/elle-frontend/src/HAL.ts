@@ -1,24 +1,36 @@
 let halOutURL = 'http://localhost:8000/hal/hal_out'
+let jogURL = 'http://localhost:8000/hal/jog'
+let jogStopURL = 'http://localhost:8000/hal/jog/stop'
 let halInURL = 'http://localhost:8000/hal/hal_in'
+let halInStreamURL = 'http://localhost:8000/hal/hal_in/stream'
 let linuxcncURL = 'http://localhost:8001/linuxcnc/'
 let threadingURL = 'http://localhost:8000/hal/threading'
 let threadingGenerateURL = 'http://localhost:8000/hal/threading/generate'
+let threadingBackplotURL = 'http://localhost:8000/hal/threading/backplot'
 let turningURL = 'http://localhost:8000/hal/turning'
 let turningGenerateURL = 'http://localhost:8000/hal/turning/generate'
+let turningBackplotURL = 'http://localhost:8000/hal/turning/backplot'
 let cleanupURL = 'http://localhost:8000/hal/cleanup'
+let jobsURL = 'http://localhost:8000/hal/jobs/'
 let abortURL = 'http://localhost:8000/hal/abort'
 let estopURL = 'http://localhost:8000/hal/estop'
 
 const userAgent = navigator.userAgent.toLowerCase()
 if (userAgent.indexOf(' electron/') < 0) {
   halOutURL = 'http://lathev2:8000/hal/hal_out'
+  jogURL = 'http://lathev2:8000/hal/jog'
+  jogStopURL = 'http://lathev2:8000/hal/jog/stop'
   halInURL = 'http://lathev2:8000/hal/hal_in'
+  halInStreamURL = 'http://lathev2:8000/hal/hal_in/stream'
   linuxcncURL = 'http://lathev2:8001/linuxcnc/'
   threadingURL = 'http://lathev2:8000/hal/threading'
   threadingGenerateURL = 'http://lathev2:8000/hal/threading/generate'
+  threadingBackplotURL = 'http://lathev2:8000/hal/threading/backplot'
   turningURL = 'http://lathev2:8000/hal/turning'
   turningGenerateURL = 'http://lathev2:8000/hal/turning/generate'
+  turningBackplotURL = 'http://lathev2:8000/hal/turning/backplot'
   cleanupURL = 'http://lathev2:8000/hal/cleanup'
+  jobsURL = 'http://lathev2:8000/hal/jobs/'
   abortURL = 'http://lathev2:8000/hal/abort'
   estopURL = 'http://lathev2:8000/hal/estop'
 }
@@ -28,8 +40,32 @@ export interface HalIn {
   position_x: number
   position_a: number
   speed_rps: number
+  spindle_rpm?: number
+  program_running?: boolean
+  error_state?: boolean
 }
 
+export interface CycleJob {
+  id: string
+  kind: string
+  state: 'starting' | 'running' | 'done' | 'failed' | 'aborted'
+  code: string | null
+  message: string | null
+  pass: { number: number; count: number; label: string } | null
+  line: { number: number; text: string } | null
+  progress: number
+  elapsed: number
+  remaining: number | null
+}
+
+const cycleJobFinishedStates = ['done', 'failed', 'aborted']
+
+// Identifies this tab to the display server, so a new backplot only
+// supersedes older ones from the same tab rather than from the same host
+const clientId = Array.from(crypto.getRandomValues(new Uint8Array(8)), (byte) =>
+  byte.toString(16).padStart(2, '0')
+).join('')
+
 export async function putThreading(threadingParams: object) {
   try {
     const response = await fetch(threadingURL, {
@@ -64,6 +100,24 @@ export async function generateThreadingGcode(threadingParams: object) {
   return {}
 }
 
+// G-code and backplot of the cycle in one call, computed without the interpreter
+export async function generateThreadingBackplot(threadingParams: object) {
+  try {
+    const response = await fetch(threadingBackplotURL, {
+      method: 'PUT',
+      headers: {
+        'Content-Type': 'application/json'
+      },
+      body: JSON.stringify(threadingParams)
+    })
+    const result = await response.json()
+    return result
+  } catch {
+    // nop
+  }
+  return {}
+}
+
 export async function putTurning(turningParams: object) {
   try {
     const response = await fetch(turningURL, {
@@ -98,6 +152,24 @@ export async function generateTurningGcode(turningParams: object) {
   return {}
 }
 
+// G-code and backplot of the cycle in one call, computed without the interpreter
+export async function generateTurningBackplot(turningParams: object) {
+  try {
+    const response = await fetch(turningBackplotURL, {
+      method: 'PUT',
+      headers: {
+        'Content-Type': 'application/json'
+      },
+      body: JSON.stringify(turningParams)
+    })
+    const result = await response.json()
+    return result
+  } catch {
+    // nop
+  }
+  return {}
+}
+
 export async function cleanupCannedCycles() {
   try {
     const response = await fetch(cleanupURL, {
@@ -166,12 +238,55 @@ export async function putHalOut(halOut: object) {
   return {}
 }
 
+export interface Jog {
+  axis: 'x' | 'z'
+  direction: -1 | 1
+  velocity: number
+  acceleration: number
+}
+
+export async function putJog(jogs: Jog[]) {
+  try {
+    const response = await fetch(jogURL, {
+      method: 'PUT',
+      headers: {
+        'Content-Type': 'application/json'
+      },
+      body: JSON.stringify(jogs)
+    })
+    const result = await response.json()
+    return result
+  } catch {
+    // nop
+  }
+  return {}
+}
+
+// Decelerates the axis, or all axes, to a stop at its maximum acceleration
+export async function putJogStop(axis?: 'x' | 'z') {
+  try {
+    const response = await fetch(jogStopURL, {
+      method: 'PUT',
+      headers: {
+        'Content-Type': 'application/json'
+      },
+      body: JSON.stringify(axis ? { axis } : {})
+    })
+    const result = await response.json()
+    return result
+  } catch {
+    // nop
+  }
+  return {}
+}
+
 export async function putLinuxCNC(command: string, data: object) {
   try {
     const response = await fetch(linuxcncURL + command, {
       method: 'PUT',
       headers: {
-        'Content-Type': 'application/json'
+        'Content-Type': 'application/json',
+        'X-Client-Id': clientId
       },
       body: JSON.stringify(data)
     })
@@ -188,3 +303,47 @@ export function getHalIn(): Promise<HalIn[]> {
     .then((res) => res.json())
     .then((res) => res as HalIn[])
 }
+
+export function subscribeHalIn(
+  onHalIn: (halIn: HalIn) => void,
+  rate: number = 30
+): EventSource | null {
+  if (typeof EventSource === 'undefined') {
+    return null
+  }
+  const source = new EventSource(`${halInStreamURL}?rate=${rate}`)
+  source.onmessage = (event) => {
+    try {
+      onHalIn(JSON.parse(event.data) as HalIn)
+    } catch {
+      // Ignore malformed frames
+    }
+  }
+  return source
+}
+
+export function subscribeCycleJob(
+  jobId: string,
+  onJob: (job: CycleJob) => void
+): EventSource | null {
+  if (typeof EventSource === 'undefined') {
+    return null
+  }
+  const source = new EventSource(`${jobsURL}${jobId}/stream`)
+  source.onmessage = (event) => {
+    try {
+      const job = JSON.parse(event.data) as CycleJob
+      onJob(job)
+      if (cycleJobFinishedStates.includes(job.state)) {
+        // The server ends the stream here, stop EventSource reconnecting
+        source.close()
+      }
+    } catch {
+      // Ignore malformed frames
+    }
+  }
+  source.onerror = () => {
+    source.close()
+  }
+  return source
+}
@@ -1,18 +1,30 @@
 import { ref } from 'vue'
 import {
   putHalOut,
+  putJog,
+  putJogStop,
+  type Jog,
   putLinuxCNC,
   getHalIn,
+  subscribeHalIn,
+  subscribeCycleJob,
+  type HalIn,
+  type CycleJob,
   putAbort,
   putEmergencyStop,
   putThreading,
   generateThreadingGcode,
+  generateThreadingBackplot,
   putTurning,
   generateTurningGcode,
+  generateTurningBackplot,
   cleanupCannedCycles
 } from '../HAL'
 import { useSettings } from './useSettings'
 
+// Held jogs are renewed well within the server's 0.5s dead-man timeout
+const JOG_RENEW_INTERVAL = 0.2
+
 export function useHAL() {
   // Get encoder scale values from settings
   const { encoderScaleZ, encoderScaleX } = useSettings()
@@ -23,6 +35,7 @@ export function useHAL() {
   const rpms = ref(0)
   const rpmsSmoothed = ref(0)
   const cannedCycleRunning = ref(false)
+  const cannedCycleJob = ref<CycleJob | null>(null)
   const errorState = ref(false)
   const xpitch = ref(0.1)
   const zpitch = ref(0.1)
@@ -32,6 +45,9 @@ export function useHAL() {
   const zstepperactive = ref(false)
 
   let updateInterval: NodeJS.Timeout
+  let halInStream: EventSource | null = null
+  let halInStreamOpen: boolean = false
+  let cycleJobStream: EventSource | null = null
   let halOutResetPositionScheduled: boolean = false
   let halOutScheduled: boolean = false
   let xaxisoffset: number = 0
@@ -48,20 +64,99 @@ export function useHAL() {
   let buttonlefttime: number = 0
   let buttonrighttime: number = 0
   let buttonupscheduled: boolean = false
+  let jogSent: string = ''
+  let jogSentTime: number = 0
   let zforward: boolean = true
   let xforward: boolean = true
 
-  function stopJogNow() {
+  function clearJogButtons() {
     buttonuptime = 0
     buttondowntime = 0
     buttonlefttime = 0
     buttonrighttime = 0
+    jogSent = ''
+  }
+
+  // Button release, the server ramps the axes down
+  function stopJog() {
+    clearJogButtons()
+    putJogStop()
+  }
+
+  function stopJogNow() {
+    clearJogButtons()
     const halOut = {
       control_stop_now: 1
     }
     putHalOut(halOut)
   }
 
+  function applyHalIn(halIn: HalIn, toolOffsets: { currentToolOffsetX: any, currentToolOffsetZ: any }) {
+    if (xaxissetscheduled) {
+      xaxissetscheduled = false
+      xaxisoffset = halIn.position_x - xaxisset
+      xaxisset = 0
+    }
+    if (zaxissetscheduled) {
+      zaxissetscheduled = false
+      zaxisoffset = halIn.position_z - zaxisset
+      zaxisset = 0
+    }
+    if (aaxissetscheduled) {
+      aaxissetscheduled = false
+      aaxisoffset = halIn.position_a - ((aaxisset / 360) % 1)
+      aaxisset = 0
+    }
+    zpos.value = halIn.position_z - zaxisoffset + toolOffsets.currentToolOffsetZ.value
+    xpos.value = halIn.position_x - xaxisoffset + toolOffsets.currentToolOffsetX.value
+    apos.value = Math.abs(((halIn.position_a - aaxisoffset) % 1) * 360)
+    const newRpm = Math.abs(halIn.speed_rps * 60)
+    rpms.value = newRpm
+    if (halIn.spindle_rpm !== undefined) {
+      // Filtered by the server at a fixed rate
+      rpmsSmoothed.value = Math.abs(halIn.spindle_rpm)
+    } else {
+      // Apply exponential smoothing filter (alpha = 0.2 for dampening)
+      rpmsSmoothed.value = rpmsSmoothed.value * 0.8 + newRpm * 0.2
+    }
+    cannedCycleRunning.value = halIn.program_running || false
+    errorState.value = halIn.error_state || false
+  }
+
+  function startHalInStream(toolOffsets: { currentToolOffsetX: any, currentToolOffsetZ: any }) {
+    halInStream = subscribeHalIn((halIn) => {
+      halInStreamOpen = true
+      applyHalIn(halIn, toolOffsets)
+    })
+    if (halInStream) {
+      halInStream.onerror = () => {
+        // EventSource reconnects on its own, poll in the meantime
+        halInStreamOpen = false
+      }
+    }
+  }
+
+  function stopHalInStream() {
+    if (halInStream) {
+      halInStream.close()
+      halInStream = null
+    }
+    halInStreamOpen = false
+  }
+
+  async function startCycleJob(start: Promise<any>) {
+    const result = await start
+    if (result.job_id) {
+      if (cycleJobStream) {
+        cycleJobStream.close()
+      }
+      cycleJobStream = subscribeCycleJob(result.job_id, (job) => {
+        cannedCycleJob.value = job
+      })
+    }
+    return result
+  }
+
   function startPoll(toolOffsets: { currentToolOffsetX: any, currentToolOffsetZ: any }, params: {
     selectedMenu: any
     MenuType: any
@@ -70,6 +165,7 @@ export function useHAL() {
     selectedDirectionMode: any
     selectedFeedMode: any
   }) {
+    startHalInStream(toolOffsets)
     updateInterval = setInterval(() => {
       if (halOutResetPositionScheduled) {
         halOutResetPositionScheduled = false
@@ -82,79 +178,47 @@ export function useHAL() {
         }
         putHalOut(halOut)
       }
-      try {
-        getHalIn().then((halIn) => {
-          if (xaxissetscheduled) {
-            xaxissetscheduled = false
-            xaxisoffset = (halIn as any).position_x - xaxisset
-            xaxisset = 0
-          }
-          if (zaxissetscheduled) {
-            zaxissetscheduled = false
-            zaxisoffset = (halIn as any).position_z - zaxisset
-            zaxisset = 0
-          }
-          if (aaxissetscheduled) {
-            aaxissetscheduled = false
-            aaxisoffset = (halIn as any).position_a - ((aaxisset / 360) % 1)
-            aaxisset = 0
-          }
-          zpos.value = (halIn as any).position_z - zaxisoffset + toolOffsets.currentToolOffsetZ.value
-          xpos.value = (halIn as any).position_x - xaxisoffset + toolOffsets.currentToolOffsetX.value
-          apos.value = Math.abs((((halIn as any).position_a - aaxisoffset) % 1) * 360)
-          const newRpm = Math.abs((halIn as any).speed_rps * 60)
-          rpms.value = newRpm
-          // Apply exponential smoothing filter (alpha = 0.2 for dampening)
-          rpmsSmoothed.value = rpmsSmoothed.value * 0.8 + newRpm * 0.2
-          cannedCycleRunning.value = (halIn as any).program_running || false
-          errorState.value = (halIn as any).error_state || false
-        })
-      } catch {
-        // Ignore polling errors
+      // Fall back to polling while the telemetry stream is not connected
+      if (!halInStreamOpen) {
+        try {
+          getHalIn().then((halIn) => {
+            applyHalIn(halIn as any, toolOffsets)
+          })
+        } catch {
+          // Ignore polling errors
+        }
       }
+      // The server ramps held jogs and stops them unless they are renewed
+      // within its dead-man timeout
+      const jogs: Jog[] = []
       if (buttonuptime > 0) {
         halOutScheduled = false
-        let velocity = (Date.now() / 1000 - buttonuptime) * 3
-        velocity = Math.min(velocity, 3.0)
-        const halOut = {
-          control_x_type: 1,
-          velocity_x_cmd: -velocity
-        }
-        putHalOut(halOut)
+        jogs.push({ axis: 'x', direction: -1, velocity: 3.0, acceleration: 3.0 })
       }
       if (buttondowntime > 0) {
         halOutScheduled = false
-        let velocity = (Date.now() / 1000 - buttondowntime) * 3
-        velocity = Math.min(velocity, 3.0)
-        const halOut = {
-          control_x_type: 1,
-          velocity_x_cmd: +velocity
-        }
-        putHalOut(halOut)
+        jogs.push({ axis: 'x', direction: +1, velocity: 3.0, acceleration: 3.0 })
       }
       if (buttonlefttime > 0) {
         halOutScheduled = false
-        let velocity = (Date.now() / 1000 - buttonlefttime) * 3
-        velocity = Math.min(velocity, 6.0)
-        const halOut = {
-          control_z_type: 1,
-          velocity_z_cmd: -velocity
-        }
-        putHalOut(halOut)
+        jogs.push({ axis: 'z', direction: -1, velocity: 6.0, acceleration: 3.0 })
       }
       if (buttonrighttime > 0) {
         halOutScheduled = false
-        let velocity = (Date.now() / 1000 - buttonrighttime) * 3
-        velocity = Math.min(velocity, 6.0)
-        const halOut = {
-          control_z_type: 1,
-          velocity_z_cmd: +velocity
+        jogs.push({ axis: 'z', direction: +1, velocity: 6.0, acceleration: 3.0 })
+      }
+      if (jogs.length > 0) {
+        const jogJson = JSON.stringify(jogs)
+        const now = Date.now() / 1000
+        if (jogJson !== jogSent || now - jogSentTime >= JOG_RENEW_INTERVAL) {
+          jogSent = jogJson
+          jogSentTime = now
+          putJog(jogs)
         }
-        putHalOut(halOut)
       }
       if (buttonupscheduled) {
         buttonupscheduled = false
-        stopJogNow()
+        stopJog()
       }
       if (halOutScheduled) {
         halOutScheduled = false
@@ -193,6 +257,7 @@ export function useHAL() {
 
   function endPoll() {
     clearTimeout(updateInterval)
+    stopHalInStream()
   }
 
   const setAxisOffset = (axis: 'x' | 'z' | 'a', value: number) => {
@@ -402,6 +467,7 @@ export function useHAL() {
     rpms,
     rpmsSmoothed,
     cannedCycleRunning,
+    cannedCycleJob,
     errorState,
     xpitch,
     zpitch,
@@ -414,13 +480,16 @@ export function useHAL() {
     getHalIn,
     putAbort,
     putEmergencyStop,
-    putThreading,
+    putThreading: (params: object) => startCycleJob(putThreading(params)),
     generateThreadingGcode,
-    putTurning,
+    generateThreadingBackplot,
+    putTurning: (params: object) => startCycleJob(putTurning(params)),
     generateTurningGcode,
+    generateTurningBackplot,
     cleanupCannedCycles,
     startPoll,
     endPoll,
+    stopJog,
     stopJogNow,
     setAxisOffset,
     scheduleResetPosition,
@@ -0,0 +1,399 @@
+"""Interpreter independent backplot geometry.
+
+Shared by the display server, which feeds it moves from the rs274
+interpreter, and the HAL server, which builds canned cycle moves directly.
+"""
+import os
+import json
+import struct
+
+import numpy as np
+
+BACKPLOT_BINARY_MAGIC = b"ELBP"
+BACKPLOT_BINARY_VERSION = 1
+BACKPLOT_BINARY_TYPES = {"feed": 0, "arcfeed": 1, "trav": 2}
+
+
+def fileMtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def sortByLine(elem):
+    return elem["line"]
+
+
+def ndjsonFrame(obj):
+    return (json.dumps(obj, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def rawGroups(entry_type, entries, start, end):
+    """Per-line groups of canon entries[start:end], coordinates untouched"""
+    groups = []
+    for entry in entries[start:end]:
+        if entry_type == "trav":
+            move = {
+                "coords": [entry[1][0], entry[1][1], entry[1][2], entry[2][0], entry[2][1], entry[2][2]],
+                "offset": [entry[3][0], entry[3][1], entry[3][2]],
+            }
+        else:
+            move = {
+                "coords": [entry[1][0], entry[1][1], entry[1][2], entry[2][0], entry[2][1], entry[2][2]],
+                "rate": entry[3],
+                "offset": [entry[4][0], entry[4][1], entry[4][2]],
+            }
+        if not groups or groups[-1]["line"] != entry[0]:
+            groups.append({"type": entry_type, "line": entry[0], entry_type: []})
+        groups[-1][entry_type].append(move)
+    return groups
+
+
+def simplifyPolylines(vertices, firsts, lasts, tolerance):
+    """Douglas-Peucker over many polylines at once: mask of the vertices to
+    keep so that no dropped vertex is further than tolerance from its
+    simplified polyline.
+
+    Polyline i is vertices[firsts[i]:lasts[i] + 1]. Every pending interval
+    is split in the same numpy pass, so the Python loop runs once per
+    recursion depth rather than once per interval."""
+    keep = np.zeros(len(vertices), dtype=bool)
+    keep[firsts] = keep[lasts] = True
+    # Two point intervals have nothing to drop
+    pending = lasts - firsts >= 2
+    firsts, lasts = firsts[pending], lasts[pending]
+    while len(firsts):
+        counts = lasts - firsts - 1
+        bounds = np.concatenate(([0], np.cumsum(counts)))
+        owner = np.repeat(np.arange(len(firsts)), counts)
+        interior = np.arange(bounds[-1]) - bounds[owner] + firsts[owner] + 1
+        a = vertices[firsts]
+        chord = vertices[lasts] - a
+        offsets = vertices[interior] - a[owner]
+        chord_length = np.linalg.norm(chord, axis=1)
+        distances = np.where(
+            (chord_length > 0)[owner],
+            np.linalg.norm(np.cross(offsets, chord[owner]), axis=1)
+            / np.where(chord_length > 0, chord_length, 1.0)[owner],
+            np.linalg.norm(offsets, axis=1),
+        )
+        furthest = np.maximum.reduceat(distances, bounds[:-1])
+        # First interior vertex at the maximum distance of each interval
+        at_max = np.flatnonzero(distances == furthest[owner])
+        _, first_at_max = np.unique(owner[at_max], return_index=True)
+        splits = interior[at_max[first_at_max]]
+        split = furthest > tolerance
+        firsts, splits, lasts = firsts[split], splits[split], lasts[split]
+        keep[splits] = True
+        firsts = np.concatenate((firsts, splits))
+        lasts = np.concatenate((splits, lasts))
+        pending = lasts - firsts >= 2
+        firsts, lasts = firsts[pending], lasts[pending]
+    return keep
+
+
+def simplifyMoves(lines, points, rates, offsets, tolerance):
+    """Decimate connected runs of segments that share a line number.
+
+    points is an (N, 2, 3) array of segment start and end points. Segments
+    never merge across line numbers, so line highlighting is unaffected.
+    Merged segments keep the rate and offset of their first segment."""
+    count = len(lines)
+    starts = np.concatenate(([0], np.flatnonzero(
+        (lines[1:] != lines[:-1]) | np.any(points[1:, 0] != points[:-1, 1], axis=1)
+    ) + 1))
+    ends = np.append(starts[1:], count)
+    # Runs of one segment cannot be decimated
+    if np.all(ends - starts < 2):
+        return lines, points, rates, offsets
+    # Each run becomes a polyline of its segment start points and its last
+    # end point, so segment i starts at vertex i + run and run r ends at
+    # vertex ends[r] + r
+    runs = np.arange(len(starts))
+    segment_run = np.repeat(runs, ends - starts)
+    vertices = np.empty((count + len(starts), 3), dtype=points.dtype)
+    vertices[np.arange(count) + segment_run] = points[:, 0]
+    vertices[ends + runs] = points[ends - 1, 1]
+    kept = np.flatnonzero(simplifyPolylines(vertices, starts + runs, ends + runs, tolerance))
+    # Consecutive kept vertices of the same run are the merged segments
+    vertex_run = np.repeat(runs, ends - starts + 1)[kept]
+    same_run = vertex_run[:-1] == vertex_run[1:]
+    first, last = kept[:-1][same_run], kept[1:][same_run]
+    keep_index = (first - vertex_run[:-1][same_run]).tolist()
+    return (
+        lines[keep_index],
+        np.stack((vertices[first], vertices[last]), axis=1),
+        None if rates is None else [rates[i] for i in keep_index],
+        [offsets[i] for i in keep_index],
+    )
+
+
+def lineGroups(lines):
+    """Start and end indices of the runs of equal line numbers"""
+    starts = np.concatenate(([0], np.flatnonzero(lines[1:] != lines[:-1]) + 1))
+    ends = np.append(starts[1:], len(lines))
+    return starts, ends
+
+
+def normalizeMoves(moves, tolerance=0.0):
+    """Scale, centre and normalize moves.
+
+    moves is a list of (type, lines, coords, rates, offsets) where lines is
+    an int array, coords an (N, 6) float array of start and end points and
+    rates/offsets plain lists (rates is None for traverses). Returns
+    (moves, extents, transform) with coords replaced by normalized, Z/X
+    swapped coordinates. A positive tolerance (in mm) decimates each line's
+    polylines first, see simplifyMoves."""
+    if moves:
+        points = np.concatenate([coords for _, _, coords, _, _ in moves]).reshape(-1, 3)
+        min_x, min_y, min_z = (float(v) for v in points.min(axis=0))
+        max_x, max_y, max_z = (float(v) for v in points.max(axis=0))
+    else:
+        min_x = min_y = min_z = -1.0
+        max_x = max_y = max_z = 1.0
+
+    # Check if LinuxCNC interpreted coordinates as inches instead of mm
+    # If the coordinate range is much smaller than expected, apply conversion
+    units_scale = 1.0
+    coordinate_range = max(abs(max_x - min_x), abs(max_y - min_y), abs(max_z - min_z))
+    if coordinate_range > 0 and coordinate_range < 10:  # Suspiciously small for typical machining
+        # Apply inch to mm conversion (25.4x) to all coordinates
+        units_scale = 25.4
+        min_x *= units_scale
+        min_y *= units_scale
+        min_z *= units_scale
+        max_x *= units_scale
+        max_y *= units_scale
+        max_z *= units_scale
+
+    # Store original extents before transformation
+    original_min_x, original_min_y, original_min_z = min_x, min_y, min_z
+    original_max_x, original_max_y, original_max_z = max_x, max_y, max_z
+
+    center_x = (min_x + max_x) / 2
+    center_y = (min_y + max_y) / 2
+    center_z = (min_z + max_z) / 2
+
+    range_x = abs(max_x - min_x)
+    range_y = abs(max_y - min_y)
+    range_z = abs(max_z - min_z)
+    max_range = max(range_x, range_y, range_z)
+
+    scale_factor = 2.0 / max_range if max_range > 0 else 1.0
+
+    # Scale, centre and normalize all moves at once, then swap X and Z
+    center = np.array([center_x, center_y, center_z])
+    normalized = []
+    for entry_type, lines, coords, rates, offsets in moves:
+        points = coords.reshape(-1, 3)
+        if units_scale != 1.0:
+            points = points * units_scale
+        if tolerance > 0:
+            lines, segments, rates, offsets = simplifyMoves(
+                lines, points.reshape(-1, 2, 3), rates, offsets, tolerance
+            )
+            points = segments.reshape(-1, 3)
+        points = (points - center) * scale_factor
+        normalized.append(
+            (entry_type, lines, points[:, ::-1].reshape(-1, 6), rates, offsets)
+        )
+
+    norm_min_x = (min_x - center_x) * scale_factor
+    norm_min_y = (min_y - center_y) * scale_factor
+    norm_min_z = (min_z - center_z) * scale_factor
+    norm_max_x = (max_x - center_x) * scale_factor
+    norm_max_y = (max_y - center_y) * scale_factor
+    norm_max_z = (max_z - center_z) * scale_factor
+
+    extents = [norm_min_z, norm_min_y, norm_min_x, norm_max_z, norm_max_y, norm_max_x]
+    transform = {
+        "center": [center_x, center_y, center_z],
+        "scale_factor": scale_factor,
+        "original_min": [original_min_x, original_min_y, original_min_z],
+        "original_max": [original_max_x, original_max_y, original_max_z],
+        "units_scale": units_scale
+    }
+    return normalized, extents, transform
+
+
+def moveGroups(moves):
+    """Per-line JSON groups of normalized moves"""
+    data = []
+    for entry_type, lines, coords, rates, offsets in moves:
+        coords_list = coords.tolist()
+        starts, ends = lineGroups(lines)
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            if rates is None:
+                group = [
+                    {"coords": coords_list[i], "offset": offsets[i]}
+                    for i in range(start, end)
+                ]
+            else:
+                group = [
+                    {"coords": coords_list[i], "rate": rates[i], "offset": offsets[i]}
+                    for i in range(start, end)
+                ]
+            data.append({"type": entry_type, "line": int(lines[start]), entry_type: group})
+    return data
+
+
+def backplotBinary(moves, extents, transform, quantize=False):
+    """Pack normalized moves into the binary wire format.
+
+    All values are little endian and every section starts 4-byte aligned
+    so the client can view the vertex buffers without copying:
+
+        header   magic "ELBP", u8 version, u8 encoding (0 float32,
+                 1 int16), u16 section count, f32 extents[6],
+                 f64 center[3], f64 scale_factor, f64 original_min[3],
+                 f64 original_max[3]
+        section  u8 type (0 feed, 1 arcfeed, 2 trav), u8 pad[3],
+                 u32 segment count N, u32 line group count G,
+                 G x (u32 line, u32 first segment), N x 6 vertex values
+                 (float32, or int16 scaled by 1/32767), padded to 4 bytes
+
+    Each segment is a start and end vertex in normalized, Z/X swapped
+    coordinates, the same values moveGroups() emits as "coords"."""
+    chunks = [
+        BACKPLOT_BINARY_MAGIC,
+        struct.pack(
+            "<BBH",
+            BACKPLOT_BINARY_VERSION,
+            1 if quantize else 0,
+            len(moves),
+        ),
+        np.asarray(extents, dtype="<f4").tobytes(),
+        np.asarray(
+            transform["center"]
+            + [transform["scale_factor"]]
+            + transform["original_min"]
+            + transform["original_max"],
+            dtype="<f8",
+        ).tobytes(),
+    ]
+    for entry_type, lines, coords, _, _ in moves:
+        starts, _ = lineGroups(lines)
+        index = np.empty((len(starts), 2), dtype="<u4")
+        index[:, 0] = lines[starts]
+        index[:, 1] = starts
+        if quantize:
+            vertices = np.round(np.clip(coords, -1.0, 1.0) * 32767).astype("<i2")
+        else:
+            vertices = coords.astype("<f4")
+        vertex_bytes = vertices.tobytes()
+        chunks.append(
+            struct.pack(
+                "<B3xII",
+                BACKPLOT_BINARY_TYPES[entry_type],
+                len(coords),
+                len(starts),
+            )
+        )
+        chunks.append(index.tobytes())
+        chunks.append(vertex_bytes)
+        chunks.append(b"\0" * (-len(vertex_bytes) % 4))
+    return b"".join(chunks)
+
+
+class CycleProgram:
+    """G-code program that records its own toolpath while it is written.
+
+    Canned cycles only use straight G0/G1/G33 moves, so the geometry the
+    interpreter would produce is known as each line is added. Moves are kept
+    the way the rs274 canon records them: in inches, starting at the origin,
+    feed rates in units per second and traverses before the first feed
+    dropped. The line number of a move is its 1-based index in lines.
+
+    For timing, toolpath keeps every move as written, (line, code, x, z,
+    pitch) in mm with None for an axis that does not move, and dwells the
+    (line, seconds) of every G4."""
+
+    MOVE_TYPES = {"G0": "trav", "G1": "feed", "G33": "feed"}
+
+    def __init__(self):
+        self.lines = []
+        self.passes = []
+        self.motion_lines = []
+        self.toolpath = []
+        self.dwells = []
+        self.position = [0.0, 0.0, 0.0]
+        self.feedrate = 0.0
+        self.spindle_rpm = 0.0
+        self.first_move = True
+        self.segments = {"feed": [], "trav": []}
+
+    def append(self, line):
+        """Add a line without motion, e.g. a comment or a modal setting"""
+        self.lines.append(line)
+
+    def beginPass(self, label):
+        """Add a pass comment, remembering its line number in passes"""
+        self.lines.append(f"({label})")
+        self.passes.append((len(self.lines), label))
+
+    def setFeed(self, feed):
+        """Add an F word, feed in mm/min"""
+        self.lines.append(f"F{feed:g}")
+        self.feedrate = feed / 25.4 / 60.0
+
+    def setSpindle(self, rpm):
+        """Add an M3 spindle start at rpm"""
+        self.lines.append(f"M3S{rpm:g}")
+        self.spindle_rpm = float(rpm)
+
+    def dwell(self, seconds):
+        """Add a G4 dwell"""
+        self.lines.append(f"G4 P{seconds:g}")
+        self.dwells.append((len(self.lines), float(seconds)))
+
+    def move(self, code, x=None, z=None, pitch=None):
+        """Add a straight G0, G1 or G33 move to x and/or z (mm)"""
+        words = [code]
+        end = list(self.position)
+        if x is not None:
+            words.append(f"X{x:.6f}")
+            x = float(f"{x:.6f}")
+            end[0] = x / 25.4
+        if z is not None:
+            words.append(f"Z{z:.6f}")
+            z = float(f"{z:.6f}")
+            end[2] = z / 25.4
+        if pitch is not None:
+            words.append(f"K{pitch:.6f}")
+            pitch = float(f"{pitch:.6f}")
+        self.lines.append(" ".join(words))
+        self.motion_lines.append(len(self.lines))
+        self.toolpath.append((len(self.lines), code, x, z, pitch))
+
+        entry_type = self.MOVE_TYPES[code]
+        if entry_type == "feed":
+            self.first_move = False
+        if not self.first_move:
+            rate = self.feedrate if entry_type == "feed" else None
+            self.segments[entry_type].append((len(self.lines), self.position + end, rate))
+        self.position = end
+
+    def moves(self):
+        """Recorded moves in the (type, lines, coords, rates, offsets) form
+        normalizeMoves expects"""
+        moves = []
+        for entry_type in ("feed", "trav"):
+            segments = self.segments[entry_type]
+            if not segments:
+                continue
+            lines = np.array([segment[0] for segment in segments], dtype=np.int64)
+            coords = np.array([segment[1] for segment in segments], dtype=np.float64)
+            rates = None
+            if entry_type == "feed":
+                rates = [segment[2] for segment in segments]
+            offsets = [[0.0, 0.0, 0.0] for _ in segments]
+            moves.append((entry_type, lines, coords, rates, offsets))
+        return moves
+
+    def backplot(self, tolerance=0.0):
+        """Backplot root structure, the same one the display server returns"""
+        moves, extents, transform = normalizeMoves(self.moves(), tolerance)
+        data = moveGroups(moves)
+        data.sort(key=sortByLine)
+        return {"backplot": data, "extents": extents, "transform": transform}
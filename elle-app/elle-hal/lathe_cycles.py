@@ -0,0 +1,704 @@
+"""Canned cycle planning, independent of HAL and the controller.
+
+Pass schedules, the programs built from them, run time estimates and pass
+optimization behind the HAL server's canned cycle endpoints. Machine limits
+are passed in by the caller.
+"""
+import bisect
+import math
+
+import numpy as np
+
+from lathe_backplot import CycleProgram
+
+# Pass planning refuses schedules longer than CYCLE_MAX_PASSES. Threading
+# chip areas assume a symmetric thread form of CYCLE_THREAD_ANGLE degrees
+# included angle unless the caller gives another.
+CYCLE_MAX_PASSES = 1000
+CYCLE_THREAD_ANGLE = 60.0
+
+
+class CycleScheduleError(ValueError):
+    pass
+
+
+def plan_threading_passes(first_cut, cut_mult, min_cut, spring_cuts, x_depth, z_depth):
+    """Cut size and accumulated X/Z cut of every threading pass.
+
+    Follows the threading.ngc recurrence: each cut is the previous one times
+    cut_mult but at least min_cut, taken along the compound angle until
+    x_depth is reached, then repeated spring_cuts times backed off by the
+    last cut. Schedules that can never reach depth or would exceed
+    CYCLE_MAX_PASSES raise CycleScheduleError."""
+    first_cut = abs(first_cut)
+    cut_mult = abs(cut_mult)
+    min_cut = abs(min_cut)
+
+    # Calculate compound distance and direction ratios
+    compound_dist = math.sqrt(x_depth * x_depth + z_depth * z_depth)
+    k_x = x_depth / compound_dist if compound_dist != 0 else 0
+    k_z = z_depth / compound_dist if compound_dist != 0 else 0
+
+    # Without a minimum cut the cuts form a geometric series, which never
+    # reaches a depth at or beyond its sum
+    if min_cut == 0 and x_depth != 0:
+        if first_cut == 0 or (cut_mult < 1 and first_cut / (1 - cut_mult) <= compound_dist):
+            raise CycleScheduleError(
+                "Threading cuts never reach full depth, set MinCut or increase FirstCut/CutMult"
+            )
+
+    passes = []
+    cut_size = 0.0
+    x_cut = 0.0
+    z_cut = 0.0
+    spring_cuts_remaining = spring_cuts
+    while spring_cuts_remaining >= 0:
+        if len(passes) >= CYCLE_MAX_PASSES:
+            raise CycleScheduleError(
+                f"Threading needs more than {CYCLE_MAX_PASSES} passes, increase MinCut"
+            )
+
+        # Calculate cut size (lines 42-47)
+        if cut_size == 0.0:
+            cut_size = first_cut
+        else:
+            cut_size = cut_size * cut_mult
+
+        # Apply minimum cut constraint (lines 49-52)
+        if abs(cut_size) < abs(min_cut):
+            cut_size = min_cut
+
+        # Calculate cut positions (lines 53-54)
+        x_cut = x_cut + (cut_size * k_x)
+        z_cut = z_cut + (cut_size * k_z)
+
+        # Don't go too far (lines 56-59)
+        if abs(x_cut) >= abs(x_depth):
+            x_cut = x_depth
+            z_cut = z_depth
+
+        passes.append((cut_size, x_cut, z_cut))
+
+        # Spring cut logic (lines 70-76)
+        if abs(x_cut) == abs(x_depth):
+            if spring_cuts_remaining > 0:
+                # Back off for spring cut
+                x_cut = x_cut - (cut_size * k_x)
+                z_cut = z_cut - (cut_size * k_z)
+            spring_cuts_remaining -= 1
+    return passes
+
+
+def turning_pass_counts(x_stock, x_target, step_down, final_step_down, spring_passes):
+    """Total cut depth, depth left for roughing and number of roughing
+    passes. Schedules exceeding CYCLE_MAX_PASSES raise CycleScheduleError."""
+    # Calculate total cut depth needed
+    total_cut_depth = abs(x_stock - x_target)
+    
+    # Calculate passes needed
+    remaining_after_final = total_cut_depth - final_step_down
+    num_roughing_passes = 0
+    if remaining_after_final > 0:
+        if not step_down > 0:
+            raise CycleScheduleError("StepDown must be positive")
+        num_roughing_passes = math.ceil(remaining_after_final / step_down)
+    
+    if num_roughing_passes + 1 + max(spring_passes, 0) > CYCLE_MAX_PASSES:
+        raise CycleScheduleError(
+            f"Turning needs more than {CYCLE_MAX_PASSES} passes, increase StepDown"
+        )
+    return total_cut_depth, remaining_after_final, num_roughing_passes
+
+
+def plan_turning_passes(x_stock, x_target, step_down, final_step_down, spring_passes):
+    """(type, number, count, depth) of every turning pass: roughing passes of
+    step_down, the final pass to full depth and spring_passes repeats of it.
+    Schedules exceeding CYCLE_MAX_PASSES raise CycleScheduleError."""
+    total_cut_depth, remaining_after_final, num_roughing_passes = turning_pass_counts(
+        x_stock, x_target, step_down, final_step_down, spring_passes
+    )
+
+    # Build list of all passes with their depths and descriptions
+    passes = []
+    
+    # Add roughing passes
+    for i in range(num_roughing_passes):
+        depth = min((i + 1) * step_down, remaining_after_final)
+        passes.append(("Roughing", i + 1, num_roughing_passes, depth))
+    
+    # Add final pass
+    passes.append(("Final", 1, 1, total_cut_depth))
+    
+    # Add spring passes
+    for i in range(spring_passes):
+        passes.append(("Spring", i + 1, spring_passes, total_cut_depth))
+    
+    return passes
+
+
+def build_threading_program(params, for_backplot=False):
+    x_start = float(params['XStart'])
+    z_start = float(params['ZStart'])
+    pitch = abs(float(params['Pitch']))
+    x_depth = float(params['XDepth'])
+    z_depth = float(params['ZDepth'])
+    x_end = float(params['XEnd'])
+    z_end = float(params['ZEnd'])
+    x_pullout = float(params['XPullout'])
+    z_pullout = float(params['ZPullout'])
+    first_cut = abs(float(params['FirstCut']))
+    cut_mult = abs(float(params['CutMult']))
+    min_cut = abs(float(params['MinCut']))
+    spring_cuts = int(params['SpringCuts'])
+    x_return = float(params['XReturn'])
+    z_return = float(params['ZReturn'])
+    
+    program = CycleProgram()
+    
+    # Common setup
+    program.append("G8")   # Radius mode
+    program.append("G21")  # Metric units
+    program.append("G90")  # Absolute positioning
+    program.setFeed(100) # Set feed rate for G1 moves
+    program.setSpindle(500) # Start spindle (required for G33)
+    
+    # Additional setup for execution (not backplot)
+    if not for_backplot:
+        program.append("G10 L20 P1 X#1 Z#2")  # Work offset from the call's [XPos] [ZPos]
+        program.append("G54")  # Use work coordinates
+    
+    # Move to start point (line 40)
+    program.move("G0", x=x_start, z=z_start)
+    
+    # Threading passes (o100 do ... o100 while from lines 41-77)
+    passes = plan_threading_passes(first_cut, cut_mult, min_cut, spring_cuts, x_depth, z_depth)
+    for pass_number, (cut_size, x_cut, z_cut) in enumerate(passes, 1):
+        # Threading pass
+        program.beginPass(f"Pass {pass_number} - Cut size: {cut_size:.4f}")
+        
+        # Move to cut start position (line 60)
+        cut_start_x = x_start + x_cut
+        cut_start_z = z_start + z_cut
+        program.move("G1", x=cut_start_x, z=cut_start_z)
+        
+        # Dwell (line 61) - Skip for backplot compatibility
+        if not for_backplot:
+            program.dwell(0.01)
+        
+        # Cut thread (line 62)
+        cut_end_x = x_end + x_cut
+        cut_end_z = z_end + z_cut
+        program.move("G33", x=cut_end_x, z=cut_end_z, pitch=pitch)
+        
+        # Pull out (line 63)
+        pullout_z = cut_end_z + z_pullout
+        program.move("G33", x=x_end, z=pullout_z, pitch=pitch)
+        
+        # Continue pullout (line 66)
+        program.move("G1", x=x_end, z=pullout_z)
+        
+        # Retract sequence (lines 67-69)
+        retract_x = x_end + x_pullout
+        program.move("G0", x=retract_x)
+        program.move("G0", z=z_start)
+        program.move("G0", x=x_start)
+
+    # Final return to safe position (line 78)
+    program.move("G0", x=x_return, z=z_return)
+    
+    return program
+
+def build_turning_program(params, for_backplot=False):
+    pitch = abs(float(params['Pitch'])) # Cutting pitch for G33
+    x_stock = float(params['Stock']) # Stock radius (larger, starting diameter)
+    x_target = float(params['Target']) # Target radius (smaller, finished diameter)
+    
+    z_start = 0 # Starting Z, we always start at zero. Note that z_lead need to be added when cutting and X adjusted based on the taper angle.
+    z_lead = float(params['ZLead']) # Leading cut depth, used to compensate for backlash. usually positive.
+    z_end = float(params['ZEnd']) # Full cut depth, usually negative
+    angle = float(params['Angle']) # Taper angle
+    step_down = float(params['StepDown']) # Cut depth of a single pass
+    final_step_down = float(params['FinalStepDown']) # Cut depth of the final pass
+    spring_passes = int(params['SpringPasses']) # Number of spring passes to run after final cut
+    x_return = float(params['XReturn']) # final position
+    z_return = float(params['ZReturn']) # final position position 
+
+    program = CycleProgram()
+    
+    # Common setup
+    program.append("G8") # Radius mode
+    program.append("G21") # Metric units
+    program.append("G90") # Absolute positioning
+    program.setFeed(100)  # Set feed rate
+    program.setSpindle(500) # Start spindle
+    
+    # Additional setup for execution (not backplot)
+    if not for_backplot:
+        program.append("G10 L20 P1 X#1 Z#2")  # Work offset from the call's [XPos] [ZPos]
+        program.append("G54")  # Use work coordinates
+    
+    # Move to start point
+    program.move("G0", x=x_stock, z=z_start)
+
+    # Calculate taper angle in radians for calculations
+    angle_rad = math.radians(angle)
+    
+    passes = plan_turning_passes(x_stock, x_target, step_down, final_step_down, spring_passes)
+    
+    # Calculate common values
+    z_travel = z_end - z_start
+    
+    # The cutting starts from the largest required diameter
+    # For external turning, this is the stock diameter
+    max_radius = x_stock
+    
+    # Determine retract position - always clear of the work
+    retract_x = max_radius + 2.0
+    
+    # For external turning, we always cut inward (reduce radius)
+    # The depth represents how much material to remove from the starting stock
+    direction = -1
+    
+    # Execute all passes
+    for pass_type, pass_num, total_of_type, depth in passes:
+        # Generate pass description
+        if total_of_type > 1:
+            program.beginPass(f"{pass_type} pass {pass_num} of {total_of_type}")
+        else:
+            program.beginPass(f"{pass_type} pass")
+        
+        # For external turning, we cut from outside in
+        # We start at stock diameter and cut progressively deeper toward target
+        current_cut_depth = depth
+        
+        # Calculate the actual cutting diameter for this pass
+        # Start from stock and work inward by the current cut depth
+        cut_diameter = x_stock - current_cut_depth
+        
+        # Apply taper compensation for the actual cutting positions
+        # For positive angles, diameter increases as Z becomes more negative (toward chuck)
+        # z_lead is positive (away from chuck), z_travel is negative (toward chuck)
+        adjusted_x_start = cut_diameter - (z_lead * math.tan(angle_rad))
+        adjusted_x_end = cut_diameter - (z_travel * math.tan(angle_rad))
+        
+        # Execute the pass
+        program.move("G0", x=adjusted_x_start, z=z_lead)
+        program.move("G33", x=adjusted_x_end, z=z_end, pitch=pitch)
+        program.move("G0", x=retract_x)
+        program.move("G0", z=z_start)
+    
+    # Return to safe position
+    program.move("G0", x=x_return, z=z_return)
+    
+    return program
+
+
+# Parameters that determine a preview program, with their types
+THREADING_PREVIEW_PARAMS = (
+    ("XStart", float), ("ZStart", float), ("Pitch", float),
+    ("XDepth", float), ("ZDepth", float), ("XEnd", float), ("ZEnd", float),
+    ("XPullout", float), ("ZPullout", float), ("FirstCut", float),
+    ("CutMult", float), ("MinCut", float), ("SpringCuts", int),
+    ("XReturn", float), ("ZReturn", float),
+)
+TURNING_PREVIEW_PARAMS = (
+    ("Pitch", float), ("Stock", float), ("Target", float), ("ZLead", float),
+    ("ZEnd", float), ("Angle", float), ("StepDown", float),
+    ("FinalStepDown", float), ("SpringPasses", int),
+    ("XReturn", float), ("ZReturn", float),
+)
+CYCLE_PREVIEWS = {
+    "threading": (THREADING_PREVIEW_PARAMS, build_threading_program),
+    "turning": (TURNING_PREVIEW_PARAMS, build_turning_program),
+}
+
+
+def normalize_cycle_params(spec, params):
+    """Hashable tuple of the parameters in spec, so that e.g. "1.5", 1.5
+    and -0.0/0.0 share a cache entry"""
+    values = []
+    for name, convert in spec:
+        value = convert(params[name])
+        if not math.isfinite(value):
+            raise ValueError(f"{name} must be a finite number")
+        values.append(value + 0)
+    return tuple(values)
+
+
+def threading_batch(param_sets):
+    """Pass lists and summaries of threading parameter sets. The cut
+    recurrence depends on the previous pass, so each set is planned on its
+    own."""
+    names = [name for name, _ in THREADING_PREVIEW_PARAMS]
+    results = []
+    for params in param_sets:
+        try:
+            values = dict(zip(names, normalize_cycle_params(THREADING_PREVIEW_PARAMS, params)))
+            passes = plan_threading_passes(
+                values["FirstCut"], values["CutMult"], values["MinCut"], values["SpringCuts"],
+                values["XDepth"], values["ZDepth"],
+            )
+            if not passes:
+                raise CycleScheduleError("No passes planned")
+        except (KeyError, TypeError, ValueError) as e:
+            results.append({"status": "Error", "message": f"Invalid threading parameters: {str(e)}"})
+            continue
+        cuts = np.array([cut for cut, _, _ in passes])
+        thread_length = math.hypot(values["XEnd"] - values["XStart"], values["ZEnd"] - values["ZStart"])
+        results.append({
+            "status": "OK",
+            "passes": [
+                {"number": number, "cut": cut, "x": x_cut, "z": z_cut}
+                for number, (cut, x_cut, z_cut) in enumerate(passes, 1)
+            ],
+            "summary": {
+                "pass_count": len(passes),
+                "spring_passes": max(values["SpringCuts"], 0),
+                "min_cut": float(cuts.min()),
+                "max_cut": float(cuts.max()),
+                "mean_cut": float(cuts.mean()),
+                "cut_length": len(passes) * thread_length,
+            },
+        })
+    return results
+
+
+def turning_batch(param_sets):
+    """Pass lists and summaries of turning parameter sets, with the roughing
+    depths of all sets computed in one vectorized step"""
+    names = [name for name, _ in TURNING_PREVIEW_PARAMS]
+    results = [None] * len(param_sets)
+    plans = []
+    for index, params in enumerate(param_sets):
+        try:
+            values = dict(zip(names, normalize_cycle_params(TURNING_PREVIEW_PARAMS, params)))
+            counts = turning_pass_counts(
+                values["Stock"], values["Target"], values["StepDown"],
+                values["FinalStepDown"], values["SpringPasses"],
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            results[index] = {"status": "Error", "message": f"Invalid turning parameters: {str(e)}"}
+            continue
+        plans.append((index, values, counts))
+
+    # Same arithmetic as plan_turning_passes: min((i + 1) * step, remaining)
+    roughing = np.array([count for _, _, (_, _, count) in plans], dtype=np.int64)
+    offsets = np.cumsum(roughing) - roughing
+    numbers = np.arange(roughing.sum()) - np.repeat(offsets, roughing) + 1
+    depths = np.minimum(
+        numbers * np.repeat(np.array([values["StepDown"] for _, values, _ in plans]), roughing),
+        np.repeat(np.array([remaining for _, _, (_, remaining, _) in plans]), roughing),
+    )
+
+    for (index, values, (total, _, count)), offset in zip(plans, offsets.tolist()):
+        roughing_depths = depths[offset:offset + count]
+        steps = np.diff(roughing_depths, prepend=0.0, append=total)
+        spring_passes = max(values["SpringPasses"], 0)
+        pass_length = abs(values["ZEnd"] - values["ZLead"]) / math.cos(math.radians(values["Angle"]))
+        passes = [
+            {"type": "Roughing", "number": number, "count": count, "depth": depth}
+            for number, depth in enumerate(roughing_depths.tolist(), 1)
+        ]
+        passes.append({"type": "Final", "number": 1, "count": 1, "depth": total})
+        passes.extend(
+            {"type": "Spring", "number": number, "count": spring_passes, "depth": total}
+            for number in range(1, spring_passes + 1)
+        )
+        results[index] = {
+            "status": "OK",
+            "passes": passes,
+            "summary": {
+                "pass_count": len(passes),
+                "roughing_passes": count,
+                "spring_passes": spring_passes,
+                "total_depth": total,
+                "min_step": float(steps.min()),
+                "max_step": float(steps.max()),
+                "cut_length": len(passes) * pass_length,
+            },
+        }
+    return results
+
+
+CYCLE_BATCHES = {
+    "threading": threading_batch,
+    "turning": turning_batch,
+}
+
+
+def move_time(length, velocity, acceleration):
+    """Seconds for a straight move that starts and ends at rest, with a
+    trapezoidal velocity profile"""
+    if length <= 0:
+        return 0.0
+    if length * acceleration >= velocity * velocity:
+        return length / velocity + velocity / acceleration
+    return 2 * math.sqrt(length / acceleration)
+
+
+CYCLE_MOVE_KINDS = {"G0": "rapid", "G1": "feed", "G33": "synced"}
+
+
+def cycle_motion_times(program, spindle_rps, axis_limits, max_velocity, start=None):
+    """(kind, seconds) of every move in program.toolpath, kind being
+    "rapid", "feed" or "synced".
+
+    Moves are timed from rest to rest, so blending only makes the machine
+    faster. G0 and G1 moves accelerate at the axis_limits, (velocity,
+    acceleration) per axis, of the axes they move, G0 up to max_velocity
+    and the axis velocity limits and G1 up to the programmed feed. A
+    G33 move takes one spindle revolution per pitch of Z travel, or of its
+    length when Z does not move, and one following another kind of move
+    first waits half a revolution on average for the index pulse. Without a
+    start (x, z) position, moves before both axes are known take no time."""
+    x, z = start if start is not None else (None, None)
+    feed_velocity = program.feedrate * 25.4
+    times = []
+    synced = False
+    for _, code, x_end, z_end, pitch in program.toolpath:
+        x_end = x if x_end is None else x_end
+        z_end = z if z_end is None else z_end
+        seconds = 0.0
+        if None not in (x, z, x_end, z_end):
+            dx = x_end - x
+            dz = z_end - z
+            length = math.hypot(dx, dz)
+            if code == "G33":
+                if not pitch > 0:
+                    raise ValueError("Pitch must be positive")
+                seconds = (abs(dz) if dz else length) / pitch / spindle_rps
+                if not synced:
+                    seconds += 0.5 / spindle_rps
+            elif length > 0:
+                velocity = max_velocity if code == "G0" else feed_velocity
+                acceleration = math.inf
+                for axis, delta in (("x", dx), ("z", dz)):
+                    if delta:
+                        axis_velocity, axis_acceleration = axis_limits[axis]
+                        velocity = min(velocity, axis_velocity * length / abs(delta))
+                        acceleration = min(acceleration, axis_acceleration * length / abs(delta))
+                seconds = move_time(length, velocity, acceleration)
+        times.append((CYCLE_MOVE_KINDS[code], seconds))
+        synced = code == "G33"
+        x, z = x_end, z_end
+    return times
+
+
+def estimate_cycle_time(program, spindle_rpm, axis_limits, max_velocity, start=None):
+    """Estimated run time of program in seconds, in total, by kind of move
+    and per pass, see cycle_motion_times"""
+    times = cycle_motion_times(program, spindle_rpm / 60.0, axis_limits, max_velocity, start)
+    totals = {"rapid": 0.0, "feed": 0.0, "synced": 0.0, "dwell": 0.0}
+    pass_lines = [line for line, _ in program.passes]
+    pass_times = [0.0] * len(pass_lines)
+    timed_lines = [
+        (line, kind, seconds) for line, (kind, seconds) in zip(program.motion_lines, times)
+    ] + [(line, "dwell", seconds) for line, seconds in program.dwells]
+    for line, kind, seconds in timed_lines:
+        totals[kind] += seconds
+        index = bisect.bisect_right(pass_lines, line) - 1
+        if index >= 0:
+            pass_times[index] += seconds
+    return {
+        "total": sum(totals.values()),
+        **totals,
+        "spindle_rpm": spindle_rpm,
+        "passes": [
+            {"label": label, "seconds": seconds}
+            for (_, label), seconds in zip(program.passes, pass_times)
+        ],
+    }
+
+
+def turning_pass_loads(passes, pitch):
+    """(cut depth, chip cross section) of every turning pass, the cross
+    section being the depth times the feed per revolution"""
+    loads = []
+    reached = 0.0
+    for _, _, _, depth in passes:
+        cut = max(depth - reached, 0.0)
+        loads.append((cut, cut * pitch))
+        reached = max(reached, depth)
+    return loads
+
+
+def threading_pass_loads(passes, thread_angle):
+    """(cut depth along the infeed, chip cross section) of every threading
+    pass. The cross section is the part of a V groove of thread_angle
+    between the radial depths before and after the pass, so spring passes
+    remove nothing."""
+    tan_half = math.tan(math.radians(thread_angle) / 2)
+    loads = []
+    reached = 0.0
+    radial = 0.0
+    for _, x_cut, z_cut in passes:
+        depth = math.hypot(x_cut, z_cut)
+        loads.append((
+            max(depth - reached, 0.0),
+            max(x_cut * x_cut - radial * radial, 0.0) * tan_half,
+        ))
+        reached = max(reached, depth)
+        radial = max(radial, abs(x_cut))
+    return loads
+
+
+def cycle_load(loads, max_cut, max_chip_area):
+    """Largest fraction of max_cut or max_chip_area any pass uses, limits
+    that are None ignored"""
+    load = 0.0
+    for cut, area in loads:
+        if max_cut is not None:
+            load = max(load, cut / max_cut)
+        if max_chip_area is not None:
+            load = max(load, area / max_chip_area)
+    return load
+
+
+def cycle_pass_loads(kind, params, thread_angle):
+    if kind == "threading":
+        passes = plan_threading_passes(
+            params["FirstCut"], params["CutMult"], params["MinCut"], params["SpringCuts"],
+            params["XDepth"], params["ZDepth"],
+        )
+        loads = threading_pass_loads(passes, thread_angle)
+    else:
+        passes = plan_turning_passes(
+            params["Stock"], params["Target"], params["StepDown"],
+            params["FinalStepDown"], params["SpringPasses"],
+        )
+        loads = turning_pass_loads(passes, abs(params["Pitch"]))
+    if not passes:
+        raise CycleScheduleError("No passes planned")
+    return passes, loads
+
+
+def optimize_turning_passes(params, max_cut, max_chip_area, thread_angle):
+    """StepDown giving the fewest turning passes that keep every cut within
+    max_cut and every chip cross section within max_chip_area. FinalStepDown
+    and SpringPasses are kept, so the final pass must already fit."""
+    limit = math.inf
+    if max_cut is not None:
+        limit = max_cut
+    if max_chip_area is not None:
+        pitch = abs(params["Pitch"])
+        if not pitch > 0:
+            raise ValueError("Pitch must be positive to limit the chip area")
+        limit = min(limit, max_chip_area / pitch)
+
+    total = abs(params["Stock"] - params["Target"])
+    remaining = total - params["FinalStepDown"]
+    if total - max(remaining, 0.0) > limit * (1 + 1e-9):
+        raise CycleScheduleError("FinalStepDown exceeds the cut limits")
+    if remaining <= 0:
+        return {}
+
+    # Equal steps, rounded up to 0.1um so that they surely add up to the
+    # depth, and the limit itself as the fallback
+    count = math.ceil(remaining / limit)
+    step = remaining / count
+    candidates = [math.ceil(step * 1e4) / 1e4, math.ceil(step * 1e4 + 1) / 1e4, step, limit]
+    best = None
+    for step_down in candidates:
+        if step_down > limit * (1 + 1e-9):
+            continue
+        proposal = dict(params, StepDown=step_down)
+        passes, loads = cycle_pass_loads("turning", proposal, thread_angle)
+        if cycle_load(loads, max_cut, max_chip_area) > 1 + 1e-9:
+            continue
+        if best is None or len(passes) < best[0]:
+            best = (len(passes), step_down)
+    if best is None:
+        raise CycleScheduleError("No StepDown keeps every pass within the limits")
+    return {"StepDown": best[1]}
+
+
+def optimize_threading_passes(params, max_cut, max_chip_area, thread_angle):
+    """FirstCut, CutMult and MinCut giving the fewest threading passes that
+    keep every cut within max_cut and every chip cross section within
+    max_chip_area.
+
+    A grid of schedules up to the largest first cut the limits allow is
+    run through the plan_threading_passes recurrence at once, pass by pass,
+    until a schedule reaches full depth within the limits. Ties go to the
+    schedule leaving the most margin, and the winner is checked with
+    plan_threading_passes itself."""
+    if params["SpringCuts"] < 0:
+        raise CycleScheduleError("No passes planned, SpringCuts is negative")
+    x_depth = params["XDepth"]
+    z_depth = params["ZDepth"]
+    compound_dist = math.hypot(x_depth, z_depth)
+    if compound_dist == 0:
+        raise CycleScheduleError("XDepth and ZDepth leave nothing to cut")
+    k_x = x_depth / compound_dist
+    k_z = z_depth / compound_dist
+    tan_half = math.tan(math.radians(thread_angle) / 2)
+
+    first_max = compound_dist
+    if max_cut is not None:
+        first_max = min(first_max, max_cut)
+    if max_chip_area is not None and k_x != 0:
+        first_max = min(first_max, math.sqrt(max_chip_area / tan_half) / abs(k_x))
+    # Proposals are rounded down to 0.1um
+    first_max = math.floor(first_max * 1e4) / 1e4
+    if first_max <= 0:
+        raise CycleScheduleError("The cut limits allow no cut of at least 0.0001")
+    firsts = np.unique(np.floor(first_max * np.linspace(0.5, 1.0, 11) * 1e4) / 1e4)
+    mults = np.arange(50, 101) / 100
+    mins = np.unique(np.floor(first_max * np.arange(41) / 40 * 1e4) / 1e4)
+    first_cut, cut_mult, min_cut = (
+        grid.ravel() for grid in np.meshgrid(firsts[firsts > 0], mults, mins, indexing="ij")
+    )
+
+    # Geometric series that never reach depth, as in plan_threading_passes,
+    # and minimum cuts above the first one are left out
+    with np.errstate(divide="ignore"):
+        active = (min_cut <= first_cut) & ~(
+            (min_cut == 0) & (x_depth != 0) & (cut_mult < 1)
+            & (first_cut / (1 - cut_mult) <= compound_dist)
+        )
+    cut_size = np.zeros_like(first_cut)
+    x_cut = np.zeros_like(first_cut)
+    z_cut = np.zeros_like(first_cut)
+    reached = np.zeros_like(first_cut)
+    load = np.zeros_like(first_cut)
+    for _ in range(CYCLE_MAX_PASSES):
+        cut_size = np.where(cut_size == 0.0, first_cut, cut_size * cut_mult)
+        cut_size = np.where(np.abs(cut_size) < min_cut, min_cut, cut_size)
+        previous_x = x_cut
+        x_cut = x_cut + cut_size * k_x
+        z_cut = z_cut + cut_size * k_z
+        done = np.abs(x_cut) >= abs(x_depth)
+        x_cut = np.where(done, x_depth, x_cut)
+        z_cut = np.where(done, z_depth, z_cut)
+        depth = np.hypot(x_cut, z_cut)
+        if max_cut is not None:
+            load = np.maximum(load, (depth - reached) / max_cut)
+        if max_chip_area is not None:
+            area = (x_cut * x_cut - previous_x * previous_x) * tan_half
+            load = np.maximum(load, area / max_chip_area)
+        active &= load <= 1 + 1e-9
+        reached = depth
+
+        finished = np.flatnonzero(active & done)
+        for index in finished[np.argsort(load[finished], kind="stable")]:
+            proposal = {
+                "FirstCut": float(first_cut[index]),
+                "CutMult": float(cut_mult[index]),
+                "MinCut": float(min_cut[index]),
+            }
+            try:
+                _, loads = cycle_pass_loads("threading", dict(params, **proposal), thread_angle)
+            except CycleScheduleError:
+                continue
+            if cycle_load(loads, max_cut, max_chip_area) <= 1 + 1e-9:
+                return proposal
+        active &= ~done
+        if not active.any():
+            break
+    raise CycleScheduleError("No FirstCut, CutMult and MinCut keep every pass within the limits")
+
+
+CYCLE_OPTIMIZERS = {
+    "threading": optimize_threading_passes,
+    "turning": optimize_turning_passes,
+}
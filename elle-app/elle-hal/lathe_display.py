@@ -1,319 +1,413 @@
 #!/usr/bin/env python3
 import os
 import shutil
-import json
+import tempfile
+import atexit
 import base64
+import hashlib
+import threading
+import itertools
+import queue
+import time
+import multiprocessing
+import multiprocessing.forkserver
+from collections import OrderedDict
 
-import tempfile
 import linuxcnc
-import gcode
-import rs274.glcanon
-import rs274.interpret
+
+from lathe_backplot import fileMtime, ndjsonFrame
+from lathe_metrics import Metrics, instrumentApp
 
 from flask import Flask
 from flask_cors import CORS
 from flask import request
+from flask import Response
+
+# Backplot results are cached in memory, and optionally on disk when
+# ELLE_BACKPLOT_CACHE_DIR is set
+BACKPLOT_CACHE_SIZE = 64
+BACKPLOT_DISK_CACHE_SIZE = 512
+BACKPLOT_DISK_CACHE_DIR = os.environ.get("ELLE_BACKPLOT_CACHE_DIR")
+
+# Opt-in binary backplot formats, selected through the Accept header. JSON
+# stays the default for clients that do not ask for them.
+BACKPLOT_JSON_MIMETYPE = "application/json"
+BACKPLOT_FLOAT32_MIMETYPE = "application/vnd.elle.backplot.f32"
+BACKPLOT_INT16_MIMETYPE = "application/vnd.elle.backplot.i16"
 
-c = linuxcnc.command()
+# Previews run in pre-forked interpreter worker processes. ELLE_BACKPLOT_WORKERS=0
+# runs them inside the request thread instead.
+BACKPLOT_WORKERS = int(os.environ.get("ELLE_BACKPLOT_WORKERS", min(4, os.cpu_count() or 1)))
+BACKPLOT_QUEUE_SIZE = 8
+BACKPLOT_JOB_TIMEOUT = 30.0
+BACKPLOT_SUPERSEDE_CHECK_INTERVAL = 0.05
+
+# Streamed previews are sent as NDJSON, flushing the lines interpreted so far
+# at most once per interval
+BACKPLOT_STREAM_MIMETYPE = "application/x-ndjson"
+BACKPLOT_STREAM_FLUSH_INTERVAL = 0.1
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
+metrics = Metrics("elle_display")
+metrics.histogram("backplot_interpret_seconds", "Time spent in the rs274 interpreter")
+metrics.histogram("backplot_serialize_seconds", "Time spent encoding backplot results")
+instrumentApp(app, metrics)
 
-class NullProgress:
-    def nextphase(self, var1):
-        pass
 
-    def progress(self):
-        pass
+class BackplotCache:
+    """Bounded LRU cache of encoded backplot results keyed by content hash"""
 
+    def __init__(self, size, disk_dir=None, disk_size=0):
+        self.size = size
+        self.disk_dir = disk_dir
+        self.disk_size = disk_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
 
-class StatCanon(rs274.glcanon.GLCanon, rs274.interpret.StatMixin):
-    def __init__(
-        self, colors, geometry, is_foam, lathe_view_option, stat, random, arcdivision
-    ):
-        rs274.glcanon.GLCanon.__init__(self, colors, geometry)
-        rs274.interpret.StatMixin.__init__(self, stat, random)
-        self.progress = NullProgress()
-        self.lathe_view_option = lathe_view_option
-        self.arcdivision = arcdivision
-        self.is_foam = is_foam
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+        result = self.read_disk(key)
+        with self.lock:
+            if result is not None:
+                self.disk_hits += 1
+                self.store(key, result)
+            else:
+                self.misses += 1
+        return result
 
-    def is_lathe(self):
-        return self.lathe_view_option
+    def put(self, key, result):
+        with self.lock:
+            self.store(key, result)
+        self.write_disk(key, result)
 
+    def store(self, key, result):
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
 
-def sortByLine(elem):
-    return elem["line"]
+    def disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.backplot")
 
+    def read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self.disk_path(key), "rb") as f:
+                result = f.read()
+            os.utime(self.disk_path(key))
+            return result
+        except OSError:
+            return None
 
-class BackplotGenerator(rs274.glcanon.GlCanonDraw):
-    def __init__(self, inifile):
-        self.inifile = linuxcnc.ini(inifile)
-        self.inifile_path = os.path.split(inifile)[0]
-        self.select_primed = None
-        rs274.glcanon.GlCanonDraw.__init__(self, linuxcnc.stat(), None)
-        live_axis_count = 0
-        for i, j in enumerate("XYZABCUVW"):
-            if self.stat.axis_mask & (1 << i) == 0:
-                continue
-            live_axis_count += 1
-        self.num_joints = int(self.inifile.find("KINS", "JOINTS") or live_axis_count)
-        self.foam_option = bool(self.inifile.find("DISPLAY", "FOAM"))
-        temp = self.inifile.find("DISPLAY", "LATHE")
-        self.lathe_option = bool(temp == "1" or temp == "True" or temp == "true")
-        self.a_axis_wrapped = bool(self.inifile.find("AXIS_A", "WRAPPED_ROTARY"))
-        self.b_axis_wrapped = bool(self.inifile.find("AXIS_B", "WRAPPED_ROTARY"))
-        self.c_axis_wrapped = bool(self.inifile.find("AXIS_C", "WRAPPED_ROTARY"))
-
-    def load(self, filepath):
-        self._current_file = filepath
+    def write_disk(self, key, result):
+        if not self.disk_dir:
+            return
         try:
-            self.stat.poll()
-            random_toolchanger = int(
-                self.inifile.find("EMCIO", "RANDOM_TOOLCHANGER") or 0
-            )
-            arcdivision = int(self.inifile.find("DISPLAY", "ARCDIVISION") or 64)
-            self.canon = StatCanon(
-                None,
-                self.inifile.find("DISPLAY", "GEOMETRY") or "XYZ",
-                self.foam_option,
-                self.lathe_option,
-                self.stat,
-                random_toolchanger,
-                arcdivision,
+            tmp_path = self.disk_path(key) + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(result)
+            os.replace(tmp_path, self.disk_path(key))
+            files = [
+                os.path.join(self.disk_dir, name)
+                for name in os.listdir(self.disk_dir)
+                if name.endswith(".backplot")
+            ]
+            if len(files) > self.disk_size:
+                files.sort(key=os.path.getmtime)
+                for path in files[: len(files) - self.disk_size]:
+                    os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "size": self.size,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "disk_dir": self.disk_dir,
+            }
+
+
+class BackplotSource:
+    """Tracks the ini contents and parameter file that key the cache"""
+
+    def __init__(self, inifile):
+        self.inifile_name = inifile
+        self.ini_mtime = None
+        self.lock = threading.Lock()
+
+    def fingerprint(self):
+        with self.lock:
+            if fileMtime(self.inifile_name) != self.ini_mtime:
+                self.ini_mtime = fileMtime(self.inifile_name)
+                with open(self.inifile_name, "rb") as f:
+                    self.ini_contents = f.read()
+                self.parameter_file = os.path.join(
+                    os.path.split(self.inifile_name)[0],
+                    os.path.basename(
+                        linuxcnc.ini(self.inifile_name).find("RS274NGC", "PARAMETER_FILE")
+                        or "linuxcnc.var"
+                    ),
+                )
+            return self.ini_contents, fileMtime(self.parameter_file)
+
+
+def backplot_cache_key(gcode_bytes, source, mimetype, tolerance=0.0):
+    """Hash of the G-code, the ini contents, the parameter file mtime, the
+    response format and the decimation tolerance"""
+    ini_contents, parameter_mtime = source.fingerprint()
+    digest = hashlib.sha256()
+    digest.update(mimetype.encode("ascii"))
+    digest.update(repr(float(tolerance)).encode("ascii"))
+    digest.update(gcode_bytes)
+    digest.update(ini_contents)
+    digest.update(str(parameter_mtime).encode("ascii"))
+    return digest.hexdigest()
+
+
+backplot_generator = None
+backplot_generator_lock = threading.Lock()
+
+
+def get_backplot_generator(scratch_dir=None):
+    """The process wide generator. Workers are killed rather than shut down,
+    so they pass in a scratch_dir that the server process removes."""
+    global backplot_generator
+    with backplot_generator_lock:
+        if backplot_generator is None:
+            from lathe_interpreter import BackplotGenerator
+
+            backplot_generator = BackplotGenerator(
+                os.path.join(os.getcwd(), "lathe.ini"), scratch_dir
             )
-            parameter_file = os.path.join(
-                self.inifile_path,
-                os.path.basename(
-                    self.inifile.find("RS274NGC", "PARAMETER_FILE") or "linuxcnc.var"
-                ),
+            if scratch_dir is None:
+                atexit.register(shutil.rmtree, backplot_generator.scratch_dir, True)
+        return backplot_generator
+
+
+def render_backplot(gcode_bytes, mimetype, emit, tolerance=0.0):
+    """Render a backplot, returning the interpreter and serialization time.
+    Streamed renders interleave both and count as interpreter time."""
+    bp = get_backplot_generator()
+    with bp.lock:
+        started = time.perf_counter()
+        bp.refresh()
+        if mimetype == BACKPLOT_STREAM_MIMETYPE:
+            bp.streamGcode(gcode_bytes, emit, BACKPLOT_STREAM_FLUSH_INTERVAL)
+            return {"interpret": time.perf_counter() - started, "serialize": 0.0}
+        bp.loadGcode(gcode_bytes)
+        interpreted = time.perf_counter()
+        if mimetype == BACKPLOT_JSON_MIMETYPE:
+            result = bp.toJson(tolerance).encode("utf-8")
+        else:
+            result = bp.toBinary(mimetype == BACKPLOT_INT16_MIMETYPE, tolerance)
+        timings = {
+            "interpret": interpreted - started,
+            "serialize": time.perf_counter() - interpreted,
+        }
+    emit(result)
+    return timings
+
+
+def record_render_timings(mimetype, timings):
+    metrics.observe("backplot_interpret_seconds", timings["interpret"], format=mimetype)
+    if mimetype != BACKPLOT_STREAM_MIMETYPE:
+        metrics.observe("backplot_serialize_seconds", timings["serialize"], format=mimetype)
+
+
+class BackplotJobError(Exception):
+    def __init__(self, message, status_code):
+        Exception.__init__(self, message)
+        self.status_code = status_code
+
+
+def backplot_worker_main(conn, scratch_dir):
+    # Warm up the generator before the first job arrives
+    get_backplot_generator(scratch_dir)
+    while True:
+        try:
+            gcode_bytes, mimetype, tolerance = conn.recv()
+        except EOFError:
+            return
+        try:
+            timings = render_backplot(
+                gcode_bytes, mimetype, lambda chunk: conn.send(("Chunk", chunk)), tolerance
             )
-            with tempfile.TemporaryDirectory() as tmpdirname:
-                tmp_parameter_file = os.path.join(tmpdirname, "backplot.var")
-                if os.path.exists(parameter_file):
-                    shutil.copy(parameter_file, tmp_parameter_file)
-                self.canon.parameter_file = tmp_parameter_file
-                initcode = self.inifile.find("RS274NGC", "RS274NGC_STARTUP_CODE") or ""
-                result, seq = self.load_preview(filepath, self.canon, "G18 G8 G21 G90", initcode)
-                if result > gcode.MIN_ERROR:
+            conn.send(("OK", timings))
+        except Exception as e:
+            conn.send(("Error", str(e)))
+
+
+class BackplotWorker:
+    def __init__(self, context, scratch_root):
+        self.scratch_dir = tempfile.mkdtemp(dir=scratch_root)
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=backplot_worker_main, args=(child_conn, self.scratch_dir), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+        shutil.rmtree(self.scratch_dir, True)
+
+
+class BackplotWorkerPool:
+    """Pre-forked interpreter processes with a bounded job queue.
+
+    A newer job from the same client supersedes an older one, whether it is
+    still queued or already running. Running jobs that are superseded or
+    exceed the timeout have their worker killed and replaced. Workers are
+    given scratch directories under one the pool owns, since a killed
+    worker cannot clean up after itself.
+
+    The initial workers are forked in start(), before the server threads
+    exist. Replacements are started from a forkserver instead, since
+    forking a process that is running server threads can copy locks held
+    by those threads."""
+
+    def __init__(self, size, queue_size, timeout):
+        self.size = size
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.context = multiprocessing.get_context("fork")
+        self.replace_context = multiprocessing.get_context("forkserver")
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.latest = {}
+        self.sequence = itertools.count()
+        self.scratch_root = None
+        self.started = False
+
+    def start(self):
+        self.scratch_root = tempfile.mkdtemp(prefix="elle-backplot-")
+        atexit.register(self.stop)
+        for i in range(self.size):
+            self.idle.put(BackplotWorker(self.context, self.scratch_root))
+        # Start the forkserver now, with the interpreter modules already
+        # imported, so replacements only have to build their generator
+        self.replace_context.set_forkserver_preload(
+            ["__main__", "lathe_display", "lathe_interpreter"]
+        )
+        multiprocessing.forkserver.ensure_running()
+        self.started = True
+
+    def stop(self):
+        """Kill the idle workers and remove all scratch directories"""
+        while True:
+            try:
+                self.idle.get_nowait().kill()
+            except queue.Empty:
+                break
+        if self.scratch_root is not None:
+            shutil.rmtree(self.scratch_root, True)
+
+    def superseded(self, client, job):
+        with self.lock:
+            return self.latest.get(client) != job
+
+    def replace(self, worker):
+        worker.kill()
+        return BackplotWorker(self.replace_context, self.scratch_root)
+
+    def run(self, client, gcode_bytes, mimetype, tolerance=0.0):
+        """Run a job on a worker, yielding its output chunks as they arrive"""
+        with self.lock:
+            if self.pending >= self.queue_size:
+                raise BackplotJobError("Backplot queue is full", 503)
+            self.pending += 1
+            job = next(self.sequence)
+            self.latest[client] = job
+        try:
+            worker = None
+            while worker is None:
+                if self.superseded(client, job):
+                    raise BackplotJobError("Backplot request superseded", 409)
+                try:
+                    worker = self.idle.get(timeout=BACKPLOT_SUPERSEDE_CHECK_INTERVAL)
+                except queue.Empty:
                     pass
+            done = False
+            try:
+                deadline = time.monotonic() + self.timeout
+                worker.conn.send((gcode_bytes, mimetype, tolerance))
+                while True:
+                    while not worker.conn.poll(BACKPLOT_SUPERSEDE_CHECK_INTERVAL):
+                        if self.superseded(client, job):
+                            raise BackplotJobError("Backplot request superseded", 409)
+                        if time.monotonic() > deadline:
+                            raise BackplotJobError("Backplot request timed out", 504)
+                    status, result = worker.conn.recv()
+                    if status != "Chunk":
+                        break
+                    yield result
+                done = True
+            except (EOFError, OSError):
+                raise BackplotJobError("Backplot worker failed", 500)
+            finally:
+                # A worker left mid-job, including by a client that stopped
+                # reading a stream, is killed rather than waited for
+                if not done:
+                    worker = self.replace(worker)
+                self.idle.put(worker)
+            if status != "OK":
+                raise BackplotJobError(f"Error generating backplot: {result}", 500)
+            record_render_timings(mimetype, result)
         finally:
-            pass
+            with self.lock:
+                self.pending -= 1
+                if self.latest.get(client) == job:
+                    del self.latest[client]
 
-    def toJson(self):
-        data = []
-        if self.canon.feed and self.canon.feed[0]:
-            currentline = self.canon.feed[0][0]
-            feed = []
-            for entry in self.canon.feed:
-                if currentline != entry[0]:
-                    data.append({"type": "feed", "line": currentline, "feed": feed})
-                    currentline = entry[0]
-                    feed = []
-                feed.append(
-                    {
-                        "coords": [
-                            entry[1][0],
-                            entry[1][1],
-                            entry[1][2],
-                            entry[2][0],
-                            entry[2][1],
-                            entry[2][2],
-                        ],
-                        "rate": entry[3],
-                        "offset": [entry[4][0], entry[4][1], entry[4][2]],
-                    }
-                )
-            data.append({"type": "feed", "line": currentline, "feed": feed})
-
-        if self.canon.arcfeed and self.canon.arcfeed[0]:
-            currentline = self.canon.arcfeed[0][0]
-            arc = []
-            for entry in self.canon.arcfeed:
-                if entry[0] != currentline:
-                    data.append(
-                        {"type": "arcfeed", "line": currentline, "arcfeed": arc}
-                    )
-                    currentline = entry[0]
-                    arc = []
-                arc.append(
-                    {
-                        "coords": [
-                            entry[1][0],
-                            entry[1][1],
-                            entry[1][2],
-                            entry[2][0],
-                            entry[2][1],
-                            entry[2][2],
-                        ],
-                        "rate": entry[3],
-                        "offset": [entry[4][0], entry[4][1], entry[4][2]],
-                    }
-                )
-            data.append({"type": "arcfeed", "line": currentline, "arcfeed": arc})
-
-        if self.canon.traverse and self.canon.traverse[0]:
-            currentline = self.canon.traverse[0][0]
-            trav = []
-            for entry in self.canon.traverse:
-                if entry[0] != currentline:
-                    data.append({"type": "trav", "line": currentline, "trav": trav})
-                    trav = []
-                    currentline = entry[0]
-                trav.append(
-                    {
-                        "coords": [
-                            entry[1][0],
-                            entry[1][1],
-                            entry[1][2],
-                            entry[2][0],
-                            entry[2][1],
-                            entry[2][2],
-                        ],
-                        "offset": [entry[3][0], entry[3][1], entry[3][2]],
-                    }
-                )
-            data.append({"type": "trav", "line": currentline, "trav": trav})
-
-        if self.canon.dwells and self.canon.dwells[0]:
-            currentline = self.canon.dwells[0][0]
-            trav = []
-            for entry in self.canon.dwells:
-                if entry[0] != currentline:
-                    data.append({"type": "dwell", "line": currentline, "trav": trav})
-                    trav = []
-                    currentline = entry[0]
-                trav.append(
-                    {"color": [entry[1]], "coord": [entry[0], entry[1], entry[2]]}
-                )
-            data.append({"type": "dwell", "line": currentline, "dwell": trav})
-
-        data.sort(key=sortByLine)
-        
-        min_x = min_y = min_z = float('inf')
-        max_x = max_y = max_z = float('-inf')
-        
-        for entry in data:
-            entry_type = entry["type"]
-            if entry_type in ["feed", "arcfeed", "trav"]:
-                moves = entry.get(entry_type, [])
-                for move in moves:
-                    coords = move.get("coords", [])
-                    if len(coords) >= 6:
-                        min_x = min(min_x, coords[0])
-                        min_y = min(min_y, coords[1])
-                        min_z = min(min_z, coords[2])
-                        max_x = max(max_x, coords[0])
-                        max_y = max(max_y, coords[1])
-                        max_z = max(max_z, coords[2])
-                        
-                        min_x = min(min_x, coords[3])
-                        min_y = min(min_y, coords[4])
-                        min_z = min(min_z, coords[5])
-                        max_x = max(max_x, coords[3])
-                        max_y = max(max_y, coords[4])
-                        max_z = max(max_z, coords[5])
-        
-        if min_x == float('inf'):
-            min_x = min_y = min_z = -1.0
-            max_x = max_y = max_z = 1.0
-        
-        # Store original extents before transformation
-        original_min_x, original_min_y, original_min_z = min_x, min_y, min_z
-        original_max_x, original_max_y, original_max_z = max_x, max_y, max_z
-        
-        # Check if LinuxCNC interpreted coordinates as inches instead of mm
-        # If the coordinate range is much smaller than expected, apply conversion
-        coordinate_range = max(abs(max_x - min_x), abs(max_y - min_y), abs(max_z - min_z))
-        if coordinate_range > 0 and coordinate_range < 10:  # Suspiciously small for typical machining
-            # Apply inch to mm conversion (25.4x) to all coordinates
-            units_scale = 25.4
-            min_x *= units_scale
-            min_y *= units_scale 
-            min_z *= units_scale
-            max_x *= units_scale
-            max_y *= units_scale
-            max_z *= units_scale
-            
-            original_min_x *= units_scale
-            original_min_y *= units_scale
-            original_min_z *= units_scale
-            original_max_x *= units_scale
-            original_max_y *= units_scale
-            original_max_z *= units_scale
-            
-            # Scale all coordinate data
-            for entry in data:
-                entry_type = entry["type"]
-                if entry_type in ["feed", "arcfeed", "trav"]:
-                    moves = entry.get(entry_type, [])
-                    for move in moves:
-                        coords = move.get("coords", [])
-                        if len(coords) >= 6:
-                            for i in range(6):
-                                coords[i] *= units_scale
-        
-        center_x = (min_x + max_x) / 2
-        center_y = (min_y + max_y) / 2
-        center_z = (min_z + max_z) / 2
-        
-        range_x = abs(max_x - min_x)
-        range_y = abs(max_y - min_y) 
-        range_z = abs(max_z - min_z)
-        max_range = max(range_x, range_y, range_z)
-        
-        scale_factor = 2.0 / max_range if max_range > 0 else 1.0
-        
-        for entry in data:
-            entry_type = entry["type"]
-            if entry_type in ["feed", "arcfeed", "trav"]:
-                moves = entry.get(entry_type, [])
-                for move in moves:
-                    coords = move.get("coords", [])
-                    if len(coords) >= 6:
-                        x1 = (coords[0] - center_x) * scale_factor
-                        y1 = (coords[1] - center_y) * scale_factor
-                        z1 = (coords[2] - center_z) * scale_factor
-                        
-                        x2 = (coords[3] - center_x) * scale_factor
-                        y2 = (coords[4] - center_y) * scale_factor
-                        z2 = (coords[5] - center_z) * scale_factor
-                        
-                        coords[0] = z1
-                        coords[1] = y1
-                        coords[2] = x1
-                        
-                        coords[3] = z2
-                        coords[4] = y2
-                        coords[5] = x2
-        
-        norm_min_x = (min_x - center_x) * scale_factor
-        norm_min_y = (min_y - center_y) * scale_factor
-        norm_min_z = (min_z - center_z) * scale_factor
-        norm_max_x = (max_x - center_x) * scale_factor
-        norm_max_y = (max_y - center_y) * scale_factor
-        norm_max_z = (max_z - center_z) * scale_factor
-        
-        min_x = norm_min_z
-        min_y = norm_min_y
-        min_z = norm_min_x
-        max_x = norm_max_z
-        max_y = norm_max_y
-        max_z = norm_max_x
-        
-        
-        rootData = {
-            "backplot": data,
-            "extents": [min_x, min_y, min_z, max_x, max_y, max_z],
-            "transform": {
-                "center": [center_x, center_y, center_z],
-                "scale_factor": scale_factor,
-                "original_min": [original_min_x, original_min_y, original_min_z],
-                "original_max": [original_max_x, original_max_y, original_max_z]
-            }
-        }
-        return json.dumps(rootData, separators=(",", ":"))
+    def submit(self, client, gcode_bytes, mimetype, tolerance=0.0):
+        return b"".join(self.run(client, gcode_bytes, mimetype, tolerance))
+
+
+def backplot_client():
+    return request.headers.get("X-Client-Id", request.remote_addr)
+
+
+backplot_source = BackplotSource(os.path.join(os.getcwd(), "lathe.ini"))
+backplot_pool = BackplotWorkerPool(BACKPLOT_WORKERS, BACKPLOT_QUEUE_SIZE, BACKPLOT_JOB_TIMEOUT)
+
+backplot_cache = BackplotCache(
+    BACKPLOT_CACHE_SIZE, BACKPLOT_DISK_CACHE_DIR, BACKPLOT_DISK_CACHE_SIZE
+)
+
+metrics.gauge(
+    "backplot_cache_requests_total",
+    "Backplot cache lookups by result",
+    lambda: {
+        (("result", key),): value
+        for key, value in backplot_cache.stats().items()
+        if key in ("hits", "disk_hits", "misses")
+    },
+    metric_type="counter",
+)
+metrics.gauge("backplot_cache_entries", "Backplots held in memory", lambda: len(backplot_cache.entries))
+metrics.gauge("backplot_jobs_pending", "Backplot jobs queued or running", lambda: backplot_pool.pending)
+metrics.gauge("backplot_workers_idle", "Idle backplot worker processes", lambda: backplot_pool.idle.qsize())
 
 
 @app.route("/")
@@ -323,22 +417,85 @@ def index():
 
 @app.put("/linuxcnc/backplot")
 def backplot():
-    with tempfile.TemporaryDirectory() as tmpdirname:
-        file_path = os.path.join(tmpdirname, "gcode.ngc")
-        file = open(file_path, "w")
-        gcode_bytes = base64.b64decode(request.json["gcode"])
-        gcode_string = gcode_bytes.decode("ascii")
-        file.write(gcode_string)
-        file.close()
-        lathe_init_path = os.path.join(os.getcwd(), "lathe.ini")
-        bp = BackplotGenerator(lathe_init_path)
-        bp.load(file_path)
-        
-        result = bp.toJson()
+    mimetype = request.accept_mimetypes.best_match(
+        [BACKPLOT_JSON_MIMETYPE, BACKPLOT_FLOAT32_MIMETYPE, BACKPLOT_INT16_MIMETYPE],
+        default=BACKPLOT_JSON_MIMETYPE,
+    )
+    gcode_bytes = base64.b64decode(request.json["gcode"])
+    # Optional chord tolerance in mm for polyline decimation, 0 keeps all moves
+    try:
+        tolerance = float(request.json.get("tolerance", 0.0))
+    except (TypeError, ValueError):
+        tolerance = -1.0
+    if not tolerance >= 0:
+        return {"status": "Error", "message": "Invalid backplot tolerance"}, 400
+    cache_key = backplot_cache_key(gcode_bytes, backplot_source, mimetype, tolerance)
+
+    result = backplot_cache.get(cache_key)
+    if result is None:
+        if backplot_pool.started:
+            try:
+                result = backplot_pool.submit(
+                    backplot_client(), gcode_bytes, mimetype, tolerance
+                )
+            except BackplotJobError as e:
+                return {"status": "Error", "message": str(e)}, e.status_code
+        else:
+            chunks = []
+            timings = render_backplot(gcode_bytes, mimetype, chunks.append, tolerance)
+            record_render_timings(mimetype, timings)
+            result = b"".join(chunks)
+        backplot_cache.put(cache_key, result)
+
+    if mimetype == BACKPLOT_JSON_MIMETYPE:
         return result
+    return Response(result, mimetype=mimetype)
+
+
+@app.put("/linuxcnc/backplot/stream")
+def backplot_stream():
+    """Progressive backplot as NDJSON, see BackplotGenerator.streamGcode"""
+    gcode_bytes = base64.b64decode(request.json["gcode"])
+    cache_key = backplot_cache_key(gcode_bytes, backplot_source, BACKPLOT_STREAM_MIMETYPE)
+
+    result = backplot_cache.get(cache_key)
+    if result is not None:
+        return Response(result, mimetype=BACKPLOT_STREAM_MIMETYPE)
+
+    if not backplot_pool.started:
+        chunks = []
+        timings = render_backplot(gcode_bytes, BACKPLOT_STREAM_MIMETYPE, chunks.append)
+        record_render_timings(BACKPLOT_STREAM_MIMETYPE, timings)
+        result = b"".join(chunks)
+        backplot_cache.put(cache_key, result)
+        return Response(result, mimetype=BACKPLOT_STREAM_MIMETYPE)
+
+    chunks = backplot_pool.run(backplot_client(), gcode_bytes, BACKPLOT_STREAM_MIMETYPE)
+
+    def generate():
+        sent = []
+        try:
+            for chunk in chunks:
+                sent.append(chunk)
+                yield chunk
+        except BackplotJobError as e:
+            yield ndjsonFrame({"type": "error", "status": "Error", "message": str(e)})
+            return
+        backplot_cache.put(cache_key, b"".join(sent))
+
+    return Response(generate(), mimetype=BACKPLOT_STREAM_MIMETYPE)
+
+
+@app.get("/linuxcnc/backplot/cache")
+def backplot_cache_stats():
+    return backplot_cache.stats()
 
 
 if __name__ == "__main__":
     from waitress import serve
 
-    serve(app, host="0.0.0.0", port=8001)
+    if BACKPLOT_WORKERS > 0:
+        backplot_pool.start()
+    metrics.startupStage("ready")
+    # Leave threads for cache hits while the job queue is full
+    serve(app, host="0.0.0.0", port=8001, threads=BACKPLOT_QUEUE_SIZE + 4)
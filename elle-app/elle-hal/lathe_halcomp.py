@@ -4,17 +4,162 @@ import sys
 import linuxcnc
 import time
 import os
+import json
+import threading
+import functools
+import hashlib
+import tempfile
+import bisect
+import uuid
+import math
+import itertools
+from collections import namedtuple
+from collections import OrderedDict
 
 from flask import Flask
 from flask_cors import CORS
 from flask import request
+from flask import Response
+from flask import stream_with_context
+
+from lathe_metrics import Metrics, TimedCommand, instrumentApp
+
+# numpy and lathe_cycles are imported where they are first needed, so that
+# loading them does not delay the component's startup
+
+metrics = Metrics("elle_hal")
+metrics.histogram("linuxcnc_stat_poll_seconds", "Time spent in linuxcnc.stat.poll")
+metrics.histogram("hal_pin_read_seconds", "Time spent reading the hal_in pins")
+metrics.histogram("hal_pin_write_seconds", "Time spent flushing HAL output writes")
+metrics.counter("hal_pin_writes_total", "HAL output pins written, unchanged values skipped")
+metrics.counter("stream_frames_total", "Frames sent on /hal/hal_in/stream")
+metrics.counter(
+    "stream_frames_dropped_total", "Telemetry frames replaced before a slow client took them"
+)
+metrics.gauge(
+    "stream_subscribers", "Clients subscribed to the telemetry hub", lambda: len(telemetry_hub.subscribers)
+)
+metrics.counter("stream_rejected_total", "Event streams refused because all stream slots were taken")
+metrics.histogram("cycle_generate_seconds", "Time spent building canned cycle previews")
+metrics.gauge(
+    "stat_snapshot_age_seconds",
+    "Age of the latest stat snapshot",
+    lambda: time.monotonic() - stat_sampler.snapshot().timestamp,
+)
+metrics.gauge(
+    "cycle_program_store_requests_total",
+    "Canned cycle subroutine saves by whether the file was reused or written",
+    lambda: {
+        (("result", "hit"),): cycle_program_store.hits,
+        (("result", "write"),): cycle_program_store.writes,
+    },
+    metric_type="counter",
+)
+metrics.gauge(
+    "cycle_cache_requests_total",
+    "Canned cycle preview cache lookups by result",
+    lambda: {
+        (("result", "hit"),): cycle_preview_program.cache_info().hits,
+        (("result", "miss"),): cycle_preview_program.cache_info().misses,
+    },
+    metric_type="counter",
+)
 
 halc = hal.component("lathe")
 haluic = hal.component("halui")
-c = linuxcnc.command()
+c = TimedCommand(linuxcnc.command(), metrics)
 reset_z = 0
 reset_x = 0
 
+# Telemetry stream settings. One hub samples the state every
+# STREAM_CHANGE_CHECK_INTERVAL while anyone is subscribed and shares each
+# encoded frame between all clients. Position changes are pushed as they
+# happen but no faster than the requested rate, status flag changes bypass
+# the rate limit and an unchanged state is repeated every keepalive interval.
+STREAM_DEFAULT_RATE = 30.0
+STREAM_MAX_RATE = 100.0
+STREAM_CHANGE_CHECK_INTERVAL = 0.005
+STREAM_KEEPALIVE_INTERVAL = 1.0
+STREAM_STATUS_KEYS = ("program_running", "error_state")
+# Every event stream holds a server thread while it is open. At most
+# STREAM_MAX_CLIENTS of the HAL_SERVER_THREADS may, so that control requests
+# such as /hal/estop always find a free one.
+HAL_SERVER_THREADS = 16
+STREAM_MAX_CLIENTS = HAL_SERVER_THREADS // 2
+
+# Jogs started with PUT /hal/jog ramp velocity_{x,z}_cmd every JOG_PERIOD.
+# An axis that gets no jog request for JOG_DEADMAN_TIMEOUT ramps down on its
+# own. Requested velocities and accelerations are capped at the ini axis
+# limits, and stops decelerate at the axis' MAX_ACCELERATION.
+JOG_PERIOD = 0.01
+JOG_DEADMAN_TIMEOUT = 0.5
+JOG_AXES = ("x", "z")
+
+# The encoder reset counters are bumped once at startup, after lathe.hal has
+# linked HAL_LINK_PINS. The links are checked every HAL_LINK_POLL_INTERVAL
+# for up to HAL_LINK_TIMEOUT.
+HAL_LINK_PINS = ("reset_z", "reset_x")
+HAL_LINK_TIMEOUT = 5.0
+HAL_LINK_POLL_INTERVAL = 0.005
+# Delay used instead by LinuxCNC versions without hal.get_info_signals
+HAL_LINK_FALLBACK_DELAY = 0.5
+
+# Preview programs are memoized by their normalized parameters
+CYCLE_CACHE_SIZE = 128
+# Batch planning takes up to CYCLE_BATCH_MAX_SETS parameter sets per request
+CYCLE_BATCH_MAX_SETS = 256
+# Cycle time estimates use the measured spindle speed once the spindle turns
+# faster than CYCLE_ESTIMATE_MIN_RPM and the program's S word before that
+CYCLE_ESTIMATE_MIN_RPM = 30.0
+
+# Canned cycles run as background jobs, the last CYCLE_JOB_HISTORY of which
+# stay queryable. A started cycle must show up as a running program within
+# CYCLE_JOB_START_TIMEOUT.
+CYCLE_JOB_HISTORY = 16
+CYCLE_JOB_START_TIMEOUT = 2.0
+# How often a running job and its event streams look for progress, aborts
+# and the end of the program
+CYCLE_JOB_POLL_INTERVAL = 0.05
+CYCLE_JOB_STATES_FINISHED = ("done", "failed", "aborted")
+
+# Canned cycle subroutines are stored in CYCLE_PROGRAM_DIR, which lathe.ini
+# puts on the SUBROUTINE_PATH, named after a hash of their G-code. The
+# CYCLE_PROGRAM_STORE_SIZE most recently used are kept.
+CYCLE_PROGRAM_DIR = os.path.join(os.getcwd(), "canned-cycles")
+CYCLE_PROGRAM_PREFIX = "canned-cycle-"
+CYCLE_PROGRAM_STORE_SIZE = 32
+# Written by earlier versions, removed by /hal/cleanup
+CYCLE_LEGACY_SUBROUTINE_FILE = "canned-cycle.ngc"
+
+# Spindle speed is estimated at SPINDLE_ESTIMATOR_RATE Hz from position_a
+# deltas and smoothed by an alpha-beta filter that also tracks acceleration.
+# The gains are near critical damping, beta = alpha^2 / (2 - alpha). A delta
+# more than SPINDLE_JUMP_RPS away from speed_rps means position_a jumped, e.g.
+# on an index reset, and speed_rps is used for that sample instead. Below
+# SPINDLE_STOPPED_RPS the spindle reads as stopped.
+SPINDLE_ESTIMATOR_RATE = 100.0
+SPINDLE_ESTIMATOR_ALPHA = 0.1
+SPINDLE_ESTIMATOR_BETA = 0.005
+SPINDLE_JUMP_RPS = 5.0
+SPINDLE_STOPPED_RPS = 0.01
+
+# Position and spindle speed history, sampled at HISTORY_RATE Hz into a ring
+# buffer holding the last HISTORY_SECONDS
+HISTORY_RATE = 100.0
+HISTORY_SECONDS = 600
+HISTORY_FIELDS = ("position_z", "position_x", "position_a", "speed_rps")
+HISTORY_MAX_BUCKETS = 10000
+
+# Deadlines for linuxcnc commands to complete and for the machine to reach
+# the state a request needs
+COMMAND_TIMEOUT = 2.0
+MACHINE_STATE_TIMEOUT = 2.0
+
+# The shared stat sampler refreshes once every STAT_SAMPLE_SERVO_MULTIPLE servo
+# periods. SERVO_PERIOD is read from the ini in nanoseconds.
+STAT_SAMPLE_SERVO_MULTIPLE = 10
+DEFAULT_SERVO_PERIOD_NS = 1000000
+
 hal_pin_machine_is_on = haluic.newpin("machine.is-on", hal.HAL_BIT, hal.HAL_OUT)
 
 hal_pin_control_source = halc.newpin("control_source", hal.HAL_BIT, hal.HAL_OUT)
@@ -49,45 +194,759 @@ hal_pin_reset_x = halc.newpin("reset_x", hal.HAL_U32, hal.HAL_OUT)
 hal_pin_scale_encoder_z = halc.newpin("scale_encoder_z", hal.HAL_FLOAT, hal.HAL_OUT)
 hal_pin_scale_encoder_x = halc.newpin("scale_encoder_x", hal.HAL_FLOAT, hal.HAL_OUT)
 
+
+StatSnapshot = namedtuple(
+    "StatSnapshot",
+    [
+        "timestamp",
+        "estop",
+        "enabled",
+        "homed",
+        "interp_state",
+        "exec_state",
+        "call_level",
+        "task_mode",
+        "motion_line",
+        "program_running",
+        "error_state",
+    ],
+)
+
+
+def servo_period():
+    ini_path = os.environ.get("INI_FILE_NAME", os.path.join(os.getcwd(), "lathe.ini"))
+    try:
+        period_ns = int(linuxcnc.ini(ini_path).find("EMCMOT", "SERVO_PERIOD") or DEFAULT_SERVO_PERIOD_NS)
+    except Exception:
+        period_ns = DEFAULT_SERVO_PERIOD_NS
+    return period_ns / 1e9
+
+
+class StatSampler:
+    """Owns the only linuxcnc.stat object and publishes immutable snapshots"""
+
+    def __init__(self, period):
+        self.period = period
+        self.stat = linuxcnc.stat()
+        self.condition = threading.Condition()
+        self.current = None
+        self.thread = threading.Thread(target=self.run, name="stat-sampler", daemon=True)
+
+    def start(self):
+        self.sample()
+        self.thread.start()
+
+    def sample(self):
+        s = self.stat
+        with metrics.timer("linuxcnc_stat_poll_seconds"):
+            s.poll()
+
+        error_state = (
+            s.estop or                              # E-stop active
+            s.exec_state == linuxcnc.EXEC_ERROR     # Execution error
+        )
+
+        program_running = (
+            s.interp_state != linuxcnc.INTERP_IDLE or
+            s.exec_state in [linuxcnc.EXEC_WAITING_FOR_MOTION,
+                            linuxcnc.EXEC_WAITING_FOR_MOTION_QUEUE,
+                            linuxcnc.EXEC_WAITING_FOR_IO] or
+            s.call_level > 0
+        )
+
+        snapshot = StatSnapshot(
+            timestamp=time.monotonic(),
+            estop=s.estop,
+            enabled=s.enabled,
+            homed=s.homed,
+            interp_state=s.interp_state,
+            exec_state=s.exec_state,
+            call_level=s.call_level,
+            task_mode=s.task_mode,
+            motion_line=s.motion_line,
+            program_running=bool(program_running),
+            error_state=bool(error_state),
+        )
+        with self.condition:
+            self.current = snapshot
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            started = time.monotonic()
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"Error polling linuxcnc status: {str(e)}")
+            time.sleep(max(0.0, self.period - (time.monotonic() - started)))
+
+    def snapshot(self):
+        return self.current
+
+    def fresh_snapshot(self, timeout=1.0):
+        """Wait for a snapshot sampled after this call, e.g. after a command"""
+        requested = time.monotonic()
+        with self.condition:
+            self.condition.wait_for(lambda: self.current.timestamp > requested, timeout)
+            return self.current
+
+    def wait_for(self, predicate, timeout):
+        """Wait until predicate(snapshot) holds for a new snapshot, returning
+        that snapshot, or None once timeout seconds have passed"""
+        requested = time.monotonic()
+        with self.condition:
+            if self.condition.wait_for(
+                lambda: self.current.timestamp > requested and predicate(self.current), timeout
+            ):
+                return self.current
+            return None
+
+
+stat_sampler = StatSampler(servo_period() * STAT_SAMPLE_SERVO_MULTIPLE)
+
+
+class MachineStateError(Exception):
+    """A command or state transition failed. code is a short machine
+    readable reason, status_code the HTTP status to answer with."""
+
+    def __init__(self, code, message, status_code=400):
+        Exception.__init__(self, message)
+        self.code = code
+        self.status_code = status_code
+
+    def response(self):
+        return {"status": "Error", "code": self.code, "message": str(self)}, self.status_code
+
+
+def run_command(name, *args, timeout=COMMAND_TIMEOUT):
+    """Issue a linuxcnc command and wait, at most timeout seconds, for it to
+    complete"""
+    getattr(c, name)(*args)
+    result = c.wait_complete(timeout)
+    if result == -1:
+        raise MachineStateError("command_timeout", f"linuxcnc {name} did not complete", 504)
+    if result == linuxcnc.RCS_ERROR:
+        raise MachineStateError("command_failed", f"linuxcnc {name} failed", 500)
+
+
+def machine_not_ready(s):
+    """(code, message) of the first reason s cannot run MDI, or None"""
+    if s.estop:
+        return "estop", "Machine is in ESTOP state"
+    if not s.enabled:
+        return "not_enabled", "Machine is not enabled"
+    if not s.homed:
+        return "not_homed", "Machine is not homed"
+    if s.interp_state != linuxcnc.INTERP_IDLE:
+        return "interpreter_busy", "Interpreter is not idle"
+    return None
+
+
+def require_mdi_ready(timeout=MACHINE_STATE_TIMEOUT):
+    """Wait until the machine is ready for MDI commands, switching it to MDI
+    mode if needed. Raises MachineStateError when it is not ready or does
+    not get there before the deadline."""
+    deadline = time.monotonic() + timeout
+    s = stat_sampler.fresh_snapshot()
+    if s.task_mode != linuxcnc.MODE_MDI and machine_not_ready(s) is None:
+        run_command("mode", linuxcnc.MODE_MDI, timeout=timeout)
+        s = stat_sampler.wait_for(
+            lambda s: s.task_mode == linuxcnc.MODE_MDI or machine_not_ready(s) is not None,
+            max(0.0, deadline - time.monotonic()),
+        )
+        if s is None:
+            raise MachineStateError("mode_timeout", "Machine did not switch to MDI mode", 504)
+    reason = machine_not_ready(s)
+    if reason is not None:
+        raise MachineStateError(*reason)
+    return s
+
+
+class HistoryRecorder:
+    """Fixed-size ring buffer of timestamped HAL input pin samples.
+    Timestamps are time.monotonic(), so they stay sorted when the wall
+    clock is stepped."""
+
+    def __init__(self, pins, rate, seconds):
+        self.pins = pins
+        self.period = 1.0 / rate
+        self.size = int(rate * seconds)
+        # Column 0 is the monotonic time, then one column per pin. Allocated
+        # by the recording thread, see run()
+        self.data = None
+        self.index = 0
+        self.count = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, name="history-recorder", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def sample(self):
+        row = [time.monotonic()] + [pin.get() for pin in self.pins]
+        with self.lock:
+            self.data[self.index] = row
+            self.index = (self.index + 1) % self.size
+            self.count = min(self.count + 1, self.size)
+
+    def run(self):
+        import numpy as np
+
+        with self.lock:
+            self.data = np.zeros((self.size, len(self.pins) + 1))
+        while True:
+            started = time.monotonic()
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"Error sampling history: {str(e)}")
+            time.sleep(max(0.0, self.period - (time.monotonic() - started)))
+
+    def samples(self, start, end):
+        """Copy of the samples with start <= monotonic time <= end, oldest
+        first"""
+        import numpy as np
+
+        with self.lock:
+            if self.data is None:
+                return np.zeros((0, len(self.pins) + 1))
+            if self.count < self.size:
+                segments = (self.data[:self.count],)
+            else:
+                segments = (self.data[self.index:], self.data[:self.index])
+            parts = []
+            for segment in segments:
+                times = segment[:, 0]
+                first = np.searchsorted(times, start, side="left")
+                last = np.searchsorted(times, end, side="right")
+                parts.append(segment[first:last])
+            return np.concatenate(parts)
+
+
+class SpindleEstimator:
+    """Filtered spindle speed and acceleration, updated from the encoder
+    pins at a fixed rate by a background thread"""
+
+    def __init__(self, position_pin, speed_pin, rate):
+        self.position_pin = position_pin
+        self.speed_pin = speed_pin
+        self.period = 1.0 / rate
+        # (speed in rev/s, acceleration in rev/s^2), replaced as a whole
+        self.state = (0.0, 0.0)
+        self.last_position = None
+        self.last_time = None
+        self.thread = threading.Thread(target=self.run, name="spindle-estimator", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def update(self, position, speed_rps, now):
+        if self.last_time is None:
+            self.state = (speed_rps, 0.0)
+        elif now > self.last_time:
+            dt = now - self.last_time
+            measured = (position - self.last_position) / dt
+            if abs(measured - speed_rps) > SPINDLE_JUMP_RPS:
+                measured = speed_rps
+            rps, acceleration = self.state
+            predicted = rps + acceleration * dt
+            residual = measured - predicted
+            rps = predicted + SPINDLE_ESTIMATOR_ALPHA * residual
+            acceleration += SPINDLE_ESTIMATOR_BETA * residual / dt
+            if abs(rps) < SPINDLE_STOPPED_RPS and abs(measured) < SPINDLE_STOPPED_RPS:
+                rps = acceleration = 0.0
+            self.state = (rps, acceleration)
+        self.last_position = position
+        self.last_time = now
+
+    def run(self):
+        while True:
+            started = time.monotonic()
+            try:
+                self.update(self.position_pin.get(), self.speed_pin.get(), started)
+            except Exception as e:
+                print(f"Error estimating spindle speed: {str(e)}")
+            time.sleep(max(0.0, self.period - (time.monotonic() - started)))
+
+
+def history_buckets(samples, start, end, buckets):
+    """Downsample samples into equal time buckets, each holding the sample
+    count and per column min/max/mean, None for empty buckets"""
+    import numpy as np
+
+    edges = np.linspace(start, end, buckets + 1)
+    bounds = np.searchsorted(samples[:, 0], edges, side="left")
+    bounds[-1] = len(samples)
+    counts = np.diff(bounds)
+    filled = counts > 0
+    first = bounds[:-1][filled]
+
+    result = {"timestamp": edges[:-1].tolist(), "count": counts.tolist()}
+    for column, field in enumerate(HISTORY_FIELDS, 1):
+        values = samples[:, column]
+        stats = {}
+        if len(first):
+            stats["min"] = np.minimum.reduceat(values, first)
+            stats["max"] = np.maximum.reduceat(values, first)
+            stats["mean"] = np.add.reduceat(values, first) / counts[filled]
+        result[field] = {}
+        for name in ("min", "max", "mean"):
+            full = [None] * buckets
+            if len(first):
+                for i, value in zip(np.flatnonzero(filled).tolist(), stats[name].tolist()):
+                    full[i] = value
+            result[field][name] = full
+    return result
+
+
+class HalWriter:
+    """Coalesces HAL output writes and skips pins whose value is unchanged"""
+
+    def __init__(self, pins):
+        self.pins = pins
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.written = {}
+
+    def update(self, name, value):
+        with self.lock:
+            self.pending[name] = value
+
+    def flush(self):
+        with self.lock, metrics.timer("hal_pin_write_seconds"):
+            pending, self.pending = self.pending, {}
+            for name, value in pending.items():
+                if name in self.written and self.written[name] == value:
+                    continue
+                self.pins[name].set(value)
+                self.written[name] = value
+                metrics.inc("hal_pin_writes_total", pin=name)
+
+    def current(self, name):
+        """Value the pin will have after the next flush"""
+        with self.lock:
+            if name in self.pending:
+                return self.pending[name]
+            if name in self.written:
+                return self.written[name]
+        return self.pins[name].get()
+
+
+def machine_ini():
+    ini_path = os.environ.get("INI_FILE_NAME", os.path.join(os.getcwd(), "lathe.ini"))
+    return linuxcnc.ini(ini_path)
+
+
+def axis_limits(axis):
+    """(MAX_VELOCITY, MAX_ACCELERATION) of an ini [AXIS_*] section"""
+    inifile = machine_ini()
+    section = f"AXIS_{axis.upper()}"
+    return (
+        float(inifile.find(section, "MAX_VELOCITY")),
+        float(inifile.find(section, "MAX_ACCELERATION")),
+    )
+
+
+
+def trajectory_max_velocity():
+    """[TRAJ] MAX_LINEAR_VELOCITY, infinite when the ini has none"""
+    value = machine_ini().find("TRAJ", "MAX_LINEAR_VELOCITY")
+    return float(value) if value is not None else math.inf
+
+
+class JogRamp:
+    """Server side jog velocity ramps, one per axis, stepped at a fixed
+    cadence by a background thread. latch(axes) writes the offsets that
+    hold axes in place once they return to position control."""
+
+    def __init__(self, writer, limits, period, deadman_timeout, latch):
+        self.writer = writer
+        self.limits = limits
+        self.latch = latch
+        self.period = period
+        self.deadman_timeout = deadman_timeout
+        self.condition = threading.Condition()
+        # axis -> {"velocity", "target", "acceleration", "deadline"}
+        self.axes = {}
+        self.thread = threading.Thread(target=self.run, name="jog-ramp", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def jog(self, axis, direction, velocity, acceleration):
+        """Ramp axis towards direction * velocity, until stopped or the
+        dead-man timeout passes. Returns the capped velocity and
+        acceleration."""
+        max_velocity, max_acceleration = self.limits[axis]
+        velocity = min(velocity, max_velocity)
+        acceleration = min(acceleration, max_acceleration)
+        with self.condition:
+            state = self.axes.setdefault(axis, {"velocity": 0.0})
+            state["target"] = direction * velocity
+            state["acceleration"] = acceleration
+            state["deadline"] = time.monotonic() + self.deadman_timeout
+            self.condition.notify()
+        return velocity, acceleration
+
+    def stop(self, axes):
+        """Decelerate axes to a stop at their maximum acceleration"""
+        with self.condition:
+            for axis in axes:
+                if axis in self.axes:
+                    self.axes[axis]["target"] = 0.0
+                    self.axes[axis]["acceleration"] = self.limits[axis][1]
+
+    def stop_now(self):
+        """Forget all ramps, for control_stop_now which zeroes the pins"""
+        with self.condition:
+            self.axes.clear()
+
+    def step(self, dt):
+        now = time.monotonic()
+        for axis, state in list(self.axes.items()):
+            if now >= state["deadline"] and state["target"] != 0.0:
+                state["target"] = 0.0
+                state["acceleration"] = self.limits[axis][1]
+            change = state["acceleration"] * dt
+            velocity, target = state["velocity"], state["target"]
+            if target > velocity:
+                velocity = min(target, velocity + change)
+            else:
+                velocity = max(target, velocity - change)
+            state["velocity"] = velocity
+            self.writer.update(f"velocity_{axis}_cmd", velocity)
+            if velocity == 0.0 and target == 0.0:
+                self.latch([axis])
+                self.writer.update(f"control_{axis}_type", 0)
+                del self.axes[axis]
+            else:
+                self.writer.update(f"control_{axis}_type", 1)
+        self.writer.update("machine_is_on", True)
+        self.writer.flush()
+
+    def run(self):
+        last = time.monotonic()
+        while True:
+            with self.condition:
+                while not self.axes:
+                    self.condition.wait()
+                    last = time.monotonic()
+                started = time.monotonic()
+                try:
+                    self.step(started - last)
+                except Exception as e:
+                    print(f"Error stepping jog ramp: {str(e)}")
+                last = started
+            time.sleep(max(0.0, self.period - (time.monotonic() - started)))
+
+
+history_recorder = HistoryRecorder(
+    [hal_pin_position_z, hal_pin_position_x, hal_pin_position_a, hal_pin_speed_rps],
+    HISTORY_RATE,
+    HISTORY_SECONDS,
+)
+spindle_estimator = SpindleEstimator(
+    hal_pin_position_a, hal_pin_speed_rps, SPINDLE_ESTIMATOR_RATE
+)
+
+hal_writer = HalWriter(
+    {
+        "machine_is_on": hal_pin_machine_is_on,
+        "control_source": hal_pin_control_source,
+        "forward_z": hal_pin_forward_z,
+        "forward_x": hal_pin_forward_x,
+        "enable_z": hal_pin_enable_z,
+        "enable_x": hal_pin_enable_x,
+        "enable_stepper_z": hal_pin_enable_stepper_z,
+        "enable_stepper_x": hal_pin_enable_stepper_x,
+        "offset_z_encoder": hal_pin_offset_z_encoder,
+        "offset_z_stepper": hal_pin_offset_z_stepper,
+        "offset_x_encoder": hal_pin_offset_x_encoder,
+        "offset_x_stepper": hal_pin_offset_x_stepper,
+        "control_z_type": hal_pin_control_z_type,
+        "control_x_type": hal_pin_control_x_type,
+        "velocity_z_cmd": hal_pin_velocity_z_cmd,
+        "velocity_x_cmd": hal_pin_velocity_x_cmd,
+        "reset_z": hal_pin_reset_z,
+        "reset_x": hal_pin_reset_x,
+        "scale_encoder_z": hal_pin_scale_encoder_z,
+        "scale_encoder_x": hal_pin_scale_encoder_x,
+    }
+)
+
+HAL_POSITION_ENCODER_PINS = {
+    "z": hal_pin_position_z_encoder,
+    "x": hal_pin_position_x_encoder,
+}
+
+
+def latch_offsets(axes):
+    """Latch the encoder and stepper offsets of axes at the current position,
+    so that position control holds the carriage where it is"""
+    position_a = hal_pin_position_a.get()
+    for axis in axes:
+        hal_writer.update(f"offset_{axis}_encoder", -position_a)
+        hal_writer.update(f"offset_{axis}_stepper", +HAL_POSITION_ENCODER_PINS[axis].get())
+
+
+AXIS_LIMITS = {axis: axis_limits(axis) for axis in JOG_AXES}
+TRAJECTORY_MAX_VELOCITY = trajectory_max_velocity()
+
+jog_ramp = JogRamp(hal_writer, AXIS_LIMITS, JOG_PERIOD, JOG_DEADMAN_TIMEOUT, latch_offsets)
+
+# PUT /hal/hal_out keys that map directly onto a pin
+HAL_OUT_COMMAND_KEYS = {
+    "encoder_scale_z": "scale_encoder_z",
+    "encoder_scale_x": "scale_encoder_x",
+    "control_z_type": "control_z_type",
+    "control_x_type": "control_x_type",
+    "velocity_z_cmd": "velocity_z_cmd",
+    "velocity_x_cmd": "velocity_x_cmd",
+    "control_source": "control_source",
+    "enable_stepper_z": "enable_stepper_z",
+    "enable_stepper_x": "enable_stepper_x",
+    "forward_z": "forward_z",
+    "enable_z": "enable_z",
+    "forward_x": "forward_x",
+    "enable_x": "enable_x",
+}
+
+HAL_OUT_JOG_KEYS = {
+    "control_stop_now",
+    "control_z_type",
+    "control_x_type",
+    "velocity_z_cmd",
+    "velocity_x_cmd",
+}
+
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
+instrumentApp(app, metrics)
 
 @app.route("/")
 def index():
     return {"status": "OK!"}
 
 
+def hal_in_state():
+    s = stat_sampler.snapshot()
+    spindle_rps, spindle_acceleration = spindle_estimator.state
+
+    with metrics.timer("hal_pin_read_seconds"):
+        return {
+            "position_z": hal_pin_position_z.get(),
+            "position_x": hal_pin_position_x.get(),
+            "position_a": hal_pin_position_a.get(),
+            "speed_rps": hal_pin_speed_rps.get(),
+            "spindle_rpm": spindle_rps * 60,
+            "spindle_acceleration": spindle_acceleration * 60,
+            "program_running": s.program_running,
+            "error_state": s.error_state
+        }
+
+class TelemetryFrame:
+    def __init__(self, state):
+        self.state = state
+        with metrics.timer("json_serialize_seconds"):
+            self.data = f"data: {json.dumps(state, separators=(',', ':'))}\n\n"
+
+
+class TelemetrySubscriber:
+    """Holds the latest frame a client has not taken yet. Offering a new
+    one replaces it, so a slow client skips stale frames instead of
+    holding up the hub."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.frame = None
+
+    def offer(self, frame):
+        with self.condition:
+            if self.frame is not None:
+                metrics.inc("stream_frames_dropped_total")
+            self.frame = frame
+            self.condition.notify()
+
+    def take(self, timeout):
+        """The next frame, or None if none arrived within timeout"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.frame is not None, timeout)
+            frame, self.frame = self.frame, None
+            return frame
+
+
+class TelemetryHub:
+    """Samples the telemetry state once for all subscribers, encoding each
+    changed state once and offering it to every subscriber"""
+
+    def __init__(self, sample, period):
+        self.sample = sample
+        self.period = period
+        self.condition = threading.Condition()
+        self.subscribers = set()
+        self.latest = None
+        self.sampled_at = 0.0
+        self.thread = threading.Thread(target=self.run, name="telemetry-hub", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def subscribe(self):
+        subscriber = TelemetrySubscriber()
+        with self.condition:
+            self.subscribers.add(subscriber)
+            if self.latest is not None:
+                subscriber.offer(self.latest)
+            self.condition.notify()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.condition:
+            self.subscribers.discard(subscriber)
+
+    def fresh(self):
+        """The latest state if it was sampled within the last period"""
+        latest = self.latest
+        if latest is not None and time.monotonic() - self.sampled_at <= self.period:
+            return latest.state
+        return None
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.subscribers:
+                    self.latest = None
+                    self.condition.wait()
+            started = time.monotonic()
+            try:
+                state = self.sample()
+                if self.latest is None or state != self.latest.state:
+                    frame = TelemetryFrame(state)
+                    with self.condition:
+                        self.latest = frame
+                        subscribers = list(self.subscribers)
+                    for subscriber in subscribers:
+                        subscriber.offer(frame)
+                self.sampled_at = started
+            except Exception as e:
+                print(f"Error sampling telemetry: {str(e)}")
+            time.sleep(max(0.0, self.period - (time.monotonic() - started)))
+
+
+telemetry_hub = TelemetryHub(hal_in_state, STREAM_CHANGE_CHECK_INTERVAL)
+stream_slots = threading.BoundedSemaphore(STREAM_MAX_CLIENTS)
+
+
+def event_stream_response(generate):
+    """Server-Sent Events response holding a stream slot until it closes,
+    or 503 when all STREAM_MAX_CLIENTS slots are taken"""
+    if not stream_slots.acquire(blocking=False):
+        metrics.inc("stream_rejected_total")
+        return {"status": "Error", "message": "Too many stream clients"}, 503, {"Retry-After": "5"}
+    response = Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    # Called by the server whether or not the stream was ever iterated
+    response.call_on_close(stream_slots.release)
+    return response
+
+
 @app.get("/hal/hal_in")
 def read_hal_in():
-    s = linuxcnc.stat()
-    s.poll()
-    
-    error_state = (
-        s.estop or                              # E-stop active
-        s.exec_state == linuxcnc.EXEC_ERROR     # Execution error
-    )
-    
-    program_running = (
-        s.interp_state != linuxcnc.INTERP_IDLE or
-        s.exec_state in [linuxcnc.EXEC_WAITING_FOR_MOTION, 
-                        linuxcnc.EXEC_WAITING_FOR_MOTION_QUEUE, 
-                        linuxcnc.EXEC_WAITING_FOR_IO] or
-        s.call_level > 0
-    )
-    
-    return {
-        "position_z": hal_pin_position_z.get(),
-        "position_x": hal_pin_position_x.get(),
-        "position_a": hal_pin_position_a.get(),
-        "speed_rps": hal_pin_speed_rps.get(),
-        "program_running": program_running,
-        "error_state": error_state
-    }
+    # Share the streaming clients' sample while the hub is running
+    return telemetry_hub.fresh() or hal_in_state()
+
+@app.get("/hal/hal_in/stream")
+def stream_hal_in():
+    """Server-Sent Events stream of the /hal/hal_in state"""
+    try:
+        rate = float(request.args.get("rate", STREAM_DEFAULT_RATE))
+    except ValueError:
+        return {"status": "Error", "message": "Invalid stream rate"}, 400
+    if rate <= 0:
+        return {"status": "Error", "message": "Invalid stream rate"}, 400
+    frame_interval = 1.0 / min(rate, STREAM_MAX_RATE)
+
+    def generate():
+        subscriber = telemetry_hub.subscribe()
+        last_frame = None
+        pending = None
+        last_sent = 0.0
+        try:
+            while True:
+                # Wait for a frame, or until the pending one may be sent or
+                # a keepalive is due
+                interval = frame_interval if pending is not None else STREAM_KEEPALIVE_INTERVAL
+                frame = subscriber.take(max(0.0, last_sent + interval - time.monotonic()))
+                if frame is not None:
+                    pending = frame
+                elapsed = time.monotonic() - last_sent
+                if pending is not None:
+                    send = (
+                        last_frame is None
+                        or any(pending.state[key] != last_frame.state[key] for key in STREAM_STATUS_KEYS)
+                        or elapsed >= frame_interval
+                    )
+                elif last_frame is not None and elapsed >= STREAM_KEEPALIVE_INTERVAL:
+                    pending = last_frame
+                    send = True
+                else:
+                    send = False
+                if send:
+                    metrics.inc("stream_frames_total")
+                    yield pending.data
+                    last_frame = pending
+                    pending = None
+                    last_sent = time.monotonic()
+        finally:
+            telemetry_hub.unsubscribe(subscriber)
+
+    return event_stream_response(generate)
+
+@app.get("/hal/history")
+def read_history():
+    """Recorded pin history between start and end.
+
+    start and end are Unix times, or seconds relative to now when zero or
+    negative, and default to the oldest sample and now. With buckets=N the
+    range is split into N equal buckets with min/max/mean per field,
+    otherwise every sample is returned."""
+    now = time.time()
+    try:
+        start = float(request.args.get("start", now - HISTORY_SECONDS))
+        end = float(request.args.get("end", now))
+        buckets = int(request.args.get("buckets", 0))
+    except ValueError:
+        return {"status": "Error", "message": "Invalid history query"}, 400
+    if start <= 0:
+        start += now
+    if end <= 0:
+        end += now
+    if not start < end or not 0 <= buckets <= HISTORY_MAX_BUCKETS:
+        return {"status": "Error", "message": "Invalid history query"}, 400
+
+    # Samples are stamped with the monotonic clock, the query converts at
+    # the current offset to the wall clock
+    clock_offset = now - time.monotonic()
+    samples = history_recorder.samples(start - clock_offset, end - clock_offset)
+    samples[:, 0] += clock_offset
+    result = {"status": "OK", "now": now, "start": start, "end": end, "rate": HISTORY_RATE}
+    if buckets:
+        result.update(history_buckets(samples, start, end, buckets))
+    else:
+        result["timestamp"] = samples[:, 0].tolist()
+        for column, field in enumerate(HISTORY_FIELDS, 1):
+            result[field] = samples[:, column].tolist()
+    return result
 
 @app.put("/hal/abort")
 def abort_operation():
     try:
-        # Abort current operation without E-stop
+        # Abort current operation without E-stop. The job is marked first so
+        # a cycle that is just starting cannot issue its call after c.abort()
+        cycle_jobs.abort_active("Operation aborted")
         c.abort()
         
         
@@ -101,6 +960,7 @@ def abort_operation():
 def emergency_stop():
     try:
         # Immediate abort of all operations
+        cycle_jobs.abort_active("Emergency stop executed")
         c.abort()
         
         # Set machine to E-stop state
@@ -114,246 +974,57 @@ def emergency_stop():
         return {"status": "Error", "message": error_msg}, 500
 
 
-def generate_threading_gcode_core(params, for_backplot=False):
-    import math
-    
-    x_start = float(params['XStart'])
-    z_start = float(params['ZStart'])
-    pitch = abs(float(params['Pitch']))
-    x_depth = float(params['XDepth'])
-    z_depth = float(params['ZDepth'])
-    x_end = float(params['XEnd'])
-    z_end = float(params['ZEnd'])
-    x_pullout = float(params['XPullout'])
-    z_pullout = float(params['ZPullout'])
-    first_cut = abs(float(params['FirstCut']))
-    cut_mult = abs(float(params['CutMult']))
-    min_cut = abs(float(params['MinCut']))
-    spring_cuts = int(params['SpringCuts'])
-    x_return = float(params['XReturn'])
-    z_return = float(params['ZReturn'])
-    
-    # Calculate compound distance and direction ratios
-    compound_dist = math.sqrt(x_depth * x_depth + z_depth * z_depth)
-    k_x = x_depth / compound_dist if compound_dist != 0 else 0
-    k_z = z_depth / compound_dist if compound_dist != 0 else 0
-    
-    gcode_lines = []
-    
-    # Common setup
-    gcode_lines.append("G8")   # Radius mode
-    gcode_lines.append("G21")  # Metric units
-    gcode_lines.append("G90")  # Absolute positioning
-    gcode_lines.append("F100") # Set feed rate for G1 moves
-    gcode_lines.append("M3S500") # Start spindle (required for G33)
-    
-    # Additional setup for execution (not backplot)
-    if not for_backplot:
-        gcode_lines.append(f"G10 L20 P1 X{float(params['XPos']):.6f} Z{float(params['ZPos']):.6f}")
-        gcode_lines.append("G54")  # Use work coordinates
-    
-    # Move to start point (line 40)
-    gcode_lines.append(f"G0 X{x_start:.6f} Z{z_start:.6f}")
-    
-    # Threading loop variables
-    cut_size = 0.0
-    x_cut = 0.0
-    z_cut = 0.0
-    spring_cuts_remaining = spring_cuts
-    
-    # Main threading loop (o100 do ... o100 while from lines 41-77)
-    pass_number = 0
-    while spring_cuts_remaining >= 0:
-        pass_number += 1
-        
-        # Calculate cut size (lines 42-47)
-        if cut_size == 0.0:
-            cut_size = first_cut
-        else:
-            cut_size = cut_size * cut_mult
-            
-        # Apply minimum cut constraint (lines 49-52)
-        if abs(cut_size) < abs(min_cut):
-            cut_size = min_cut
-            
-        # Calculate cut positions (lines 53-54)
-        x_cut = x_cut + (cut_size * k_x)
-        z_cut = z_cut + (cut_size * k_z)
-        
-        # Don't go too far (lines 56-59)
-        if abs(x_cut) >= abs(x_depth):
-            x_cut = x_depth
-            z_cut = z_depth
-            
-        # Threading pass
-        gcode_lines.append(f"(Pass {pass_number} - Cut size: {cut_size:.4f})")
-        
-        # Move to cut start position (line 60)
-        cut_start_x = x_start + x_cut
-        cut_start_z = z_start + z_cut
-        gcode_lines.append(f"G1 X{cut_start_x:.6f} Z{cut_start_z:.6f}")
-        
-        # Dwell (line 61) - Skip for backplot compatibility
-        if not for_backplot:
-            gcode_lines.append("G4 P0.01")
-        
-        # Cut thread (line 62)
-        cut_end_x = x_end + x_cut
-        cut_end_z = z_end + z_cut
-        gcode_lines.append(f"G33 X{cut_end_x:.6f} Z{cut_end_z:.6f} K{pitch:.6f}")
-        
-        # Pull out (line 63)
-        pullout_z = cut_end_z + z_pullout
-        gcode_lines.append(f"G33 X{x_end:.6f} Z{pullout_z:.6f} K{pitch:.6f}")
-        
-        # Continue pullout (line 66)
-        gcode_lines.append(f"G1 X{x_end:.6f} Z{pullout_z:.6f}")
-        
-        # Retract sequence (lines 67-69)
-        retract_x = x_end + x_pullout
-        gcode_lines.append(f"G0 X{retract_x:.6f}")
-        gcode_lines.append(f"G0 Z{z_start:.6f}")
-        gcode_lines.append(f"G0 X{x_start:.6f}")
-        
-        # Spring cut logic (lines 70-76)
-        if abs(x_cut) == abs(x_depth):
-            if spring_cuts_remaining > 0:
-                # Back off for spring cut
-                x_cut = x_cut - (cut_size * k_x)
-                z_cut = z_cut - (cut_size * k_z)
-            spring_cuts_remaining -= 1
-            
-        # Break if we've completed all cuts including spring cuts
-        if spring_cuts_remaining < 0:
-            break
-
+def print_gcode(title, gcode_lines):
     # Debug: Print the generated G-code
-    print("=== GENERATED TURNING G-CODE ===")
+    print(f"=== GENERATED {title} G-CODE ===")
     for i, line in enumerate(gcode_lines):
         print(f"{i+1:3d}: {line}")
     print("=== END G-CODE ===")
-    
-    # Final return to safe position (line 78)
-    gcode_lines.append(f"G0 X{x_return:.6f} Z{z_return:.6f}")
-    
-    return gcode_lines
 
-def generate_turning_gcode_core(params, for_backplot=False):
-    import math
-    
-    pitch = abs(float(params['Pitch'])) # Cutting pitch for G33
-    x_stock = float(params['Stock']) # Stock radius (larger, starting diameter)
-    x_target = float(params['Target']) # Target radius (smaller, finished diameter)
-    
-    z_start = 0 # Starting Z, we always start at zero. Note that z_lead need to be added when cutting and X adjusted based on the taper angle.
-    z_lead = float(params['ZLead']) # Leading cut depth, used to compensate for backlash. usually positive.
-    z_end = float(params['ZEnd']) # Full cut depth, usually negative
-    angle = float(params['Angle']) # Taper angle
-    step_down = float(params['StepDown']) # Cut depth of a single pass
-    final_step_down = float(params['FinalStepDown']) # Cut depth of the final pass
-    spring_passes = int(params['SpringPasses']) # Number of spring passes to run after final cut
-    x_return = float(params['XReturn']) # final position
-    z_return = float(params['ZReturn']) # final position position 
-
-    gcode_lines = []
-    
-    # Common setup
-    gcode_lines.append("G8") # Radius mode
-    gcode_lines.append("G21") # Metric units
-    gcode_lines.append("G90") # Absolute positioning
-    gcode_lines.append("F100")  # Set feed rate
-    gcode_lines.append("M3S500") # Start spindle
-    
-    # Additional setup for execution (not backplot)
-    if not for_backplot:
-        gcode_lines.append(f"G10 L20 P1 X{float(params['XPos']):.6f} Z{float(params['ZPos']):.6f}")
-        gcode_lines.append("G54")  # Use work coordinates
-    
-    # Move to start point
-    gcode_lines.append(f"G0 X{x_stock:.6f} Z{z_start:.6f}")
 
-    # Calculate taper angle in radians for calculations
-    import math
-    angle_rad = math.radians(angle)
-    
-    # Calculate total cut depth needed
-    total_cut_depth = abs(x_stock - x_target)
-    
-    # Calculate passes needed
-    remaining_after_final = total_cut_depth - final_step_down
-    num_roughing_passes = 0
-    if remaining_after_final > 0:
-        num_roughing_passes = int(math.ceil(remaining_after_final / step_down))
-    
-    # Build list of all passes with their depths and descriptions
-    passes = []
-    
-    # Add roughing passes
-    for i in range(num_roughing_passes):
-        depth = min((i + 1) * step_down, remaining_after_final)
-        passes.append(("Roughing", i + 1, num_roughing_passes, depth))
-    
-    # Add final pass
-    passes.append(("Final", 1, 1, total_cut_depth))
-    
-    # Add spring passes
-    for i in range(spring_passes):
-        passes.append(("Spring", i + 1, spring_passes, total_cut_depth))
-    
-    # Calculate common values
-    z_travel = z_end - z_start
-    
-    # The cutting starts from the largest required diameter
-    # For external turning, this is the stock diameter
-    max_radius = x_stock
-    
-    # Determine retract position - always clear of the work
-    retract_x = max_radius + 2.0
-    
-    # For external turning, we always cut inward (reduce radius)
-    # The depth represents how much material to remove from the starting stock
-    direction = -1
-    
-    # Execute all passes
-    for pass_type, pass_num, total_of_type, depth in passes:
-        # Generate pass description
-        if total_of_type > 1:
-            gcode_lines.append(f"({pass_type} pass {pass_num} of {total_of_type})")
-        else:
-            gcode_lines.append(f"({pass_type} pass)")
-        
-        # For external turning, we cut from outside in
-        # We start at stock diameter and cut progressively deeper toward target
-        current_cut_depth = depth
-        
-        # Calculate the actual cutting diameter for this pass
-        # Start from stock and work inward by the current cut depth
-        cut_diameter = x_stock - current_cut_depth
-        
-        # Apply taper compensation for the actual cutting positions
-        # For positive angles, diameter increases as Z becomes more negative (toward chuck)
-        # z_lead is positive (away from chuck), z_travel is negative (toward chuck)
-        adjusted_x_start = cut_diameter - (z_lead * math.tan(angle_rad))
-        adjusted_x_end = cut_diameter - (z_travel * math.tan(angle_rad))
-        
-        # Execute the pass
-        gcode_lines.append(f"G0 X{adjusted_x_start:.6f} Z{z_lead:.6f}")
-        gcode_lines.append(f"G33 X{adjusted_x_end:.6f} Z{z_end:.6f} K{pitch:.6f}")
-        gcode_lines.append(f"G0 X{retract_x:.6f}")
-        gcode_lines.append(f"G0 Z{z_start:.6f}")
-    
-    # Return to safe position
-    gcode_lines.append(f"G0 X{x_return:.6f} Z{z_return:.6f}")
-    
-    # Debug: Print the generated G-code
-    print("=== GENERATED TURNING G-CODE ===")
-    for i, line in enumerate(gcode_lines):
-        print(f"{i+1:3d}: {line}")
-    print("=== END G-CODE ===")
-    
-    return gcode_lines
+# Executed programs set the work offset from the current position, which is
+# passed as call parameters so that the stored subroutine only depends on
+# the cycle parameters
+CYCLE_POSITION_PARAMS = (("XPos", float), ("ZPos", float))
 
 
+@functools.lru_cache(maxsize=CYCLE_CACHE_SIZE)
+def cycle_preview_program(kind, values):
+    import lathe_cycles
+
+    spec, build_program = lathe_cycles.CYCLE_PREVIEWS[kind]
+    params = dict(zip((name for name, _ in spec), values))
+    with metrics.timer("cycle_generate_seconds", kind=kind):
+        program = build_program(params, for_backplot=True)
+    print_gcode(kind.upper(), program.lines)
+    return program
+
+
+@functools.lru_cache(maxsize=CYCLE_CACHE_SIZE)
+def cycle_execute_program(kind, values):
+    import lathe_cycles
+
+    spec, build_program = lathe_cycles.CYCLE_PREVIEWS[kind]
+    params = dict(zip((name for name, _ in spec), values))
+    with metrics.timer("cycle_generate_seconds", kind=kind):
+        program = build_program(params, for_backplot=False)
+    print_gcode(kind.upper(), program.lines)
+    return program
+
+
+@functools.lru_cache(maxsize=CYCLE_CACHE_SIZE)
+def cycle_preview_backplot(kind, values, tolerance):
+    return cycle_preview_program(kind, values).backplot(tolerance)
+
+
+def cycle_preview_gcode(kind, json_data):
+    """Memoized preview G-code lines of a canned cycle. The lines are shared
+    between callers and must not be modified."""
+    import lathe_cycles
+
+    spec, _ = lathe_cycles.CYCLE_PREVIEWS[kind]
+    return cycle_preview_program(kind, lathe_cycles.normalize_cycle_params(spec, json_data)).lines
+
 
 @app.put("/hal/turning/generate")
 def generate_turning():
@@ -363,72 +1034,544 @@ def generate_turning():
         return {"status": "Error", "message": "Missing turning parameters"}, 400
 
     try:
-        gcode_lines = generate_turning_gcode_core(json_data, for_backplot=True)
+        gcode_lines = cycle_preview_gcode("turning", json_data)
         return {
             "status": "OK", 
             "message": "Turning G-code generated",
             "gcode": gcode_lines
         }
         
+    except (KeyError, TypeError, ValueError) as e:
+        return {"status": "Error", "message": f"Invalid turning parameters: {str(e)}"}, 400
     except Exception as e:
         error_msg = f"Error generating turning G-code: {str(e)}"
         return {"status": "Error", "message": error_msg}, 500
 
 
-@app.put("/hal/turning")
-def execute_turning():
+def cycle_batch(kind, json_data):
+    """Plan every parameter set in the json_data list. Invalid sets get an
+    error entry in place instead of failing the whole batch."""
+    import lathe_cycles
+
+    if not isinstance(json_data, list) or not json_data:
+        raise ValueError("expected a non-empty list of parameter sets")
+    if len(json_data) > CYCLE_BATCH_MAX_SETS:
+        raise ValueError(f"at most {CYCLE_BATCH_MAX_SETS} parameter sets per batch")
+    for index, params in enumerate(json_data):
+        if not isinstance(params, dict):
+            raise ValueError(f"parameter set {index} is not an object")
+    return {"status": "OK", "results": lathe_cycles.CYCLE_BATCHES[kind](json_data)}
+
+
+def cycle_spindle_rpm(program, rpm=None):
+    """Spindle speed to estimate with and where it comes from: rpm when
+    given, else the measured speed while the spindle turns, else the
+    program's S word"""
+    if rpm is not None:
+        rpm = abs(float(rpm))
+        if not 0 < rpm < math.inf:
+            raise ValueError("RPM must be a positive number")
+        return rpm, "request"
+    measured = abs(spindle_estimator.state[0]) * 60.0
+    if measured > CYCLE_ESTIMATE_MIN_RPM:
+        return measured, "measured"
+    return program.spindle_rpm, "program"
+
+
+def cycle_limit(json_data, name):
+    """json_data[name] as a positive number, None when it is not given"""
+    value = json_data.get(name)
+    if value is None:
+        return None
+    value = float(value)
+    if not 0 < value < math.inf:
+        raise ValueError(f"{name} must be a positive number")
+    return value
+
+
+def cycle_start_position(json_data):
+    """(XPos, ZPos) when both are given, the position a cycle starts from"""
+    if json_data.get("XPos") is None or json_data.get("ZPos") is None:
+        return None
+    return float(json_data["XPos"]), float(json_data["ZPos"])
+
+
+def cycle_estimate(kind, json_data):
+    """Estimated run time of a canned cycle. Optional RPM overrides the
+    spindle speed and XPos/ZPos add the approach from that position."""
+    import lathe_cycles
+
+    spec, _ = lathe_cycles.CYCLE_PREVIEWS[kind]
+    program = cycle_preview_program(kind, lathe_cycles.normalize_cycle_params(spec, json_data))
+    if not program.passes:
+        raise lathe_cycles.CycleScheduleError("No passes planned")
+    rpm, source = cycle_spindle_rpm(program, json_data.get("RPM"))
+    estimate = lathe_cycles.estimate_cycle_time(
+        program, rpm, AXIS_LIMITS, TRAJECTORY_MAX_VELOCITY, cycle_start_position(json_data)
+    )
+    estimate["spindle_source"] = source
+    return {"status": "OK", "pass_count": len(program.passes), "estimate": estimate}
+
+
+def cycle_schedule(kind, params, max_cut, max_chip_area, thread_angle, rpm):
+    """Pass count, heaviest cut and chip, and estimated time of a parameter
+    set, None when it cannot be planned"""
+    import lathe_cycles
+
+    spec, _ = lathe_cycles.CYCLE_PREVIEWS[kind]
+    try:
+        program = cycle_preview_program(kind, lathe_cycles.normalize_cycle_params(spec, params))
+        _, loads = lathe_cycles.cycle_pass_loads(kind, params, thread_angle)
+    except lathe_cycles.CycleScheduleError:
+        return None
+    rpm, _ = cycle_spindle_rpm(program, rpm)
+    return {
+        "pass_count": len(program.passes),
+        "max_cut": max(cut for cut, _ in loads),
+        "max_chip_area": max(area for _, area in loads),
+        "load": lathe_cycles.cycle_load(loads, max_cut, max_chip_area),
+        "cycle_time": lathe_cycles.estimate_cycle_time(
+            program, rpm, AXIS_LIMITS, TRAJECTORY_MAX_VELOCITY
+        )["total"],
+    }
+
+
+def cycle_optimize(kind, json_data):
+    """Parameters giving the fewest passes within MaxCut and/or MaxChipArea
+    (mm^2), with the current and proposed schedules. Threading chip areas
+    use ThreadAngle, lathe_cycles.CYCLE_THREAD_ANGLE by default."""
+    import lathe_cycles
+
+    max_cut = cycle_limit(json_data, "MaxCut")
+    max_chip_area = cycle_limit(json_data, "MaxChipArea")
+    if max_cut is None and max_chip_area is None:
+        raise ValueError("MaxCut or MaxChipArea is required")
+    thread_angle = float(json_data.get("ThreadAngle", lathe_cycles.CYCLE_THREAD_ANGLE))
+    if not 0 < thread_angle < 180:
+        raise ValueError("ThreadAngle must be between 0 and 180 degrees")
+    rpm = json_data.get("RPM")
+
+    spec, _ = lathe_cycles.CYCLE_PREVIEWS[kind]
+    params = dict(zip((name for name, _ in spec), lathe_cycles.normalize_cycle_params(spec, json_data)))
+    changes = lathe_cycles.CYCLE_OPTIMIZERS[kind](params, max_cut, max_chip_area, thread_angle)
+    proposed = {
+        name: value for name, value in json_data.items()
+        if name not in ("MaxCut", "MaxChipArea", "ThreadAngle", "RPM")
+    }
+    proposed.update(changes)
+    return {
+        "status": "OK",
+        "params": proposed,
+        "changes": changes,
+        "current": cycle_schedule(kind, params, max_cut, max_chip_area, thread_angle, rpm),
+        "proposed": cycle_schedule(
+            kind, dict(params, **changes), max_cut, max_chip_area, thread_angle, rpm
+        ),
+    }
+
+
+def cycle_backplot(kind, json_data):
+    """Backplot of a canned cycle built straight from its parameters, in
+    the structure the display server's /linuxcnc/backplot returns"""
+    import lathe_cycles
+
+    tolerance = float(json_data.get("tolerance", 0.0))
+    if not tolerance >= 0:
+        raise ValueError("tolerance must be a non-negative number")
+    spec, _ = lathe_cycles.CYCLE_PREVIEWS[kind]
+    values = lathe_cycles.normalize_cycle_params(spec, json_data)
+    root_data = dict(cycle_preview_backplot(kind, values, tolerance + 0))
+    root_data["status"] = "OK"
+    root_data["gcode"] = cycle_preview_program(kind, values).lines
+    return root_data
+
+
+@app.put("/hal/turning/backplot")
+def backplot_turning():
     json_data = request.json
     
     if not json_data:
         return {"status": "Error", "message": "Missing turning parameters"}, 400
 
-    c.state(linuxcnc.STATE_ON)
-    c.wait_complete()
-
     try:
-        s = linuxcnc.stat()
-        while True:
-            s.poll()
-            if s.estop:
-                return {"status": "Error", "message": "Machine is in ESTOP state"}, 400
-            if not s.enabled:
-                return {"status": "Error", "message": "Machine is not enabled"}, 400
-            if not s.homed:
-                return {"status": "Error", "message": "Machine is not homed"}, 400
-            if s.interp_state != linuxcnc.INTERP_IDLE:
-                return {"status": "Error", "message": "Interpreter is not idle"}, 400
-            if s.task_mode != linuxcnc.MODE_MDI:
-                c.mode(linuxcnc.MODE_MDI)
-                time.sleep(0.1)
-                continue
-            break
-        c.wait_complete()
-
-        gcode_lines = generate_turning_gcode_core(json_data, for_backplot=False)
-        
-        ngc_filename = "canned-cycle.ngc"
-        ngc_path = os.path.join(os.getcwd(), ngc_filename)
-        
-        with open(ngc_path, 'w') as f:
-            f.write("o<canned-cycle> sub\n")
-            for line in gcode_lines:
-                f.write(f"{line}\n")
-            f.write("o<canned-cycle> endsub\n")
-        
-        c.mdi("o<canned-cycle> call")
+        return cycle_backplot("turning", json_data)
         
+    except (KeyError, TypeError, ValueError) as e:
+        return {"status": "Error", "message": f"Invalid turning parameters: {str(e)}"}, 400
+    except Exception as e:
+        error_msg = f"Error generating turning backplot: {str(e)}"
+        return {"status": "Error", "message": error_msg}, 500
+
+
+class CycleProgramStore:
+    """Canned cycle subroutine files named after a hash of their G-code.
+
+    Saving a program that is already stored only marks it as recently used.
+    New files are written to a temporary name and renamed into place, and
+    the least recently used are removed beyond size files."""
+
+    def __init__(self, directory, size):
+        self.directory = directory
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.writes = 0
+        os.makedirs(directory, exist_ok=True)
+        # Adopt the files of earlier runs, oldest first
+        stored = []
+        for filename in os.listdir(directory):
+            if filename.startswith(CYCLE_PROGRAM_PREFIX) and filename.endswith(".ngc"):
+                path = os.path.join(directory, filename)
+                stored.append((os.path.getmtime(path), filename[:-4]))
+        for _, name in sorted(stored):
+            self.entries[name] = True
+
+    def path(self, name):
+        return os.path.join(self.directory, f"{name}.ngc")
+
+    def save(self, lines):
+        """Store the program lines as a subroutine and return its name"""
+        body = "".join(f"{line}\n" for line in lines)
+        name = CYCLE_PROGRAM_PREFIX + hashlib.sha256(body.encode()).hexdigest()[:16]
+        with self.lock:
+            if name in self.entries:
+                self.entries.move_to_end(name)
+                self.hits += 1
+                return name
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    f.write(f"o<{name}> sub\n{body}o<{name}> endsub\n")
+                os.replace(tmp_path, self.path(name))
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+            self.entries[name] = True
+            self.writes += 1
+            while len(self.entries) > self.size:
+                evicted, _ = self.entries.popitem(last=False)
+                try:
+                    os.remove(self.path(evicted))
+                except OSError:
+                    pass
+        return name
+
+    def clear(self, keep=None):
+        """Remove every stored subroutine except keep, return the file names"""
+        removed = []
+        with self.lock:
+            for name in list(self.entries):
+                if name == keep:
+                    continue
+                del self.entries[name]
+                try:
+                    os.remove(self.path(name))
+                    removed.append(f"{name}.ngc")
+                except OSError:
+                    pass
+        return removed
+
+
+cycle_program_store = CycleProgramStore(CYCLE_PROGRAM_DIR, CYCLE_PROGRAM_STORE_SIZE)
+
+
+class CycleJob:
+    """A canned cycle run and its progress through the generated program,
+    called with the (x, z) start position. motion_times are the estimated
+    seconds of each of the program's moves."""
+
+    def __init__(self, kind, program, subroutine, position, motion_times):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.program = program
+        self.subroutine = subroutine
+        self.position = position
+        self.pass_lines = [line for line, _ in program.passes]
+        # Estimated seconds from each move to the end of the program
+        self.remaining_times = list(itertools.accumulate(reversed(motion_times), initial=0.0))[::-1]
+        self.state = "starting"
+        self.code = None
+        self.message = None
+        self.started = None
+        self.finished = None
+        self.line = 0
+
+    def finish(self, state, code=None, message=None):
+        if self.state in CYCLE_JOB_STATES_FINISHED:
+            return
+        self.state = state
+        self.code = code
+        self.message = message
+        self.finished = time.monotonic()
+
+    def update(self, motion_line):
+        # CycleProgramStore files start with the "o<canned-cycle-<hash>> sub"
+        # line, so program line n is line n + 1 of the file
+        self.line = max(0, min(motion_line - 1, len(self.program.lines)))
+
+    def status(self):
+        now = time.monotonic()
+        elapsed = 0.0
+        if self.started is not None:
+            elapsed = (self.finished or now) - self.started
+
+        current_pass = None
+        index = bisect.bisect_right(self.pass_lines, self.line)
+        if index > 0:
+            current_pass = {
+                "number": index,
+                "count": len(self.pass_lines),
+                "label": self.program.passes[index - 1][1],
+            }
+
+        motion_lines = self.program.motion_lines
+        progress = bisect.bisect_right(motion_lines, self.line) / len(motion_lines) if motion_lines else 0.0
+        if self.state == "done":
+            progress = 1.0
+        remaining = None
+        if self.state in ("starting", "running"):
+            remaining = self.remaining_times[bisect.bisect_left(motion_lines, self.line)]
+
+        line = None
+        if self.line > 0:
+            line = {"number": self.line, "text": self.program.lines[self.line - 1]}
+
         return {
-            "status": "OK", 
-            "message": "Turning cycle started",
-            "gcode": gcode_lines,
-            "subroutine_file": ngc_filename
+            "id": self.id,
+            "kind": self.kind,
+            "subroutine": self.subroutine,
+            "state": self.state,
+            "code": self.code,
+            "message": self.message,
+            "pass": current_pass,
+            "line": line,
+            "progress": progress,
+            "elapsed": elapsed,
+            "remaining": remaining,
         }
-        
+
+
+class CycleJobs:
+    """Recent canned cycle jobs, at most one of them active"""
+
+    def __init__(self, history):
+        self.history = history
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict()
+        self.active = None
+
+    def running(self):
+        """The active job until it finishes, else None"""
+        job = self.active
+        if job is not None and job.state not in CYCLE_JOB_STATES_FINISHED:
+            return job
+        return None
+
+    def check_idle(self):
+        if self.running() is not None:
+            raise MachineStateError("cycle_running", "A canned cycle is already running", 409)
+
+    def start(self, kind, program, subroutine, position, motion_times):
+        with self.lock:
+            self.check_idle()
+            job = CycleJob(kind, program, subroutine, position, motion_times)
+            self.jobs[job.id] = job
+            while len(self.jobs) > self.history:
+                self.jobs.popitem(last=False)
+            self.active = job
+        threading.Thread(target=run_cycle_job, args=(job,), name=f"cycle-{job.id}", daemon=True).start()
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self.lock:
+            return list(self.jobs.values())
+
+    def abort_active(self, message):
+        with self.lock:
+            if self.active is not None:
+                self.active.finish("aborted", "aborted", message)
+
+
+cycle_jobs = CycleJobs(CYCLE_JOB_HISTORY)
+
+
+def run_cycle_job(job):
+    try:
+        run_command("state", linuxcnc.STATE_ON)
+        require_mdi_ready()
+
+        # Under the lock an abort lands either before the call, which is then
+        # never issued, or after the job is marked running
+        with cycle_jobs.lock:
+            if job.state != "starting":
+                return
+            x, z = job.position
+            c.mdi(f"o<{job.subroutine}> call [{x:.6f}] [{z:.6f}]")
+            job.started = time.monotonic()
+            job.state = "running"
+
+        s = stat_sampler.wait_for(lambda s: s.program_running or s.error_state, CYCLE_JOB_START_TIMEOUT)
+        if s is None:
+            job.finish("failed", "start_timeout", "Canned cycle did not start")
+            return
+        while job.state == "running":
+            job.update(s.motion_line)
+            if s.error_state:
+                job.finish("failed", "machine_error", "Machine error during canned cycle")
+            elif not s.program_running:
+                job.finish("done")
+            else:
+                motion_line = s.motion_line
+                s = stat_sampler.wait_for(
+                    lambda s: s.motion_line != motion_line or not s.program_running or s.error_state,
+                    CYCLE_JOB_POLL_INTERVAL,
+                ) or stat_sampler.snapshot()
+    except MachineStateError as e:
+        job.finish("failed", e.code, str(e))
+    except Exception as e:
+        job.finish("failed", "error", f"Error executing {job.kind} subroutine: {str(e)}")
+
+
+def start_cycle_job(kind, json_data):
+    import lathe_cycles
+
+    try:
+        spec, _ = lathe_cycles.CYCLE_PREVIEWS[kind]
+        program = cycle_execute_program(kind, lathe_cycles.normalize_cycle_params(spec, json_data))
+        start = lathe_cycles.normalize_cycle_params(CYCLE_POSITION_PARAMS, json_data)
+        rpm, _ = cycle_spindle_rpm(program)
+        motion_times = [
+            seconds for _, seconds in lathe_cycles.cycle_motion_times(
+                program, rpm / 60.0, AXIS_LIMITS, TRAJECTORY_MAX_VELOCITY, start
+            )
+        ]
+        cycle_jobs.check_idle()
+        subroutine = cycle_program_store.save(program.lines)
+        job = cycle_jobs.start(kind, program, subroutine, start, motion_times)
+    except (KeyError, TypeError, ValueError) as e:
+        return {"status": "Error", "message": f"Invalid {kind} parameters: {str(e)}"}, 400
+    except MachineStateError as e:
+        return e.response()
+
+    return {
+        "status": "OK",
+        "message": f"{kind.capitalize()} cycle starting",
+        "job_id": job.id,
+        "cycle_time": lathe_cycles.estimate_cycle_time(
+            program, rpm, AXIS_LIMITS, TRAJECTORY_MAX_VELOCITY, start
+        )["total"],
+        "gcode": program.lines,
+        "subroutine_file": os.path.relpath(cycle_program_store.path(subroutine))
+    }, 202
+
+
+@app.get("/hal/jobs")
+def list_cycle_jobs():
+    return {"status": "OK", "jobs": [job.status() for job in cycle_jobs.list()]}
+
+
+@app.get("/hal/jobs/<job_id>")
+def read_cycle_job(job_id):
+    job = cycle_jobs.get(job_id)
+    if job is None:
+        return {"status": "Error", "message": "Unknown job"}, 404
+    return {"status": "OK", "job": job.status()}
+
+
+@app.get("/hal/jobs/<job_id>/stream")
+def stream_cycle_job(job_id):
+    """Server-Sent Events stream of a job's progress, ending when it finishes"""
+    job = cycle_jobs.get(job_id)
+    if job is None:
+        return {"status": "Error", "message": "Unknown job"}, 404
+
+    def generate():
+        last_status = None
+        last_sent = 0.0
+        while True:
+            status = job.status()
+            now = time.monotonic()
+            # Elapsed and remaining time change constantly, only pass, line
+            # and state changes are pushed straight away
+            changed = last_status is None or any(
+                status[key] != last_status[key] for key in ("state", "pass", "line")
+            )
+            if changed or now - last_sent >= STREAM_KEEPALIVE_INTERVAL:
+                yield f"data: {json.dumps(status, separators=(',', ':'))}\n\n"
+                last_status = status
+                last_sent = now
+            if status["state"] in CYCLE_JOB_STATES_FINISHED:
+                return
+            time.sleep(CYCLE_JOB_POLL_INTERVAL)
+
+    return event_stream_response(generate)
+
+
+@app.put("/hal/turning/batch")
+def batch_turning():
+    """Pass lists and summary statistics for a list of turning parameter sets"""
+    try:
+        return cycle_batch("turning", request.json)
+
+    except ValueError as e:
+        return {"status": "Error", "message": f"Invalid turning batch: {str(e)}"}, 400
+    except Exception as e:
+        error_msg = f"Error planning turning batch: {str(e)}"
+        return {"status": "Error", "message": error_msg}, 500
+
+
+@app.put("/hal/turning/estimate")
+def estimate_turning():
+    """Estimated turning cycle time, in total, by kind of move and per pass"""
+    json_data = request.json
+
+    if not json_data or not isinstance(json_data, dict):
+        return {"status": "Error", "message": "Missing turning parameters"}, 400
+
+    try:
+        return cycle_estimate("turning", json_data)
+
+    except (KeyError, TypeError, ValueError) as e:
+        return {"status": "Error", "message": f"Invalid turning parameters: {str(e)}"}, 400
     except Exception as e:
-        error_msg = f"Error executing turning subroutine: {str(e)}"
+        error_msg = f"Error estimating turning cycle time: {str(e)}"
         return {"status": "Error", "message": error_msg}, 500
 
 
+@app.put("/hal/turning/optimize")
+def optimize_turning():
+    """Turning parameters giving the fewest passes within MaxCut and/or MaxChipArea"""
+    json_data = request.json
+
+    if not json_data or not isinstance(json_data, dict):
+        return {"status": "Error", "message": "Missing turning parameters"}, 400
+
+    try:
+        return cycle_optimize("turning", json_data)
+
+    except (KeyError, TypeError, ValueError) as e:
+        return {"status": "Error", "message": f"Invalid turning parameters: {str(e)}"}, 400
+    except Exception as e:
+        error_msg = f"Error optimizing turning passes: {str(e)}"
+        return {"status": "Error", "message": error_msg}, 500
+
+
+@app.put("/hal/turning")
+def execute_turning():
+    """Start the turning cycle as a background job, see /hal/jobs"""
+    json_data = request.json
+    
+    if not json_data:
+        return {"status": "Error", "message": "Missing turning parameters"}, 400
+
+    return start_cycle_job("turning", json_data)
+
+
 @app.put("/hal/threading/generate")
 def generate_threading():
     json_data = request.json
@@ -437,87 +1580,111 @@ def generate_threading():
         return {"status": "Error", "message": "Missing threading parameters"}, 400
 
     try:
-        gcode_lines = generate_threading_gcode_core(json_data, for_backplot=True)
+        gcode_lines = cycle_preview_gcode("threading", json_data)
         return {
             "status": "OK", 
             "message": "Threading G-code generated",
             "gcode": gcode_lines
         }
         
+    except (KeyError, TypeError, ValueError) as e:
+        return {"status": "Error", "message": f"Invalid threading parameters: {str(e)}"}, 400
     except Exception as e:
         error_msg = f"Error generating threading G-code: {str(e)}"
         return {"status": "Error", "message": error_msg}, 500
 
 
-@app.put("/hal/threading")
-def execute_threading():
+@app.put("/hal/threading/backplot")
+def backplot_threading():
     json_data = request.json
     
     if not json_data:
         return {"status": "Error", "message": "Missing threading parameters"}, 400
 
-    c.state(linuxcnc.STATE_ON)
-    c.wait_complete()
-
     try:
-        s = linuxcnc.stat()
-        while True:
-            s.poll()
-            if s.estop:
-                return {"status": "Error", "message": "Machine is in ESTOP state"}, 400
-            if not s.enabled:
-                return {"status": "Error", "message": "Machine is not enabled"}, 400
-            if not s.homed:
-                return {"status": "Error", "message": "Machine is not homed"}, 400
-            if s.interp_state != linuxcnc.INTERP_IDLE:
-                return {"status": "Error", "message": "Interpreter is not idle"}, 400
-            if s.task_mode != linuxcnc.MODE_MDI:
-                c.mode(linuxcnc.MODE_MDI)
-                time.sleep(0.1)
-                continue
-            break
-        c.wait_complete()
-
-        gcode_lines = generate_threading_gcode_core(json_data, for_backplot=False)
-        
-        ngc_filename = "canned-cycle.ngc"
-        ngc_path = os.path.join(os.getcwd(), ngc_filename)
-        
-        with open(ngc_path, 'w') as f:
-            f.write("o<canned-cycle> sub\n")
-            for line in gcode_lines:
-                f.write(f"{line}\n")
-            f.write("o<canned-cycle> endsub\n")
-        
-        c.mdi("o<canned-cycle> call")
-        
-        return {
-            "status": "OK", 
-            "message": "Canned cycle started",
-            "gcode": gcode_lines,
-            "subroutine_file": ngc_filename
-        }
+        return cycle_backplot("threading", json_data)
         
+    except (KeyError, TypeError, ValueError) as e:
+        return {"status": "Error", "message": f"Invalid threading parameters: {str(e)}"}, 400
+    except Exception as e:
+        error_msg = f"Error generating threading backplot: {str(e)}"
+        return {"status": "Error", "message": error_msg}, 500
+
+
+@app.put("/hal/threading/batch")
+def batch_threading():
+    """Pass lists and summary statistics for a list of threading parameter sets"""
+    try:
+        return cycle_batch("threading", request.json)
+
+    except ValueError as e:
+        return {"status": "Error", "message": f"Invalid threading batch: {str(e)}"}, 400
+    except Exception as e:
+        error_msg = f"Error planning threading batch: {str(e)}"
+        return {"status": "Error", "message": error_msg}, 500
+
+
+@app.put("/hal/threading/estimate")
+def estimate_threading():
+    """Estimated threading cycle time, in total, by kind of move and per pass"""
+    json_data = request.json
+
+    if not json_data or not isinstance(json_data, dict):
+        return {"status": "Error", "message": "Missing threading parameters"}, 400
+
+    try:
+        return cycle_estimate("threading", json_data)
+
+    except (KeyError, TypeError, ValueError) as e:
+        return {"status": "Error", "message": f"Invalid threading parameters: {str(e)}"}, 400
+    except Exception as e:
+        error_msg = f"Error estimating threading cycle time: {str(e)}"
+        return {"status": "Error", "message": error_msg}, 500
+
+
+@app.put("/hal/threading/optimize")
+def optimize_threading():
+    """Threading parameters giving the fewest passes within MaxCut and/or MaxChipArea"""
+    json_data = request.json
+
+    if not json_data or not isinstance(json_data, dict):
+        return {"status": "Error", "message": "Missing threading parameters"}, 400
+
+    try:
+        return cycle_optimize("threading", json_data)
+
+    except (KeyError, TypeError, ValueError) as e:
+        return {"status": "Error", "message": f"Invalid threading parameters: {str(e)}"}, 400
     except Exception as e:
-        error_msg = f"Error executing threading subroutine: {str(e)}"
+        error_msg = f"Error optimizing threading passes: {str(e)}"
         return {"status": "Error", "message": error_msg}, 500
 
 
+@app.put("/hal/threading")
+def execute_threading():
+    """Start the threading cycle as a background job, see /hal/jobs"""
+    json_data = request.json
+    
+    if not json_data:
+        return {"status": "Error", "message": "Missing threading parameters"}, 400
+
+    return start_cycle_job("threading", json_data)
+
+
 
 @app.put("/hal/cleanup")
 def cleanup_canned_cycle_files():
-    """Clean up temporary canned cycle .ngc files"""
-    import os
-    
+    """Remove stored canned cycle subroutines, except the running one"""
     try:
-        files_removed = []
-        ngc_path = os.path.join(os.getcwd(), "canned-cycle.ngc")
-        
-        if os.path.exists(ngc_path):
+        running = cycle_jobs.running()
+        files_removed = cycle_program_store.clear(keep=running.subroutine if running else None)
+
+        legacy_path = os.path.join(os.getcwd(), CYCLE_LEGACY_SUBROUTINE_FILE)
+        if os.path.exists(legacy_path):
             try:
-                os.remove(ngc_path)
-                files_removed.append("canned-cycle.ngc")
-            except OSError as e:
+                os.remove(legacy_path)
+                files_removed.append(CYCLE_LEGACY_SUBROUTINE_FILE)
+            except OSError:
                 pass
         
         message = f"Cleaned up {len(files_removed)} canned cycle files"
@@ -535,98 +1702,177 @@ def cleanup_canned_cycle_files():
         return {"status": "Error", "message": error_msg}, 500
 
 
-@app.put("/hal/hal_out")
-def write_hal_out():
+def apply_hal_out(json):
     global reset_z, reset_x
-    json = request.json
+
+    # Leaving velocity control must re-latch the offsets where the jog
+    # left the carriage, or position control drives it back
+    stopping = "control_stop_now" in json or any(
+        key in json and not json[key] and hal_writer.current(key)
+        for key in ("control_z_type", "control_x_type")
+    )
 
     if "control_stop_now" in json:
-        hal_pin_velocity_z_cmd.set(0)
-        hal_pin_velocity_x_cmd.set(0)
-        hal_pin_control_z_type.set(0)
-        hal_pin_control_x_type.set(0)
+        jog_ramp.stop_now()
+        hal_writer.update("velocity_z_cmd", 0)
+        hal_writer.update("velocity_x_cmd", 0)
+        hal_writer.update("control_z_type", 0)
+        hal_writer.update("control_x_type", 0)
 
     if "reset_position" in json:
         reset_z = reset_z + 1
-        hal_pin_reset_z.set(reset_z)
+        hal_writer.update("reset_z", reset_z)
         reset_x = reset_x + 1
-        hal_pin_reset_x.set(reset_x)
-        c.mode(linuxcnc.MODE_MDI)
-        c.wait_complete()
-        s = linuxcnc.stat()
-        while True:
-            s.poll()
-            if s.estop:
-                return {"status": "Error", "message": "Machine is in ESTOP state"}, 400
-            if not s.enabled:
-                return {"status": "Error", "message": "Machine is not enabled"}, 400
-            if not s.homed:
-                return {"status": "Error", "message": "Machine is not homed"}, 400
-            if s.interp_state != linuxcnc.INTERP_IDLE:
-                return {"status": "Error", "message": "Interpreter is not idle"}, 400
-            if s.task_mode != linuxcnc.MODE_MDI:
-                c.mode(linuxcnc.MODE_MDI)
-                time.sleep(0.1)
-                continue
-            break
-        c.state(linuxcnc.STATE_OFF)
-        c.wait_complete()
-        c.state(linuxcnc.STATE_ON)
-        c.wait_complete()
-        c.reset_interpreter()
-        c.wait_complete()
-
-    # Set encoder scale factors from frontend settings or use defaults
-    hal_pin_scale_encoder_z.set(json.get("encoder_scale_z", 0.001))
-    hal_pin_scale_encoder_x.set(json.get("encoder_scale_x", -0.001))
-
-    hal_pin_offset_z_encoder.set(-hal_pin_position_a.get())
-    hal_pin_offset_z_stepper.set(+hal_pin_position_z_encoder.get())
-    hal_pin_offset_x_encoder.set(-hal_pin_position_a.get())
-    hal_pin_offset_x_stepper.set(+hal_pin_position_x_encoder.get())
-
-    if "control_z_type" in json:
-        hal_pin_control_z_type.set(json["control_z_type"])
-    if "control_x_type" in json:
-        hal_pin_control_x_type.set(json["control_x_type"])
-    if "velocity_z_cmd" in json:
-        hal_pin_velocity_z_cmd.set(json["velocity_z_cmd"])
-    if "velocity_x_cmd" in json:
-        hal_pin_velocity_x_cmd.set(json["velocity_x_cmd"])
-
-    if "control_source" in json:
-        hal_pin_control_source.set(json["control_source"])
-    if "enable_stepper_z" in json:
-        hal_pin_enable_stepper_z.set(json["enable_stepper_z"])
-    if "enable_stepper_x" in json:
-        hal_pin_enable_stepper_x.set(json["enable_stepper_x"])
-
-    if "forward_z" in json:
-        hal_pin_forward_z.set(json["forward_z"])
-    if "enable_z" in json:
-        hal_pin_enable_z.set(json["enable_z"])
-    if "forward_x" in json:
-        hal_pin_forward_x.set(json["forward_x"])
-    if "enable_x" in json:
-        hal_pin_enable_x.set(json["enable_x"])
-
-    hal_pin_machine_is_on.set(True)
+        hal_writer.update("reset_x", reset_x)
+        hal_writer.flush()
+        try:
+            require_mdi_ready()
+            run_command("state", linuxcnc.STATE_OFF)
+            run_command("state", linuxcnc.STATE_ON)
+            run_command("reset_interpreter")
+        except MachineStateError as e:
+            return e.response()
+
+    # Jog updates that stay in velocity control leave the offsets latched,
+    # anything else re-latches them at the current position
+    if stopping or not set(json) <= HAL_OUT_JOG_KEYS:
+        latch_offsets(JOG_AXES)
+
+    for key in HAL_OUT_COMMAND_KEYS:
+        if key in json:
+            hal_writer.update(HAL_OUT_COMMAND_KEYS[key], json[key])
 
+    hal_writer.update("machine_is_on", True)
+    return None
+
+
+@app.put("/hal/hal_out")
+def write_hal_out():
+    """Apply one hal_out command, or a list of them in order.
+
+    Pin updates are coalesced so only the latest value per pin is written,
+    and only when it differs from what was last written."""
+    json = request.json
+
+    if json is None:
+        return {"status": "Error", "message": "Missing hal_out command"}, 400
+
+    commands = json if isinstance(json, list) else [json]
+    # Checked up front so a bad list applies none of its commands
+    if not all(isinstance(command, dict) for command in commands):
+        return {"status": "Error", "message": "Invalid hal_out command"}, 400
+    try:
+        for command in commands:
+            error = apply_hal_out(command)
+            if error:
+                return error
+    finally:
+        hal_writer.flush()
+
+    return {"status": "OK"}
+
+def parse_jog(json):
+    axis = json["axis"]
+    if axis not in JOG_AXES:
+        raise ValueError(f"Unknown jog axis {axis}")
+    direction = int(json["direction"])
+    if direction not in (-1, 1):
+        raise ValueError("direction must be -1 or 1")
+    velocity = float(json["velocity"])
+    acceleration = float(json["acceleration"])
+    if not (velocity > 0 and acceleration > 0 and math.isfinite(velocity + acceleration)):
+        raise ValueError("velocity and acceleration must be positive")
+    return axis, direction, velocity, acceleration
+
+
+@app.put("/hal/jog")
+def write_jog():
+    """Start or renew one jog, or a list of them.
+
+    Each is {"axis": "x"|"z", "direction": -1|1, "velocity", "acceleration"}.
+    The server ramps the axis' velocity_*_cmd pin to direction * velocity and
+    holds it there until /hal/jog/stop, or until no jog request has arrived
+    for JOG_DEADMAN_TIMEOUT seconds, so held jogs must be renewed."""
+    json = request.json
+
+    if json is None:
+        return {"status": "Error", "message": "Missing jog command"}, 400
+
+    try:
+        jogs = [parse_jog(jog) for jog in (json if isinstance(json, list) else [json])]
+    except (KeyError, TypeError, ValueError) as e:
+        return {"status": "Error", "message": f"Invalid jog command: {str(e)}"}, 400
+
+    result = {}
+    for axis, direction, velocity, acceleration in jogs:
+        velocity, acceleration = jog_ramp.jog(axis, direction, velocity, acceleration)
+        result[axis] = {"velocity": velocity, "acceleration": acceleration}
+    return {"status": "OK", "jog": result, "timeout": JOG_DEADMAN_TIMEOUT}
+
+
+@app.put("/hal/jog/stop")
+def write_jog_stop():
+    """Decelerate the given axis, or all axes, to a stop"""
+    json = request.get_json(silent=True) or {}
+    if not isinstance(json, dict):
+        return {"status": "Error", "message": "Invalid jog stop command"}, 400
+    axis = json.get("axis")
+    if axis is not None and axis not in JOG_AXES:
+        return {"status": "Error", "message": f"Unknown jog axis {axis}"}, 400
+    jog_ramp.stop([axis] if axis else JOG_AXES)
     return {"status": "OK"}
 
+
+def wait_for_pin_links(pins, timeout):
+    """Wait until each of our output pins drives a signal, returning whether
+    that happened within timeout. Returns None, after HAL_LINK_FALLBACK_DELAY,
+    when this HAL cannot list its signals and the links were not checked."""
+    if not hasattr(hal, "get_info_signals"):
+        time.sleep(HAL_LINK_FALLBACK_DELAY)
+        return None
+    names = [f"lathe.{pin}" for pin in pins]
+    deadline = time.monotonic() + timeout
+    while True:
+        drivers = {signal["DRIVER"] for signal in hal.get_info_signals()}
+        if all(name in drivers for name in names):
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(HAL_LINK_POLL_INTERVAL)
+
+
 halc.ready()
 haluic.ready()
+metrics.startupStage("hal_ready")
+
+# Encoder scale defaults until the frontend sends its settings
+hal_writer.update("scale_encoder_z", 0.001)
+hal_writer.update("scale_encoder_x", -0.001)
+hal_writer.update("reset_z", reset_z)
+hal_writer.update("reset_x", reset_x)
+hal_writer.flush()
 
-hal_pin_reset_z.set(reset_z)
-hal_pin_reset_x.set(reset_x)
+stat_sampler.start()
+history_recorder.start()
+spindle_estimator.start()
+jog_ramp.start()
+telemetry_hub.start()
 
-time.sleep(0.500)
+pins_linked = wait_for_pin_links(HAL_LINK_PINS, HAL_LINK_TIMEOUT)
+if pins_linked:
+    metrics.startupStage("pins_linked")
+elif pins_linked is None:
+    metrics.startupStage("pins_unchecked")
+else:
+    print(f"lathe pins {', '.join(HAL_LINK_PINS)} not linked after {HAL_LINK_TIMEOUT}s")
 
 reset_z = reset_z + 1
-hal_pin_reset_z.set(reset_z)
+hal_writer.update("reset_z", reset_z)
 reset_x = reset_x + 1
-hal_pin_reset_x.set(reset_x)
+hal_writer.update("reset_x", reset_x)
+hal_writer.flush()
 
+metrics.startupStage("ready")
 print("{REST_API_READY}")
 
 sys.stdout.flush()
@@ -634,4 +1880,4 @@ sys.stdout.flush()
 if __name__ == "__main__":
     from waitress import serve
 
-    serve(app, host="0.0.0.0", port=8000)
+    serve(app, host="0.0.0.0", port=8000, threads=HAL_SERVER_THREADS)
@@ -0,0 +1,273 @@
+"""rs274 interpreter side of the display server's backplots.
+
+Kept out of lathe_display so that the server answers requests before the
+interpreter modules are loaded. They are imported on first use, in each
+backplot worker process or, without workers, in the server itself.
+"""
+import os
+import json
+import tempfile
+import threading
+import time
+
+import numpy as np
+import linuxcnc
+import gcode
+import rs274.glcanon
+import rs274.interpret
+
+from lathe_backplot import (
+    fileMtime,
+    sortByLine,
+    ndjsonFrame,
+    rawGroups,
+    normalizeMoves,
+    moveGroups,
+    backplotBinary,
+)
+
+
+class NullProgress:
+    def nextphase(self, var1):
+        pass
+
+    def progress(self):
+        pass
+
+    def update(self, lineno):
+        pass
+
+
+class StreamProgress(NullProgress):
+    """Calls flush at most once per interval as interpretation advances"""
+
+    def __init__(self, flush, interval):
+        self.flush = flush
+        self.interval = interval
+        self.last_flush = time.monotonic()
+
+    def update(self, lineno):
+        now = time.monotonic()
+        if now - self.last_flush >= self.interval:
+            self.last_flush = now
+            self.flush()
+
+
+class StatCanon(rs274.glcanon.GLCanon, rs274.interpret.StatMixin):
+    def __init__(
+        self, colors, geometry, is_foam, lathe_view_option, stat, random, arcdivision
+    ):
+        rs274.glcanon.GLCanon.__init__(self, colors, geometry)
+        rs274.interpret.StatMixin.__init__(self, stat, random)
+        self.progress = NullProgress()
+        self.lathe_view_option = lathe_view_option
+        self.arcdivision = arcdivision
+        self.is_foam = is_foam
+
+    def is_lathe(self):
+        return self.lathe_view_option
+
+    def next_line(self, st):
+        rs274.glcanon.GLCanon.next_line(self, st)
+        # Everything recorded so far belongs to lines that are complete
+        self.progress.update(self.lineno)
+
+
+class BackplotGenerator(rs274.glcanon.GlCanonDraw):
+    """Long-lived backplot generator.
+
+    The ini is parsed and the parameter file read once, and again only when
+    either changes on disk. Previews run in one reusable scratch directory,
+    so callers must hold self.lock from load() until the result is emitted."""
+
+    def __init__(self, inifile, scratch_dir=None):
+        self.inifile_name = inifile
+        self.inifile_path = os.path.split(inifile)[0]
+        self.select_primed = None
+        self.lock = threading.Lock()
+        self.scratch_dir = scratch_dir or tempfile.mkdtemp(prefix="elle-backplot-")
+        rs274.glcanon.GlCanonDraw.__init__(self, linuxcnc.stat(), None)
+        self.configure()
+
+    def configure(self):
+        self.ini_mtime = fileMtime(self.inifile_name)
+        self.inifile = linuxcnc.ini(self.inifile_name)
+        live_axis_count = 0
+        for i, j in enumerate("XYZABCUVW"):
+            if self.stat.axis_mask & (1 << i) == 0:
+                continue
+            live_axis_count += 1
+        self.num_joints = int(self.inifile.find("KINS", "JOINTS") or live_axis_count)
+        self.foam_option = bool(self.inifile.find("DISPLAY", "FOAM"))
+        temp = self.inifile.find("DISPLAY", "LATHE")
+        self.lathe_option = bool(temp == "1" or temp == "True" or temp == "true")
+        self.a_axis_wrapped = bool(self.inifile.find("AXIS_A", "WRAPPED_ROTARY"))
+        self.b_axis_wrapped = bool(self.inifile.find("AXIS_B", "WRAPPED_ROTARY"))
+        self.c_axis_wrapped = bool(self.inifile.find("AXIS_C", "WRAPPED_ROTARY"))
+        self.random_toolchanger = int(
+            self.inifile.find("EMCIO", "RANDOM_TOOLCHANGER") or 0
+        )
+        self.arcdivision = int(self.inifile.find("DISPLAY", "ARCDIVISION") or 64)
+        self.geometry = self.inifile.find("DISPLAY", "GEOMETRY") or "XYZ"
+        self.initcode = self.inifile.find("RS274NGC", "RS274NGC_STARTUP_CODE") or ""
+        self.parameter_file = os.path.join(
+            self.inifile_path,
+            os.path.basename(
+                self.inifile.find("RS274NGC", "PARAMETER_FILE") or "linuxcnc.var"
+            ),
+        )
+        self.parameter_mtime = fileMtime(self.parameter_file)
+        self.parameter_data = None
+        if self.parameter_mtime is not None:
+            with open(self.parameter_file, "rb") as f:
+                self.parameter_data = f.read()
+
+    def refresh(self):
+        """Re-read the configuration if the ini or parameter file changed"""
+        if (
+            fileMtime(self.inifile_name) != self.ini_mtime
+            or fileMtime(self.parameter_file) != self.parameter_mtime
+        ):
+            self.configure()
+
+    def loadGcode(self, gcode_bytes, progress=None):
+        file_path = os.path.join(self.scratch_dir, "gcode.ngc")
+        with open(file_path, "w") as file:
+            file.write(gcode_bytes.decode("ascii"))
+        self.load(file_path, progress)
+
+    def streamGcode(self, gcode_bytes, emit, flush_interval):
+        """Interpret gcode_bytes, emitting NDJSON frames at most once per
+        flush_interval as it progresses.
+
+        "moves" frames carry completed line groups in raw machine
+        coordinates. The closing "trailer" frame carries the extents and the
+        transform (including units_scale) needed to normalize them the same
+        way toJson() does."""
+        flushed = {"feed": 0, "arcfeed": 0, "trav": 0}
+
+        def flush():
+            data = []
+            for entry_type, entries in (
+                ("feed", self.canon.feed),
+                ("arcfeed", self.canon.arcfeed),
+                ("trav", self.canon.traverse),
+            ):
+                end = len(entries)
+                data.extend(rawGroups(entry_type, entries, flushed[entry_type], end))
+                flushed[entry_type] = end
+            if data:
+                data.sort(key=sortByLine)
+                emit(ndjsonFrame({"type": "moves", "backplot": data}))
+
+        self.loadGcode(gcode_bytes, StreamProgress(flush, flush_interval))
+        flush()
+        _, extents, transform = self.normalizedMoves()
+        emit(ndjsonFrame({"type": "trailer", "extents": extents, "transform": transform}))
+
+    def load(self, filepath, progress=None):
+        self._current_file = filepath
+        try:
+            self.stat.poll()
+            self.canon = StatCanon(
+                None,
+                self.geometry,
+                self.foam_option,
+                self.lathe_option,
+                self.stat,
+                self.random_toolchanger,
+                self.arcdivision,
+            )
+            if progress is not None:
+                self.canon.progress = progress
+            # The interpreter may rewrite its parameter file, so every preview
+            # starts from the in-memory copy of the original
+            tmp_parameter_file = os.path.join(self.scratch_dir, "backplot.var")
+            if self.parameter_data is not None:
+                with open(tmp_parameter_file, "wb") as f:
+                    f.write(self.parameter_data)
+            elif os.path.exists(tmp_parameter_file):
+                os.remove(tmp_parameter_file)
+            self.canon.parameter_file = tmp_parameter_file
+            result, seq = self.load_preview(filepath, self.canon, "G18 G8 G21 G90", self.initcode)
+            if result > gcode.MIN_ERROR:
+                pass
+        finally:
+            pass
+
+    def moveArrays(self):
+        """Collect feed, arcfeed and traverse moves into contiguous arrays.
+
+        Returns a list of (type, lines, coords, rates, offsets) where lines is
+        an int array, coords an (N, 6) float array of start and end points and
+        rates/offsets plain lists (rates is None for traverses)."""
+        moves = []
+        for entry_type, entries, rate_index in (
+            ("feed", self.canon.feed, 3),
+            ("arcfeed", self.canon.arcfeed, 3),
+            ("trav", self.canon.traverse, None),
+        ):
+            if not (entries and entries[0]):
+                continue
+            lines = np.fromiter(
+                (entry[0] for entry in entries), dtype=np.int64, count=len(entries)
+            )
+            coords = np.array(
+                [
+                    (
+                        entry[1][0],
+                        entry[1][1],
+                        entry[1][2],
+                        entry[2][0],
+                        entry[2][1],
+                        entry[2][2],
+                    )
+                    for entry in entries
+                ],
+                dtype=np.float64,
+            )
+            offset_index = 4 if rate_index is not None else 3
+            rates = None
+            if rate_index is not None:
+                rates = [entry[rate_index] for entry in entries]
+            offsets = [
+                [entry[offset_index][0], entry[offset_index][1], entry[offset_index][2]]
+                for entry in entries
+            ]
+            moves.append((entry_type, lines, coords, rates, offsets))
+        return moves
+
+    def normalizedMoves(self, tolerance=0.0):
+        return normalizeMoves(self.moveArrays(), tolerance)
+
+    def toJson(self, tolerance=0.0):
+        moves, extents, transform = self.normalizedMoves(tolerance)
+
+        data = moveGroups(moves)
+
+        if self.canon.dwells and self.canon.dwells[0]:
+            currentline = self.canon.dwells[0][0]
+            trav = []
+            for entry in self.canon.dwells:
+                if entry[0] != currentline:
+                    data.append({"type": "dwell", "line": currentline, "trav": trav})
+                    trav = []
+                    currentline = entry[0]
+                trav.append(
+                    {"color": [entry[1]], "coord": [entry[0], entry[1], entry[2]]}
+                )
+            data.append({"type": "dwell", "line": currentline, "dwell": trav})
+
+        data.sort(key=sortByLine)
+
+        rootData = {
+            "backplot": data,
+            "extents": extents,
+            "transform": transform
+        }
+        return json.dumps(rootData, separators=(",", ":"))
+
+    def toBinary(self, quantize=False, tolerance=0.0):
+        """Pack the backplot into the binary wire format, see backplotBinary"""
+        moves, extents, transform = self.normalizedMoves(tolerance)
+        return backplotBinary(moves, extents, transform, quantize)
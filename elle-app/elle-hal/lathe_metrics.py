@@ -0,0 +1,280 @@
+"""Request and timing metrics shared by the HAL and display servers.
+
+Both servers expose them at GET /metrics, as Prometheus text by default or
+as JSON with ?format=json (or an Accept: application/json header).
+"""
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+# Histogram upper bounds, seconds for timings and bytes for payloads
+LATENCY_BUCKETS = (
+    0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def processStartTime():
+    """time.monotonic() at which this process started, read from /proc on
+    Linux and otherwise approximated by when this module was imported"""
+    imported = time.monotonic()
+    try:
+        with open("/proc/self/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        started = int(fields[19]) / os.sysconf("SC_CLK_TCK")
+        return imported - (time.clock_gettime(time.CLOCK_BOOTTIME) - started)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return imported
+
+
+PROCESS_STARTED = processStartTime()
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """(upper bound, cumulative count) pairs ending with +Inf"""
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class Metrics:
+    """Thread safe registry of labelled counters, histograms and gauges.
+
+    Metrics are declared once with counter(), histogram() or gauge() and
+    then updated with inc(), observe() or timer(), labels given as keyword
+    arguments."""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.families = {}
+
+    def counter(self, name, help_text):
+        self.families[name] = {"type": "counter", "help": help_text, "values": {}}
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.families[name] = {
+            "type": "histogram", "help": help_text, "buckets": buckets, "values": {}
+        }
+
+    def gauge(self, name, help_text, read=None, metric_type="gauge"):
+        """read() returns the current value, or a {labels tuple: value} dict.
+        Without read, values are assigned with set(). Pass
+        metric_type="counter" for values that only ever increase."""
+        if read is None:
+            self.families[name] = {"type": metric_type, "help": help_text, "values": {}}
+        else:
+            self.families[name] = {"type": metric_type, "help": help_text, "read": read}
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        values = self.families[name]["values"]
+        with self.lock:
+            values[key] = values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.families[name]["values"][key] = value
+
+    def startupStage(self, stage):
+        """Record how long after process start stage was reached"""
+        self.set("startup_seconds", time.monotonic() - PROCESS_STARTED, stage=stage)
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        family = self.families[name]
+        with self.lock:
+            histogram = family["values"].get(key)
+            if histogram is None:
+                histogram = family["values"][key] = Histogram(family["buckets"])
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def collect(self):
+        """(name, family, [(labels, value)]) with histogram values copied"""
+        result = []
+        for name, family in self.families.items():
+            if "read" in family:
+                value = family["read"]()
+                if isinstance(value, dict):
+                    samples = list(value.items())
+                else:
+                    samples = [((), value)]
+            else:
+                with self.lock:
+                    samples = []
+                    for labels, value in family["values"].items():
+                        if isinstance(value, Histogram):
+                            value = (value.cumulative(), value.count, value.sum)
+                        samples.append((labels, value))
+            result.append((f"{self.prefix}_{name}", family, samples))
+        return result
+
+    def toJson(self):
+        data = {}
+        for name, family, samples in self.collect():
+            values = []
+            for labels, value in samples:
+                entry = {"labels": dict(labels)}
+                if family["type"] == "histogram":
+                    buckets, count, total = value
+                    entry["buckets"] = [
+                        ["+Inf" if bound == float("inf") else bound, cumulative]
+                        for bound, cumulative in buckets
+                    ]
+                    entry["count"] = count
+                    entry["sum"] = total
+                else:
+                    entry["value"] = value
+                values.append(entry)
+            data[name] = {"type": family["type"], "help": family["help"], "values": values}
+        return json.dumps(data, separators=(",", ":"))
+
+    def toPrometheus(self):
+        lines = []
+        for name, family, samples in self.collect():
+            lines.append(f"# HELP {name} {family['help']}")
+            lines.append(f"# TYPE {name} {family['type']}")
+            for labels, value in samples:
+                if family["type"] == "histogram":
+                    buckets, count, total = value
+                    for bound, cumulative in buckets:
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        bucket_labels = prometheusLabels(labels + (("le", le),))
+                        lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                    lines.append(f"{name}_count{prometheusLabels(labels)} {count}")
+                    lines.append(f"{name}_sum{prometheusLabels(labels)} {total!r}")
+                else:
+                    lines.append(f"{name}{prometheusLabels(labels)} {value!r}")
+        return "\n".join(lines) + "\n"
+
+
+def prometheusLabels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that records how long responses take to encode"""
+
+    metrics = None
+
+    def dumps(self, obj, **kwargs):
+        started = time.perf_counter()
+        try:
+            return DefaultJSONProvider.dumps(self, obj, **kwargs)
+        finally:
+            self.metrics.observe("json_serialize_seconds", time.perf_counter() - started)
+
+
+class TimedCommand:
+    """linuxcnc.command proxy that times every method call"""
+
+    def __init__(self, command, metrics):
+        self.command = command
+        self.metrics = metrics
+        metrics.histogram("linuxcnc_command_seconds", "Time spent in linuxcnc.command calls")
+
+    def __getattr__(self, name):
+        attribute = getattr(self.command, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            with self.metrics.timer("linuxcnc_command_seconds", command=name):
+                return attribute(*args, **kwargs)
+
+        return call
+
+
+def instrumentApp(app, metrics):
+    """Record per route request counts, latency and payload sizes, time JSON
+    encoding, time the first request and add the GET /metrics route"""
+    metrics.counter("http_requests_total", "Requests by method, route and status")
+    metrics.histogram(
+        "http_request_duration_seconds",
+        "Time until the response is ready, streamed bodies excluded",
+    )
+    metrics.histogram("http_request_size_bytes", "Request body sizes", SIZE_BUCKETS)
+    metrics.histogram(
+        "http_response_size_bytes", "Response body sizes, streamed bodies excluded", SIZE_BUCKETS
+    )
+    metrics.histogram("json_serialize_seconds", "Time spent encoding JSON responses")
+    metrics.gauge("startup_seconds", "Seconds from process start until each startup stage")
+
+    provider = TimedJSONProvider(app)
+    provider.metrics = metrics
+    app.json = provider
+
+    local = threading.local()
+    first_request = threading.Event()
+
+    @app.before_request
+    def start_request_timer():
+        local.started = time.perf_counter()
+        if not first_request.is_set():
+            first_request.set()
+            metrics.startupStage("first_request")
+
+    @app.after_request
+    def record_request(response):
+        elapsed = time.perf_counter() - getattr(local, "started", time.perf_counter())
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        metrics.inc(
+            "http_requests_total", method=request.method, route=route, status=response.status_code
+        )
+        metrics.observe("http_request_duration_seconds", elapsed, method=request.method, route=route)
+        if request.content_length:
+            metrics.observe("http_request_size_bytes", request.content_length, route=route)
+        if not response.is_streamed:
+            metrics.observe("http_response_size_bytes", response.calculate_content_length() or 0, route=route)
+        return response
+
+    @app.get("/metrics")
+    def read_metrics():
+        output_format = request.args.get("format")
+        if output_format is None:
+            best = request.accept_mimetypes.best_match(["text/plain", "application/json"])
+            output_format = "json" if best == "application/json" else "prometheus"
+        if output_format == "json":
+            return Response(metrics.toJson(), mimetype="application/json")
+        if output_format == "prometheus":
+            return Response(metrics.toPrometheus(), content_type=PROMETHEUS_CONTENT_TYPE)
+        return {"status": "Error", "message": f"Unknown metrics format {output_format}"}, 400
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""HAL and backplot servers in one process.
+
+Optional replacement for running lathe_halcomp.py and lathe_display.py
+separately: one interpreter, one set of Flask/numpy imports and one
+LinuxCNC command channel, with port 8000 and 8001 served by the same
+waitress instance. Previews still run in the pre-forked backplot workers.
+
+To use it, load it from lathe.hal instead of lathe_halcomp.py and make it
+the ini DISPLAY instead of lathe_display.py. Started as the DISPLAY
+(LinuxCNC passes -ini) it only keeps that slot occupied.
+"""
+import signal
+import sys
+
+HAL_PORT = 8000
+DISPLAY_PORT = 8001
+
+
+def serve():
+    from waitress import serve
+
+    import lathe_display
+
+    # Fork the interpreter workers before lathe_halcomp starts its threads
+    if lathe_display.BACKPLOT_WORKERS > 0:
+        lathe_display.backplot_pool.start()
+    lathe_display.metrics.startupStage("ready")
+
+    import lathe_halcomp
+
+    apps = {
+        str(HAL_PORT): lathe_halcomp.app,
+        str(DISPLAY_PORT): lathe_display.app,
+    }
+
+    def dispatch(environ, start_response):
+        return apps[environ["SERVER_PORT"]](environ, start_response)
+
+    # The thread counts the two servers use on their own
+    serve(
+        dispatch,
+        listen=f"0.0.0.0:{HAL_PORT} 0.0.0.0:{DISPLAY_PORT}",
+        threads=lathe_halcomp.HAL_SERVER_THREADS + lathe_display.BACKPLOT_QUEUE_SIZE + 4,
+    )
+
+
+if __name__ == "__main__":
+    if "-ini" in sys.argv:
+        while True:
+            signal.pause()
+    serve()